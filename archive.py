@@ -0,0 +1,289 @@
+"""
+日志归档
+
+将 system_logs / channel_invites / promo_logs 中超过保留天数的记录，
+按月份分批搬迁到独立的归档数据库（archives/<库名>_archive_YYYY-MM.db），
+已完整归档的月份可选压缩为 .db.gz。查询接口会依次读取在线库和归档库，
+调用方无需关心记录在哪一层。
+"""
+import gzip
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterator, List, Optional
+
+from models import row_to_dict
+
+logger = logging.getLogger(__name__)
+
+# 可归档的表 -> 时间列（均为 CURRENT_TIMESTAMP 写入的 UTC 时间）
+ARCHIVE_TABLES = {
+    'system_logs': 'created_at',
+    'channel_invites': 'invited_at',
+    'promo_logs': 'sent_at',
+}
+
+# 查询时允许的等值过滤列
+QUERY_FILTERS = {
+    'system_logs': ('log_type', 'user_id', 'order_id'),
+    'channel_invites': ('user_id', 'order_id', 'invite_status'),
+    'promo_logs': ('task_id', 'template_id', 'target_chat', 'status'),
+}
+
+
+def _format_ts(value: datetime) -> str:
+    return value.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _next_month(month: str) -> str:
+    year, mon = int(month[:4]), int(month[5:7])
+    year, mon = (year + 1, 1) if mon == 12 else (year, mon + 1)
+    return f"{year:04d}-{mon:02d}"
+
+
+class LogArchiver:
+    """日志归档引擎"""
+
+    def __init__(self, db, archive_dir: str = 'archives', compress: bool = False,
+                 chunk_size: int = 1000):
+        """
+        Args:
+            db: Database 实例（在线库）
+            archive_dir: 归档文件目录
+            compress: 是否压缩已完整归档的月份
+            chunk_size: 每批搬迁的记录数（每批单独提交）
+        """
+        self.db = db
+        self.archive_dir = archive_dir
+        self.compress = compress
+        self.chunk_size = chunk_size
+        self.prefix = os.path.splitext(os.path.basename(db.db_path))[0] + '_archive_'
+
+    # ========== 归档文件 ==========
+
+    def _archive_path(self, month: str) -> str:
+        return os.path.join(self.archive_dir, f"{self.prefix}{month}.db")
+
+    def list_months(self) -> List[str]:
+        """已有的归档月份（升序）"""
+        if not os.path.isdir(self.archive_dir):
+            return []
+        months = set()
+        for name in os.listdir(self.archive_dir):
+            if not name.startswith(self.prefix):
+                continue
+            rest = name[len(self.prefix):]
+            if rest.endswith('.db') or rest.endswith('.db.gz'):
+                months.add(rest.split('.', 1)[0])
+        return sorted(months)
+
+    def _open_for_write(self, month: str) -> sqlite3.Connection:
+        """打开（必要时解压/创建）某月的归档库"""
+        os.makedirs(self.archive_dir, exist_ok=True)
+        path = self._archive_path(month)
+        gz_path = path + '.gz'
+        if not os.path.exists(path) and os.path.exists(gz_path):
+            # 保留期调整后可能需要向已压缩的月份追加记录
+            with gzip.open(gz_path, 'rb') as src, open(path, 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(gz_path)
+        return sqlite3.connect(path)
+
+    @contextmanager
+    def _open_for_read(self, month: str) -> Iterator[Optional[sqlite3.Connection]]:
+        """只读打开某月的归档库（压缩文件解压到临时文件）"""
+        path = self._archive_path(month)
+        temp_path = None
+        if not os.path.exists(path):
+            if not os.path.exists(path + '.gz'):
+                yield None
+                return
+            fd, temp_path = tempfile.mkstemp(suffix='.db')
+            with gzip.open(path + '.gz', 'rb') as src, os.fdopen(fd, 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+            path = temp_path
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            yield conn
+        finally:
+            conn.close()
+            if temp_path:
+                os.remove(temp_path)
+
+    def _ensure_table(self, archive_conn: sqlite3.Connection, hot_cursor: sqlite3.Cursor, table: str):
+        """在归档库中按在线库的表结构建表"""
+        hot_cursor.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name=?", (table,))
+        create_sql = hot_cursor.fetchone()[0]
+        archive_conn.execute(create_sql.replace('CREATE TABLE', 'CREATE TABLE IF NOT EXISTS', 1))
+        ts_column = ARCHIVE_TABLES[table]
+        archive_conn.execute(
+            f'CREATE INDEX IF NOT EXISTS idx_{table}_{ts_column} ON {table}({ts_column})'
+        )
+
+    def _compress_month(self, month: str):
+        path = self._archive_path(month)
+        if not os.path.exists(path):
+            return
+        with open(path, 'rb') as src, gzip.open(path + '.gz', 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(path)
+        logger.info(f"Compressed archive {path}.gz")
+
+    # ========== 归档 ==========
+
+    def archive(self, retention_days: int, tables: Optional[List[str]] = None) -> Dict[str, int]:
+        """
+        将超过保留天数的记录搬迁到月度归档库
+
+        每批先写入并提交归档库，再从在线库删除（INSERT OR IGNORE 保证中断后重跑不会重复），
+        写队列中只有每批的删除操作，Bot 运行期间也可以执行。
+
+        Args:
+            retention_days: 在线库保留天数
+            tables: 要归档的表，默认全部
+
+        Returns:
+            {表名: 搬迁记录数}
+        """
+        now_utc = datetime.now(timezone.utc).replace(tzinfo=None)
+        cutoff = _format_ts(now_utc - timedelta(days=retention_days))
+        moved = {}
+
+        for table in tables or ARCHIVE_TABLES:
+            ts_column = ARCHIVE_TABLES[table]
+            moved[table] = 0
+
+            while True:
+                count = self._archive_chunk(table, ts_column, cutoff)
+                if not count:
+                    break
+                moved[table] += count
+
+            if moved[table]:
+                logger.info(f"Archived {moved[table]} row(s) from {table} (before {cutoff} UTC)")
+
+        if self.compress:
+            # 只压缩整月都早于截止时间的月份（之后不会再有记录写入）
+            for month in self.list_months():
+                if _next_month(month) + '-01' <= cutoff[:10] and os.path.exists(self._archive_path(month)):
+                    self._compress_month(month)
+
+        return moved
+
+    def _archive_chunk(self, table: str, ts_column: str, cutoff: str) -> int:
+        """
+        搬迁一批记录，返回记录数
+
+        读取和写入归档文件（可能需要解压整个月份）都在写队列之外进行，
+        写队列中只执行删除这一批记录的短事务，不阻塞 Bot 的其他写入。
+        """
+        conn = self.db.get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                SELECT * FROM {table}
+                WHERE {ts_column} < ?
+                ORDER BY {ts_column}, id
+                LIMIT ?
+            """, (cutoff, self.chunk_size))
+            rows = cursor.fetchall()
+            if not rows:
+                return 0
+
+            columns = [desc[0] for desc in cursor.description]
+            ts_index = columns.index(ts_column)
+            by_month: Dict[str, list] = {}
+            for row in rows:
+                by_month.setdefault(str(row[ts_index])[:7], []).append(row)
+
+            placeholders = ','.join('?' * len(columns))
+            for month, month_rows in by_month.items():
+                archive_conn = self._open_for_write(month)
+                try:
+                    self._ensure_table(archive_conn, cursor, table)
+                    archive_conn.executemany(
+                        f"INSERT OR IGNORE INTO {table} ({','.join(columns)}) VALUES ({placeholders})",
+                        month_rows
+                    )
+                    archive_conn.commit()
+                finally:
+                    archive_conn.close()
+        finally:
+            conn.close()
+
+        # 日志记录写入后不再修改，已写入归档库的这批 id 可以直接删除
+        ids = [row[0] for row in rows]
+        self.db.writer.execute(lambda cursor: cursor.execute(
+            f"DELETE FROM {table} WHERE id IN ({','.join('?' * len(ids))})", ids
+        ))
+        return len(rows)
+
+    # ========== 查询 ==========
+
+    def query(self, table: str, since: Optional[datetime] = None, until: Optional[datetime] = None,
+              limit: int = 100, **filters) -> List[Dict[str, Any]]:
+        """
+        查询记录（在线库 + 归档库），按时间倒序
+
+        归档库里的记录都早于在线库，所以先查在线库，不够再从最近的月份往前查，
+        取满 limit 条即停止。
+
+        Args:
+            table: 表名（system_logs / channel_invites / promo_logs）
+            since / until: 时间范围（UTC）
+            limit: 最多返回条数
+            **filters: 等值过滤，如 user_id=123
+        """
+        if table not in ARCHIVE_TABLES:
+            raise ValueError(f"Unsupported table: {table}")
+        unknown = set(filters) - set(QUERY_FILTERS[table])
+        if unknown:
+            raise ValueError(f"Unsupported filter(s) for {table}: {', '.join(sorted(unknown))}")
+
+        ts_column = ARCHIVE_TABLES[table]
+        conditions, params = [], []
+        if since is not None:
+            conditions.append(f"{ts_column} >= ?")
+            params.append(_format_ts(since))
+        if until is not None:
+            conditions.append(f"{ts_column} < ?")
+            params.append(_format_ts(until))
+        for column, value in filters.items():
+            conditions.append(f"{column} = ?")
+            params.append(value)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        sql = f"SELECT * FROM {table} {where} ORDER BY {ts_column} DESC, id DESC LIMIT ?"
+
+        def run(conn: sqlite3.Connection, remaining: int) -> List[Dict[str, Any]]:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(sql, params + [remaining])
+            except sqlite3.OperationalError:
+                # 该月归档库中没有这张表
+                return []
+            return [row_to_dict(cursor, row) for row in cursor.fetchall()]
+
+        conn = self.db.get_connection()
+        try:
+            results = run(conn, limit)
+        finally:
+            conn.close()
+
+        since_month = _format_ts(since)[:7] if since is not None else None
+        until_month = _format_ts(until)[:7] if until is not None else None
+        for month in reversed(self.list_months()):
+            if len(results) >= limit:
+                break
+            if until_month and month > until_month:
+                continue
+            if since_month and month < since_month:
+                break
+            with self._open_for_read(month) as archive_conn:
+                if archive_conn is not None:
+                    results.extend(run(archive_conn, limit - len(results)))
+
+        return results
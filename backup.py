@@ -0,0 +1,147 @@
+"""
+数据库在线备份
+
+使用 SQLite 备份 API 分批复制页面（每批之间短暂休眠，不会长时间阻塞 Bot 写入），
+得到的是一致的快照，不会像直接复制文件那样拷到写了一半的数据。
+每个备份都会做完整性检查并记录 SHA-256 校验值；数据库自上次备份以来没有变化时
+不会生成新文件。
+"""
+import gzip
+import hashlib
+import logging
+import os
+import shutil
+import sqlite3
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+CHECKSUM_SUFFIX = '.sha256'
+
+
+def _file_sha256(path: str, opener=open) -> str:
+    digest = hashlib.sha256()
+    with opener(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _read_checksum(backup_path: str) -> Optional[str]:
+    try:
+        with open(backup_path + CHECKSUM_SUFFIX, encoding='utf-8') as f:
+            return f.read().split()[0]
+    except (OSError, IndexError):
+        return None
+
+
+def list_backups(backup_dir: str, name: str) -> List[str]:
+    """某个数据库的全部备份文件（按时间从旧到新）"""
+    if not os.path.isdir(backup_dir):
+        return []
+    prefix = f"{name}_backup_"
+    files = [
+        os.path.join(backup_dir, f) for f in os.listdir(backup_dir)
+        if f.startswith(prefix) and (f.endswith('.db') or f.endswith('.db.gz'))
+    ]
+    return sorted(files)
+
+
+def verify_backup(backup_path: str) -> bool:
+    """按记录的校验值检查备份文件是否完好"""
+    expected = _read_checksum(backup_path)
+    if expected is None:
+        return False
+    opener = gzip.open if backup_path.endswith('.gz') else open
+    try:
+        return _file_sha256(backup_path, opener) == expected
+    except OSError:
+        return False
+
+
+def backup_database(src_path: str, backup_dir: str, name: Optional[str] = None,
+                    compress: bool = False, keep: int = 7, pages: int = 256,
+                    pause: float = 0.01) -> Dict[str, object]:
+    """
+    在线备份一个 SQLite 数据库
+
+    Args:
+        src_path: 数据库文件
+        backup_dir: 备份目录
+        name: 备份文件名前缀，默认为数据库文件名
+        compress: 是否 gzip 压缩
+        keep: 保留最近几份备份（0 表示全部保留）
+        pages: 每批复制的页数
+        pause: 每批之间的休眠秒数（让出写锁给 Bot）
+
+    Returns:
+        {'status': 'created' / 'unchanged', 'path': 备份文件, 'checksum': ..., 'removed': [...]}
+    """
+    name = name or os.path.splitext(os.path.basename(src_path))[0]
+    os.makedirs(backup_dir, exist_ok=True)
+
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    db_path = os.path.join(backup_dir, f"{name}_backup_{timestamp}.db")
+    temp_path = db_path + '.tmp'
+
+    started = time.monotonic()
+
+    def progress(status, remaining, total):
+        if pause:
+            time.sleep(pause)
+
+    src = sqlite3.connect(f"file:{src_path}?mode=ro", uri=True)
+    dst = sqlite3.connect(temp_path)
+    try:
+        src.backup(dst, pages=pages, progress=progress)
+        result = dst.execute("PRAGMA integrity_check").fetchone()[0]
+    finally:
+        dst.close()
+        src.close()
+
+    if result != 'ok':
+        os.remove(temp_path)
+        raise RuntimeError(f"Backup of {src_path} failed integrity check: {result}")
+
+    checksum = _file_sha256(temp_path)
+
+    # 与最近一次备份内容相同则不重复保存
+    existing = list_backups(backup_dir, name)
+    if existing and _read_checksum(existing[-1]) == checksum and verify_backup(existing[-1]):
+        os.remove(temp_path)
+        logger.info(f"Backup of {src_path} unchanged since {existing[-1]}")
+        return {'status': 'unchanged', 'path': existing[-1], 'checksum': checksum, 'removed': []}
+
+    if compress:
+        final_path = db_path + '.gz'
+        with open(temp_path, 'rb') as f_in, gzip.open(final_path, 'wb') as f_out:
+            shutil.copyfileobj(f_in, f_out)
+        os.remove(temp_path)
+    else:
+        final_path = db_path
+        os.replace(temp_path, final_path)
+
+    with open(final_path + CHECKSUM_SUFFIX, 'w', encoding='utf-8') as f:
+        f.write(f"{checksum}  {os.path.basename(final_path)}\n")
+
+    if not verify_backup(final_path):
+        raise RuntimeError(f"Backup verification failed: {final_path}")
+
+    removed = apply_retention(backup_dir, name, keep)
+    logger.info(f"Backed up {src_path} -> {final_path} in {time.monotonic() - started:.1f}s")
+    return {'status': 'created', 'path': final_path, 'checksum': checksum, 'removed': removed}
+
+
+def apply_retention(backup_dir: str, name: str, keep: int) -> List[str]:
+    """只保留最近 keep 份备份，返回被删除的文件"""
+    if keep <= 0:
+        return []
+    removed = []
+    for path in list_backups(backup_dir, name)[:-keep]:
+        for target in (path, path + CHECKSUM_SUFFIX):
+            if os.path.exists(target):
+                os.remove(target)
+        removed.append(path)
+    return removed
@@ -8,13 +8,24 @@ from telegram.ext import (
     Application, CommandHandler, CallbackQueryHandler, 
     MessageHandler, filters, ContextTypes
 )
-from telegram.error import TelegramError
+from telegram.error import TelegramError, RetryAfter
 from datetime import datetime, timedelta
+import json
+from typing import Optional
+import os
+import socket
 import time
 
 from config import *
 from database import Database
 from tron_payment import TronPayment
+from ratelimit import AsyncRateLimiter, OrderLimiter
+from broadcast import BroadcastEngine, parse_targets
+from scheduler import NextFireScheduler
+from media import MediaCache
+from screens import Screen, ScreenRegistry
+from router import CallbackRouter
+from states import ConversationStateStore
 
 # 配置日志
 logging.basicConfig(
@@ -28,7 +39,7 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # 初始化数据库
-db = Database(DATABASE_PATH)
+db = Database(DATABASE_PATH, STATS_TIMEZONE)
 
 # 初始化 TRON 支付
 tron_payment = None
@@ -44,8 +55,42 @@ try:
 except Exception as e:
     logger.error(f"Failed to initialize TRON Payment: {e}")
 
-# 用户状态管理（用于多步骤对话）
-user_states = {}
+# 用户状态管理（用于多步骤对话）：过期自动失效，可保存到数据库以便重启后继续
+user_states = ConversationStateStore(
+    db if CONVERSATION_STATE_PERSIST else None,
+    ttl_seconds=CONVERSATION_STATE_TTL_MINUTES * 60,
+    max_entries=CONVERSATION_STATE_MAX,
+)
+
+# 批量调用 Telegram API 时的全局限流器
+telegram_limiter = AsyncRateLimiter(TELEGRAM_API_RATE)
+
+# 广告群发（与其他批量调用共用全局限流器）
+promo_broadcaster = BroadcastEngine(telegram_limiter, PROMO_CHAT_MESSAGES_PER_MINUTE, PROMO_CONCURRENCY)
+
+# 定时广告任务：按最早的发送时间唤醒，在 main() 中启动
+promo_scheduler = NextFireScheduler('promo_tasks')
+
+# URL/本地文件图片的 file_id 缓存（欢迎图片、广告图片）
+media_cache = MediaCache(db)
+
+# 广告模板 id -> (模板版本, 模板, 按钮)，见 get_promo_content
+promo_content_cache = {}
+
+# 定时广告任务的认领者标识（多个 Bot 进程时区分是谁在执行）和本进程正在执行的任务
+PROMO_TASK_OWNER = f"{socket.gethostname()}:{os.getpid()}"
+running_promo_tasks = set()
+
+# 下单防刷限制（待支付订单数 + 下单间隔），启动时从数据库加载
+order_limiter = OrderLimiter(MAX_PENDING_ORDERS_PER_USER, MIN_ORDER_INTERVAL_SECONDS)
+order_limiter.load(
+    db.get_pending_order_counts(),
+    db.get_last_order_times(datetime.now() - timedelta(seconds=MIN_ORDER_INTERVAL_SECONDS))
+)
+
+# 可能还没提交闲鱼订单号的用户，启动时从数据库加载，下闲鱼订单时加入；
+# 只有集合中的用户发消息时才查数据库确认，确认没有待填写的订单后移出
+xianyu_awaiting_users = db.get_xianyu_awaiting_users()
 
 
 # ========== 工具函数 ==========
@@ -76,17 +121,190 @@ def format_wide_message(text: str, min_width: int = 50) -> str:
     
     return '\n'.join(formatted_lines)
 
-def get_main_keyboard() -> ReplyKeyboardMarkup:
-    """获取主键盘（固定显示在聊天框底部）"""
+def page_nav_row(base: str, page) -> list:
+    """生成翻页按钮（callback_data 为 "<base>:p<游标>" / "<base>:n<游标>"）"""
+    row = []
+    if page.prev_cursor:
+        row.append(InlineKeyboardButton("« 上一页", callback_data=f"{base}:p{page.prev_cursor}"))
+    if page.next_cursor:
+        row.append(InlineKeyboardButton("下一页 »", callback_data=f"{base}:n{page.next_cursor}"))
+    return row
+
+
+def parse_page_callback(data: str, base: str) -> tuple:
+    """解析翻页回调，返回 (after, before)"""
+    if not data.startswith(base + ':'):
+        return None, None
+    direction, cursor = data[len(base) + 1], data[len(base) + 2:]
+    return (cursor, None) if direction == 'n' else (None, cursor)
+
+
+# ========== 静态界面（只由配置决定，构建一次后复用） ==========
+
+screens = ScreenRegistry()
+
+
+@screens.register('main_keyboard')
+def build_main_keyboard(variant) -> Screen:
+    """主键盘（固定显示在聊天框底部）"""
     keyboard = [
         ["🏠 主页", "📋 我的订单"],
         ["👤 会员状态", "❓ 帮助"]
     ]
-    return ReplyKeyboardMarkup(
+    return Screen(reply_markup=ReplyKeyboardMarkup(
         keyboard,
         resize_keyboard=True,  # 按钮大小自适应
         one_time_keyboard=False  # 不自动隐藏键盘
-    )
+    ))
+
+
+@screens.register('main_menu')
+def build_main_menu(admin: bool) -> Screen:
+    """主菜单：欢迎消息 + 按钮（变体：是否管理员）"""
+    # 使用自定义欢迎消息（从 config.py）
+    welcome_text = WELCOME_MESSAGE
+    if not welcome_text:
+        logger.error("WELCOME_MESSAGE is None or empty!")
+        welcome_text = "欢迎使用本 Bot！"
+    
+    keyboard = []
+    
+    # 第一行：支付方式（并排显示）
+    # 根据配置决定按钮文字
+    if ENABLE_MULTIPLE_PLANS:
+        # 多套餐模式：显示简单的支付方式
+        usdt_btn_text = "💎 USDT 支付"
+        xianyu_btn_text = "🏪 闲鱼支付"
+    else:
+        # 单套餐模式：直接显示价格
+        usdt_btn_text = f"💎 USDT 支付 - {DEFAULT_PLAN['price_usdt']} USDT"
+        xianyu_btn_text = f"🏪 闲鱼支付 - ¥{DEFAULT_PLAN['price_cny']}"
+    
+    keyboard.append([
+        InlineKeyboardButton(usdt_btn_text, callback_data="direct_usdt_payment"),
+        InlineKeyboardButton(xianyu_btn_text, callback_data="direct_xianyu_payment")
+    ])
+    
+    # 第二行：查询功能（并排显示）
+    keyboard.append([
+        InlineKeyboardButton("📋 我的订单", callback_data="my_orders"),
+        InlineKeyboardButton("👤 会员状态", callback_data="my_status")
+    ])
+    
+    # 第三行：客服和帮助（并排显示）
+    keyboard.append([
+        InlineKeyboardButton("👨‍💼 联系客服", url=CUSTOMER_SERVICE_URL),
+        InlineKeyboardButton("❓ 使用帮助", callback_data="help")
+    ])
+    
+    # 管理员功能（单独一行）
+    if admin:
+        keyboard.append([InlineKeyboardButton("👑 管理员面板", callback_data="admin_panel")])
+    
+    # 隐藏的购买按钮（保留代码，但不显示）
+    # if not is_member:
+    #     keyboard.append([InlineKeyboardButton("🎉 立即购买会员", callback_data="buy_membership")])
+    # else:
+    #     keyboard.append([InlineKeyboardButton("🔄 续费会员", callback_data="buy_membership")])
+    
+    return Screen(welcome_text, InlineKeyboardMarkup(keyboard))
+
+
+@screens.register('help')
+def build_help(admin: bool) -> Screen:
+    """/help 和「❓ 帮助」按钮（变体：是否管理员）"""
+    text = HELP_MESSAGE + "\n\n" + ADMIN_HELP_MESSAGE if admin else HELP_MESSAGE
+    return Screen(text, get_main_keyboard())
+
+
+@screens.register('help_inline')
+def build_help_inline(variant) -> Screen:
+    """主菜单中的「使用帮助」"""
+    keyboard = [[InlineKeyboardButton("« 返回", callback_data="back_to_main")]]
+    return Screen(HELP_MESSAGE, InlineKeyboardMarkup(keyboard))
+
+
+@screens.register('admin_panel')
+def build_admin_panel(with_back: bool) -> Screen:
+    """管理员面板按钮（统计文字是动态的，不缓存）；从菜单进入时带返回按钮"""
+    keyboard = [
+        [InlineKeyboardButton("📋 待审核订单", callback_data="admin_pending_orders")],
+        [InlineKeyboardButton("👥 用户列表", callback_data="admin_users")],
+        [InlineKeyboardButton("📊 详细统计", callback_data="admin_stats")],
+        [InlineKeyboardButton("📢 广告管理", callback_data="promo_manage")],
+        [InlineKeyboardButton("🔄 刷新", callback_data="admin_panel")]
+    ]
+    if with_back:
+        keyboard.append([InlineKeyboardButton("« 返回", callback_data="back_to_main")])
+    return Screen(reply_markup=InlineKeyboardMarkup(keyboard))
+
+
+@screens.register('membership_plans')
+def build_membership_plans(payment_method) -> Optional[Screen]:
+    """会员套餐列表（变体：已选择的支付方式 'usdt' / 'xianyu' / None）"""
+    if payment_method == 'usdt':
+        text = "💎 USDT 支付 - 选择会员套餐：\n\n"
+    elif payment_method == 'xianyu':
+        text = "🏪 闲鱼支付 - 选择会员套餐：\n\n"
+    elif payment_method is None:
+        text = "💎 选择会员套餐：\n\n"
+    else:
+        return None
+    
+    keyboard = []
+    
+    for plan_key, plan_info in MEMBERSHIP_PLANS.items():
+        text += f"🔹 {plan_info['name']}\n"
+        text += f"   时长: {plan_info['days']} 天\n"
+        text += f"   USDT: {plan_info['price_usdt']} | 人民币: ¥{plan_info['price_cny']}\n\n"
+        
+        # 如果已选择支付方式，直接跳转到支付处理
+        if payment_method == 'usdt':
+            callback_data = f"pay_tron_{plan_key}"
+        elif payment_method == 'xianyu':
+            callback_data = f"pay_xianyu_{plan_key}"
+        else:
+            callback_data = f"plan_{plan_key}"
+        
+        keyboard.append([InlineKeyboardButton(
+            f"{plan_info['name']} - {plan_info['days']}天",
+            callback_data=callback_data
+        )])
+    
+    keyboard.append([InlineKeyboardButton("« 返回", callback_data="back_to_main")])
+    return Screen(text, InlineKeyboardMarkup(keyboard))
+
+
+@screens.register('payment_methods')
+def build_payment_methods(plan_type: str) -> Optional[Screen]:
+    """某个套餐的支付方式选择（变体：套餐；套餐不存在时为 None）"""
+    plan_info = MEMBERSHIP_PLANS.get(plan_type)
+    if not plan_info:
+        return None
+    
+    text = f"""
+您选择的套餐：{plan_info['name']}
+
+请选择支付方式：
+"""
+    
+    keyboard = [
+        [InlineKeyboardButton(
+            f"💎 USDT (TRC20) - {plan_info['price_usdt']} USDT",
+            callback_data=f"pay_tron_{plan_type}"
+        )],
+        [InlineKeyboardButton(
+            f"🛒 闲鱼支付 - ¥{plan_info['price_cny']}",
+            callback_data=f"pay_xianyu_{plan_type}"
+        )],
+        [InlineKeyboardButton("« 返回套餐选择", callback_data="buy_membership")]
+    ]
+    return Screen(text, InlineKeyboardMarkup(keyboard))
+
+
+def get_main_keyboard() -> ReplyKeyboardMarkup:
+    """获取主键盘（固定显示在聊天框底部）"""
+    return screens.get('main_keyboard').reply_markup
 
 def is_admin(user_id: int) -> bool:
     """检查是否是管理员"""
@@ -219,63 +437,21 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         db.get_or_create_user(user.id, user.username, user.first_name, user.last_name)
         
-        # 使用自定义欢迎消息（从 config.py）
-        welcome_text = WELCOME_MESSAGE
-        if not welcome_text:
-            logger.error("WELCOME_MESSAGE is None or empty!")
-            welcome_text = "欢迎使用本 Bot！"
-        
-        # 构建按钮布局
-        keyboard = []
-        
-        # 第一行：支付方式（并排显示）
-        # 根据配置决定按钮文字
-        if ENABLE_MULTIPLE_PLANS:
-            # 多套餐模式：显示简单的支付方式
-            usdt_btn_text = "💎 USDT 支付"
-            xianyu_btn_text = "🏪 闲鱼支付"
-        else:
-            # 单套餐模式：直接显示价格
-            usdt_btn_text = f"💎 USDT 支付 - {DEFAULT_PLAN['price_usdt']} USDT"
-            xianyu_btn_text = f"🏪 闲鱼支付 - ¥{DEFAULT_PLAN['price_cny']}"
-        
-        keyboard.append([
-            InlineKeyboardButton(usdt_btn_text, callback_data="direct_usdt_payment"),
-            InlineKeyboardButton(xianyu_btn_text, callback_data="direct_xianyu_payment")
-        ])
-        
-        # 第二行：查询功能（并排显示）
-        keyboard.append([
-            InlineKeyboardButton("📋 我的订单", callback_data="my_orders"),
-            InlineKeyboardButton("👤 会员状态", callback_data="my_status")
-        ])
-        
-        # 第三行：客服和帮助（并排显示）
-        keyboard.append([
-            InlineKeyboardButton("👨‍💼 联系客服", url=CUSTOMER_SERVICE_URL),
-            InlineKeyboardButton("❓ 使用帮助", callback_data="help")
-        ])
-        
-        # 管理员功能（单独一行）
-        if is_admin(user.id):
-            keyboard.append([InlineKeyboardButton("👑 管理员面板", callback_data="admin_panel")])
-        
-        # 隐藏的购买按钮（保留代码，但不显示）
-        # if not is_member:
-        #     keyboard.append([InlineKeyboardButton("🎉 立即购买会员", callback_data="buy_membership")])
-        # else:
-        #     keyboard.append([InlineKeyboardButton("🔄 续费会员", callback_data="buy_membership")])
-        
-        inline_markup = InlineKeyboardMarkup(keyboard)
+        menu = screens.get('main_menu', is_admin(user.id))
+        welcome_text = menu.text
+        inline_markup = menu.reply_markup
         main_keyboard = get_main_keyboard()  # 获取固定键盘
         
         # 如果配置了欢迎图片，发送图片+文字；否则只发送文字
         if WELCOME_IMAGE:
             try:
-                await update.message.reply_photo(
-                    photo=WELCOME_IMAGE,
-                    caption=welcome_text,
-                    reply_markup=main_keyboard  # 使用固定键盘
+                await media_cache.send_photo(
+                    WELCOME_IMAGE,
+                    lambda photo: update.message.reply_photo(
+                        photo=photo,
+                        caption=welcome_text,
+                        reply_markup=main_keyboard  # 使用固定键盘
+                    )
                 )
                 # 再发送一条带 inline 按钮的消息
                 await update.message.reply_text(
@@ -394,13 +570,8 @@ async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """帮助信息"""
-    user_id = update.effective_user.id
-    main_keyboard = get_main_keyboard()  # 获取固定键盘
-    
-    if is_admin(user_id):
-        await update.message.reply_text(HELP_MESSAGE + "\n\n" + ADMIN_HELP_MESSAGE, reply_markup=main_keyboard)
-    else:
-        await update.message.reply_text(HELP_MESSAGE, reply_markup=main_keyboard)
+    screen = screens.get('help', is_admin(update.effective_user.id))
+    await update.message.reply_text(screen.text, reply_markup=screen.reply_markup)
 
 
 # ========== 管理员命令 ==========
@@ -435,16 +606,7 @@ USDT: {stats['total_usdt']:.2f}
     # 使用格式化函数使消息更宽
     text = format_wide_message(text, min_width=60)
     
-    keyboard = [
-        [InlineKeyboardButton("📋 待审核订单", callback_data="admin_pending_orders")],
-        [InlineKeyboardButton("👥 用户列表", callback_data="admin_users")],
-        [InlineKeyboardButton("📊 详细统计", callback_data="admin_stats")],
-        [InlineKeyboardButton("📢 广告管理", callback_data="promo_manage")],
-        [InlineKeyboardButton("🔄 刷新", callback_data="admin_panel")]
-    ]
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await update.message.reply_text(text, reply_markup=reply_markup)
+    await update.message.reply_text(text, reply_markup=screens.get('admin_panel', False).reply_markup)
 
 
 async def pending_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -465,144 +627,166 @@ async def promo_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await show_promo_menu(update, context)
 
 
-# ========== 回调处理 ==========
-
-async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """处理按钮回调"""
-    query = update.callback_query
-    await query.answer()
+async def find_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """按片段查找订单和用户：/find <订单号/用户名/闲鱼订单号/交易哈希片段>"""
+    if not is_admin(update.effective_user.id):
+        await update.message.reply_text("⛔ 您没有权限")
+        return
     
-    data = query.data
-    user_id = update.effective_user.id
+    text = ' '.join(context.args).strip()
+    if not text:
+        await update.message.reply_text(
+            "用法: /find <关键字>\n"
+            "可输入订单号、用户 ID、用户名、闲鱼订单号、TRON 交易哈希的任意片段（至少 3 个字符）"
+        )
+        return
     
-    # 购买会员流程
-    if data == "buy_membership":
-        await show_membership_plans(update, context, query=query)
+    results = db.search(text, limit=10)
+    orders, users = results['orders'], results['users']
     
-    # 直接支付方式（从欢迎页面）
-    elif data == "direct_usdt_payment":
-        try:
-            logger.info(f"User {user_id} clicked usdt payment, ENABLE_MULTIPLE_PLANS={ENABLE_MULTIPLE_PLANS}")
-            if ENABLE_MULTIPLE_PLANS:
-                # 多套餐模式：显示套餐选择
-                user_states[user_id] = {'selected_payment': 'usdt'}
-                await show_membership_plans(update, context, query=query, payment_method='usdt')
-            else:
-                # 单套餐模式：直接进入支付
-                logger.info(f"Calling process_tron_payment with plan: {DEFAULT_PLAN}")
-                await process_tron_payment(update, context, 'default', DEFAULT_PLAN, query)
-        except Exception as e:
-            logger.error(f"Error in direct_usdt_payment: {e}", exc_info=True)
-            await query.answer("❌ 处理失败，请稍后重试", show_alert=True)
+    if not orders and not users:
+        await update.message.reply_text(f"🔍 没有找到与「{text}」相关的订单或用户")
+        return
     
-    elif data == "direct_xianyu_payment":
-        try:
-            logger.info(f"User {user_id} clicked xianyu payment, ENABLE_MULTIPLE_PLANS={ENABLE_MULTIPLE_PLANS}")
-            if ENABLE_MULTIPLE_PLANS:
-                # 多套餐模式：显示购买指南和套餐选择
-                logger.info("Calling show_xianyu_guide")
-                await show_xianyu_guide(update, context, query=query)
-            else:
-                # 单套餐模式：直接创建订单并等待订单号
-                logger.info(f"Calling create_xianyu_order_direct with plan: {DEFAULT_PLAN}")
-                await create_xianyu_order_direct(update, context, 'default', DEFAULT_PLAN, query)
-        except Exception as e:
-            logger.error(f"Error in direct_xianyu_payment: {e}", exc_info=True)
-            await query.answer("❌ 处理失败，请稍后重试", show_alert=True)
+    status_emoji = {'pending': '⏳', 'paid': '✅', 'cancelled': '❌', 'expired': '⏰', 'timeout': '⏰'}
+    lines = [f"🔍 「{text}」的查找结果：", ""]
     
-    elif data.startswith("plan_"):
-        plan_type = data.split("_")[1]
-        await show_payment_methods(update, context, plan_type, query=query)
+    if users:
+        lines.append(f"👥 用户（{len(users)}）：")
+        for user in users:
+            name = ' '.join(filter(None, [user['first_name'], user['last_name']]))
+            member = '✅ 会员' if user['is_member'] else '非会员'
+            lines.append(f"• {user['user_id']} @{user['username'] or 'N/A'} {name} - {member}")
+        lines.append("")
     
-    # 闲鱼支付 - 选择套餐后直接进入订单号输入流程
-    elif data.startswith("xianyu_plan_"):
-        plan_type = data.replace("xianyu_plan_", "")
-        plan_info = MEMBERSHIP_PLANS.get(plan_type)
-        
-        if not plan_info:
-            await query.answer("套餐不存在", show_alert=True)
-            return
-        
-        # 检查防刷限制 - 待支付订单数量
-        pending_count = db.count_user_pending_orders(user_id)
-        if pending_count >= MAX_PENDING_ORDERS_PER_USER:
-            await query.answer("⚠️ 待支付订单已达上限", show_alert=True)
-            
-            from config import XIANYU_ORDER_TIMEOUT_MINUTES
-            message = f"""
-⚠️ **订单数量已达上限**
+    keyboard = []
+    if orders:
+        lines.append(f"📋 订单（{len(orders)}）：")
+        for order in orders:
+            lines.append(
+                f"{status_emoji.get(order['status'], '❓')} {order['order_id']} - "
+                f"{order['payment_method']} {order['amount']} {order['currency']} - "
+                f"用户 {order['user_id']}"
+            )
+            if order['xianyu_order_number']:
+                lines.append(f"    闲鱼订单号: {order['xianyu_order_number']}")
+            if order['tron_tx_hash']:
+                lines.append(f"    交易哈希: {order['tron_tx_hash']}")
+            keyboard.append([InlineKeyboardButton(
+                f"查看 {order['order_id'][:20]}",
+                callback_data=f"view_order_{order['order_id']}"
+            )])
+    
+    reply_markup = InlineKeyboardMarkup(keyboard) if keyboard else None
+    await update.message.reply_text('\n'.join(lines), reply_markup=reply_markup)
 
-您当前有 **{pending_count}** 个待支付订单
-系统限制：最多 **{MAX_PENDING_ORDERS_PER_USER}** 个待支付订单
 
-📋 **如何处理：**
+# ========== 回调处理 ==========
 
-1️⃣ **查看订单** - 点击下方「📋 我的订单」
-2️⃣ **完成支付** - 如果准备购买，请尽快支付
-3️⃣ **取消订单** - 不再购买可以取消订单
+async def deny_non_admin(query):
+    """非管理员点击管理员按钮"""
+    await query.answer("⛔ 您没有权限", show_alert=True)
 
-⏰ **自动清理**
-超过 {XIANYU_ORDER_TIMEOUT_MINUTES} 分钟未支付的订单会自动过期
 
-💡 订单过期或取消后，您就可以创建新订单了
-"""
-            keyboard = [
-                [InlineKeyboardButton("📋 我的订单", callback_data='my_orders')],
-                [InlineKeyboardButton("« 返回主菜单", callback_data='back_to_main')]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.edit_message_text(text=message, reply_markup=reply_markup, parse_mode='Markdown')
-            return
-        
-        # 检查防刷限制 - 下单时间间隔
-        last_order_time = db.get_user_last_order_time(user_id)
-        if last_order_time:
-            time_since_last = (datetime.now() - last_order_time).total_seconds()
-            if time_since_last < MIN_ORDER_INTERVAL_SECONDS:
-                wait_time = int(MIN_ORDER_INTERVAL_SECONDS - time_since_last)
-                
-                await query.answer(f"⏳ 请等待 {wait_time} 秒", show_alert=True)
-                
-                message = f"""
-⏳ **下单过于频繁**
+# 按钮回调路由：完整匹配查字典，"view_order_<订单号>" 这类按前缀树匹配
+callbacks = CallbackRouter(is_admin, deny_non_admin)
 
-为了防止误操作和刷单，系统限制了下单速度。
 
-⏰ **请等待：{wait_time} 秒**
+async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """处理按钮回调（分发给下方用 @callbacks.route 注册的处理函数）"""
+    query = update.callback_query
+    await query.answer()
+    await callbacks.dispatch(update, context)
 
-💡 **提示**
-系统会在 {wait_time} 秒后自动允许您创建新订单
-请稍候片刻再试
 
-🔒 **防刷保护**
-这是为了保护您的账户安全和系统稳定性
-"""
-                keyboard = [[InlineKeyboardButton("« 返回主菜单", callback_data='back_to_main')]]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                await query.edit_message_text(text=message, reply_markup=reply_markup, parse_mode='Markdown')
-                return
-        
-        # 创建订单
-        order_id = f"XY_{user_id}_{int(time.time())}"
-        db.create_order({
-            'order_id': order_id,
-            'user_id': user_id,
-            'payment_method': 'xianyu',
-            'plan_type': plan_type,
-            'amount': plan_info['price_cny'],
-            'currency': 'CNY',
-            'status': 'pending',
-            'membership_days': plan_info['days']
-        })
-        
-        # 设置用户状态，等待输入订单号
-        user_states[user_id] = {
-            'action': 'waiting_xianyu_order',
-            'order_id': order_id
-        }
-        
-        # 提示用户输入订单号
-        text = f"""
+# 购买会员流程
+@callbacks.route("buy_membership")
+async def cb_buy_membership(update: Update, context: ContextTypes.DEFAULT_TYPE, query, user_id: int, arg: str):
+    """购买会员：显示套餐列表"""
+    await show_membership_plans(update, context, query=query)
+
+
+# 直接支付方式（从欢迎页面）
+@callbacks.route("direct_usdt_payment")
+async def cb_direct_usdt_payment(update: Update, context: ContextTypes.DEFAULT_TYPE, query, user_id: int, arg: str):
+    """欢迎页的 USDT 支付按钮"""
+    try:
+        logger.info(f"User {user_id} clicked usdt payment, ENABLE_MULTIPLE_PLANS={ENABLE_MULTIPLE_PLANS}")
+        if ENABLE_MULTIPLE_PLANS:
+            # 多套餐模式：显示套餐选择
+            user_states[user_id] = {'selected_payment': 'usdt'}
+            await show_membership_plans(update, context, query=query, payment_method='usdt')
+        else:
+            # 单套餐模式：直接进入支付
+            logger.info(f"Calling process_tron_payment with plan: {DEFAULT_PLAN}")
+            await process_tron_payment(update, context, 'default', DEFAULT_PLAN, query)
+    except Exception as e:
+        logger.error(f"Error in direct_usdt_payment: {e}", exc_info=True)
+        await query.answer("❌ 处理失败，请稍后重试", show_alert=True)
+
+
+@callbacks.route("direct_xianyu_payment")
+async def cb_direct_xianyu_payment(update: Update, context: ContextTypes.DEFAULT_TYPE, query, user_id: int, arg: str):
+    """欢迎页的闲鱼支付按钮"""
+    try:
+        logger.info(f"User {user_id} clicked xianyu payment, ENABLE_MULTIPLE_PLANS={ENABLE_MULTIPLE_PLANS}")
+        if ENABLE_MULTIPLE_PLANS:
+            # 多套餐模式：显示购买指南和套餐选择
+            logger.info("Calling show_xianyu_guide")
+            await show_xianyu_guide(update, context, query=query)
+        else:
+            # 单套餐模式：直接创建订单并等待订单号
+            logger.info(f"Calling create_xianyu_order_direct with plan: {DEFAULT_PLAN}")
+            await create_xianyu_order_direct(update, context, 'default', DEFAULT_PLAN, query)
+    except Exception as e:
+        logger.error(f"Error in direct_xianyu_payment: {e}", exc_info=True)
+        await query.answer("❌ 处理失败，请稍后重试", show_alert=True)
+
+
+@callbacks.route(prefixes=("plan_",))
+async def cb_plan(update: Update, context: ContextTypes.DEFAULT_TYPE, query, user_id: int, arg: str):
+    """选择套餐后显示支付方式"""
+    plan_type = arg
+    await show_payment_methods(update, context, plan_type, query=query)
+
+
+# 闲鱼支付 - 选择套餐后直接进入订单号输入流程
+@callbacks.route(prefixes=("xianyu_plan_",))
+async def cb_xianyu_plan(update: Update, context: ContextTypes.DEFAULT_TYPE, query, user_id: int, arg: str):
+    """闲鱼支付选择套餐：创建订单并等待输入闲鱼订单号"""
+    plan_type = arg
+    plan_info = MEMBERSHIP_PLANS.get(plan_type)
+    
+    if not plan_info:
+        await query.answer("套餐不存在", show_alert=True)
+        return
+    
+    # 检查防刷限制（待支付订单数量、下单时间间隔）
+    if not await check_order_limits(user_id, query):
+        return
+    
+    # 创建订单
+    order_id = f"XY_{user_id}_{int(time.time())}"
+    create_pending_order({
+        'order_id': order_id,
+        'user_id': user_id,
+        'payment_method': 'xianyu',
+        'plan_type': plan_type,
+        'amount': plan_info['price_cny'],
+        'currency': 'CNY',
+        'status': 'pending',
+        'membership_days': plan_info['days'],
+        'expires_at': datetime.now() + timedelta(minutes=XIANYU_ORDER_TIMEOUT_MINUTES)
+    })
+    
+    # 设置用户状态，等待输入订单号
+    user_states[user_id] = {
+        'action': 'waiting_xianyu_order',
+        'order_id': order_id
+    }
+    
+    # 提示用户输入订单号
+    text = f"""
 ✅ 订单已创建
 
 🛒 套餐：{plan_info['name']}
@@ -619,66 +803,76 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 💡 如还未购买，请点击下方按钮前往闲鱼
 """
-        
-        keyboard = [
-            [InlineKeyboardButton("🛒 打开闲鱼商品", url=XIANYU_PRODUCT_URL)],
-            [
-                InlineKeyboardButton("« 返回", callback_data="back_to_main"),
-                InlineKeyboardButton("❌ 取消订单", callback_data=f"cancel_order_{order_id}")
-            ]
+    
+    keyboard = [
+        [InlineKeyboardButton("🛒 打开闲鱼商品", url=XIANYU_PRODUCT_URL)],
+        [
+            InlineKeyboardButton("« 返回", callback_data="back_to_main"),
+            InlineKeyboardButton("❌ 取消订单", callback_data=f"cancel_order_{order_id}")
         ]
-        await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
+    ]
+    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
+
+
+@callbacks.route(prefixes=("pay_",))
+async def cb_pay(update: Update, context: ContextTypes.DEFAULT_TYPE, query, user_id: int, arg: str):
+    """选择支付方式（pay_<方式>_<套餐>）"""
+    method, _, plan_type = arg.partition("_")
+    await process_payment_selection(update, context, method, plan_type, query=query)
+
+
+# 订单查看
+@callbacks.route("my_orders")
+async def cb_my_orders(update: Update, context: ContextTypes.DEFAULT_TYPE, query, user_id: int, arg: str):
+    """我的订单列表"""
+    orders = db.get_user_orders(user_id, limit=10)
+    if not orders:
+        await query.edit_message_text("您还没有任何订单")
+        return
     
-    elif data.startswith("pay_"):
-        parts = data.split("_")
-        method = parts[1]
-        plan_type = parts[2]
-        await process_payment_selection(update, context, method, plan_type, query=query)
-    
-    # 订单查看
-    elif data == "my_orders":
-        orders = db.get_user_orders(user_id, limit=10)
-        if not orders:
-            await query.edit_message_text("您还没有任何订单")
-            return
-        
-        text = "📋 您的订单列表：\n\n"
-        keyboard = []
-        
-        for order in orders:
-            status_emoji = {'pending': '⏳', 'paid': '✅', 'cancelled': '❌', 'expired': '⏰'}
-            text += f"{status_emoji.get(order['status'], '❓')} {order['order_id'][:30]}... - {order['status']}\n"
-            keyboard.append([InlineKeyboardButton(
-                f"查看详情",
-                callback_data=f"view_order_{order['order_id']}"
-            )])
-        
-        keyboard.append([InlineKeyboardButton("« 返回", callback_data="back_to_main")])
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text(text, reply_markup=reply_markup)
+    text = "📋 您的订单列表：\n\n"
+    keyboard = []
     
-    elif data.startswith("view_order_"):
-        order_id = data.replace("view_order_", "")
-        order = db.get_order(order_id)
-        
-        if not order:
-            await query.edit_message_text("订单不存在")
-            return
-        
-        text = format_order_info(order)
-        keyboard = [[InlineKeyboardButton("« 返回订单列表", callback_data="my_orders")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+    for order in orders:
+        status_emoji = {'pending': '⏳', 'paid': '✅', 'cancelled': '❌', 'expired': '⏰'}
+        text += f"{status_emoji.get(order['status'], '❓')} {order['order_id'][:30]}... - {order['status']}\n"
+        keyboard.append([InlineKeyboardButton(
+            f"查看详情",
+            callback_data=f"view_order_{order['order_id']}"
+        )])
     
-    # 会员状态
-    elif data == "my_status":
-        user = db.get_user(user_id)
+    keyboard.append([InlineKeyboardButton("« 返回", callback_data="back_to_main")])
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    await query.edit_message_text(text, reply_markup=reply_markup)
+
+
+@callbacks.route(prefixes=("view_order_",))
+async def cb_view_order(update: Update, context: ContextTypes.DEFAULT_TYPE, query, user_id: int, arg: str):
+    """订单详情"""
+    order_id = arg
+    order = db.get_order(order_id)
+    
+    if not order:
+        await query.edit_message_text("订单不存在")
+        return
+    
+    text = format_order_info(order)
+    keyboard = [[InlineKeyboardButton("« 返回订单列表", callback_data="my_orders")]]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+
+
+# 会员状态
+@callbacks.route("my_status")
+async def cb_my_status(update: Update, context: ContextTypes.DEFAULT_TYPE, query, user_id: int, arg: str):
+    """会员状态"""
+    user = db.get_user(user_id)
+    
+    if user['is_member']:
+        member_until = datetime.fromisoformat(user['member_until'])
+        days_left = (member_until - datetime.now()).days
         
-        if user['is_member']:
-            member_until = datetime.fromisoformat(user['member_until'])
-            days_left = (member_until - datetime.now()).days
-            
-            text = f"""
+        text = f"""
 ✨ 会员信息
 
 状态: ✅ 已激活
@@ -687,34 +881,35 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 总消费: {user['total_spent_usdt']} USDT / {user['total_spent_cny']} CNY
 """
-            
-            # 使用格式化函数使消息更宽
-            text = format_wide_message(text, min_width=50)
-        else:
-            text = "❌ 您还不是会员"
         
-        keyboard = [
-            [InlineKeyboardButton("💳 购买/续费", callback_data="buy_membership")],
-            [InlineKeyboardButton("« 返回", callback_data="back_to_main")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text(text, reply_markup=reply_markup)
+        # 使用格式化函数使消息更宽
+        text = format_wide_message(text, min_width=50)
+    else:
+        text = "❌ 您还不是会员"
     
-    # 帮助
-    elif data == "help":
-        keyboard = [[InlineKeyboardButton("« 返回", callback_data="back_to_main")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text(HELP_MESSAGE, reply_markup=reply_markup)
+    keyboard = [
+        [InlineKeyboardButton("💳 购买/续费", callback_data="buy_membership")],
+        [InlineKeyboardButton("« 返回", callback_data="back_to_main")]
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    await query.edit_message_text(text, reply_markup=reply_markup)
+
+
+# 帮助
+@callbacks.route("help")
+async def cb_help(update: Update, context: ContextTypes.DEFAULT_TYPE, query, user_id: int, arg: str):
+    """使用帮助"""
+    screen = screens.get('help_inline')
+    await query.edit_message_text(screen.text, reply_markup=screen.reply_markup)
+
+
+# 管理员功能
+@callbacks.route("admin_panel", admin=True)
+async def cb_admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE, query, user_id: int, arg: str):
+    """管理员面板"""
+    stats = db.get_statistics()
     
-    # 管理员功能
-    elif data == "admin_panel":
-        if not is_admin(user_id):
-            await query.answer("⛔ 您没有权限", show_alert=True)
-            return
-        
-        stats = db.get_statistics()
-        
-        text = f"""
+    text = f"""
 👑 管理员面板
 
 📊 系统统计：
@@ -728,69 +923,60 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
 USDT: {stats['total_usdt']:.2f}
 人民币: {stats['total_cny']:.2f}
 """
-        
-        # 使用格式化函数使消息更宽
-        text = format_wide_message(text, min_width=60)
-        
-        keyboard = [
-            [InlineKeyboardButton("📋 待审核订单", callback_data="admin_pending_orders")],
-            [InlineKeyboardButton("👥 用户列表", callback_data="admin_users")],
-            [InlineKeyboardButton("📊 详细统计", callback_data="admin_stats")],
-            [InlineKeyboardButton("📢 广告管理", callback_data="promo_manage")],
-            [InlineKeyboardButton("🔄 刷新", callback_data="admin_panel")],
-            [InlineKeyboardButton("« 返回", callback_data="back_to_main")]
-        ]
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text(text, reply_markup=reply_markup)
     
-    elif data == "admin_pending_orders":
-        if not is_admin(user_id):
-            await query.answer("⛔ 您没有权限", show_alert=True)
-            return
-        
-        await show_pending_orders(update, context, query=query)
+    # 使用格式化函数使消息更宽
+    text = format_wide_message(text, min_width=60)
     
-    elif data.startswith("admin_approve_"):
-        if not is_admin(user_id):
-            await query.answer("⛔ 您没有权限", show_alert=True)
-            return
-        
-        order_id = data.replace("admin_approve_", "")
-        await approve_order(update, context, order_id, query=query)
+    await query.edit_message_text(text, reply_markup=screens.get('admin_panel', True).reply_markup)
+
+
+@callbacks.route("admin_pending_orders", prefixes=("admin_pending_orders:",), admin=True)
+async def cb_admin_pending_orders(update: Update, context: ContextTypes.DEFAULT_TYPE, query, user_id: int, arg: str):
+    """待审核订单（分页）"""
+    after, before = parse_page_callback(query.data, "admin_pending_orders")
+    await show_pending_orders(update, context, query=query, after=after, before=before)
+
+
+@callbacks.route(prefixes=("admin_approve_",), admin=True)
+async def cb_admin_approve(update: Update, context: ContextTypes.DEFAULT_TYPE, query, user_id: int, arg: str):
+    """审核通过订单"""
+    order_id = arg
+    await approve_order(update, context, order_id, query=query)
+
+
+@callbacks.route(prefixes=("admin_reject_",), admin=True)
+async def cb_admin_reject(update: Update, context: ContextTypes.DEFAULT_TYPE, query, user_id: int, arg: str):
+    """拒绝订单"""
+    order_id = arg
+    await reject_order(update, context, order_id, query=query)
+
+
+@callbacks.route("admin_users", prefixes=("admin_users:",), admin=True)
+async def cb_admin_users(update: Update, context: ContextTypes.DEFAULT_TYPE, query, user_id: int, arg: str):
+    """用户列表（分页）"""
+    after, before = parse_page_callback(query.data, "admin_users")
+    page = db.get_users_page(limit=20, after=after, before=before)
+    text = f"👥 用户列表 (按最近活跃排序)：\n\n"
     
-    elif data.startswith("admin_reject_"):
-        if not is_admin(user_id):
-            await query.answer("⛔ 您没有权限", show_alert=True)
-            return
-        
-        order_id = data.replace("admin_reject_", "")
-        await reject_order(update, context, order_id, query=query)
+    for user in page.items:
+        member_emoji = "✅" if user['is_member'] else "❌"
+        text += f"{member_emoji} {user['user_id']} - @{user['username'] or 'N/A'} - {user['first_name']}\n"
     
-    elif data == "admin_users":
-        if not is_admin(user_id):
-            await query.answer("⛔ 您没有权限", show_alert=True)
-            return
-        
-        users = db.get_all_users(limit=20)
-        text = f"👥 用户列表 (最近20个)：\n\n"
-        
-        for user in users:
-            member_emoji = "✅" if user['is_member'] else "❌"
-            text += f"{member_emoji} {user['user_id']} - @{user['username'] or 'N/A'} - {user['first_name']}\n"
-        
-        keyboard = [[InlineKeyboardButton("« 返回", callback_data="admin_panel")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text(text, reply_markup=reply_markup)
+    keyboard = []
+    nav_row = page_nav_row("admin_users", page)
+    if nav_row:
+        keyboard.append(nav_row)
+    keyboard.append([InlineKeyboardButton("« 返回", callback_data="admin_panel")])
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    await query.edit_message_text(text, reply_markup=reply_markup)
+
+
+@callbacks.route("admin_stats", admin=True)
+async def cb_admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE, query, user_id: int, arg: str):
+    """详细统计"""
+    stats = db.get_statistics()
     
-    elif data == "admin_stats":
-        if not is_admin(user_id):
-            await query.answer("⛔ 您没有权限", show_alert=True)
-            return
-        
-        stats = db.get_statistics()
-        
-        text = f"""
+    text = f"""
 📊 详细统计
 
 👥 用户统计：
@@ -812,279 +998,253 @@ USDT 收入: {stats['total_usdt']:.2f} USDT
 📅 今日数据：
 新订单: {stats['today_orders']}
 已支付: {stats['today_paid']}
+
+📈 最近 7 天（新订单 / 已支付）：
+"""
+    for day in db.get_daily_stats(7):
+        text += f"{day['day'][5:]}: {day['orders']} / {day['paid_orders']}\n"
+    
+    writes = db.write_metrics()
+    text += f"""
+🗄️ 写入队列：
+写入次数: {writes['writes']}（失败 {writes['failed_writes']}）
+排队等待: 平均 {writes['avg_wait_ms']:.1f} ms / 最长 {writes['max_wait_ms']:.1f} ms
+提交耗时: 平均 {writes['avg_commit_ms']:.1f} ms
+组提交: 平均 {writes['avg_batch']:.1f} / 最大 {writes['max_batch']} 条每事务
+当前积压: {writes['queue_depth']}
 """
-        
-        # 使用格式化函数使消息更宽
-        text = format_wide_message(text, min_width=60)
-        
-        keyboard = [[InlineKeyboardButton("« 返回", callback_data="admin_panel")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text(text, reply_markup=reply_markup)
     
-    # 广告管理功能
-    elif data == "promo_manage":
-        if not is_admin(user_id):
-            await query.answer("⛔ 您没有权限", show_alert=True)
-            return
-        
-        await show_promo_menu(update, context, query=query)
+    routes = [route for route in callbacks.metrics() if route['calls']][:5]
+    if routes:
+        text += "\n🔀 按钮回调耗时（前 5）：\n"
+        for route in routes:
+            text += (f"{route['route']}: {route['calls']} 次, 平均 {route['avg_ms']:.1f} ms, "
+                     f"最长 {route['max_ms']:.1f} ms\n")
     
-    elif data == "promo_list_templates":
-        if not is_admin(user_id):
-            await query.answer("⛔ 您没有权限", show_alert=True)
-            return
-        
-        await show_promo_templates(update, context, query=query)
+    # 使用格式化函数使消息更宽
+    text = format_wide_message(text, min_width=60)
     
-    elif data == "promo_list_tasks":
-        if not is_admin(user_id):
-            await query.answer("⛔ 您没有权限", show_alert=True)
-            return
-        
-        await show_scheduled_tasks(update, context, query=query)
+    keyboard = [[InlineKeyboardButton("« 返回", callback_data="admin_panel")]]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    await query.edit_message_text(text, reply_markup=reply_markup)
+
+
+# 广告管理功能
+@callbacks.route("promo_manage", admin=True)
+async def cb_promo_manage(update: Update, context: ContextTypes.DEFAULT_TYPE, query, user_id: int, arg: str):
+    """广告管理菜单"""
+    await show_promo_menu(update, context, query=query)
+
+
+@callbacks.route("promo_list_templates", admin=True)
+async def cb_promo_list_templates(update: Update, context: ContextTypes.DEFAULT_TYPE, query, user_id: int, arg: str):
+    """广告模板列表"""
+    await show_promo_templates(update, context, query=query)
+
+
+@callbacks.route("promo_list_tasks", prefixes=("promo_list_tasks:",), admin=True)
+async def cb_promo_list_tasks(update: Update, context: ContextTypes.DEFAULT_TYPE, query, user_id: int, arg: str):
+    """定时任务列表（分页）"""
+    after, before = parse_page_callback(query.data, "promo_list_tasks")
+    await show_scheduled_tasks(update, context, query=query, after=after, before=before)
+
+
+@callbacks.route("promo_list_schedules", admin=True)
+async def cb_promo_list_schedules(update: Update, context: ContextTypes.DEFAULT_TYPE, query, user_id: int, arg: str):
+    """重复任务列表"""
+    await show_promo_schedules(update, context, query=query)
+
+
+@callbacks.route(prefixes=("promo_stop_schedule_",), admin=True)
+async def cb_promo_stop_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE, query, user_id: int, arg: str):
+    """停用重复任务"""
+    schedule_id = int(arg)
+    db.deactivate_promo_schedule(schedule_id)
+    promo_scheduler.remove(('schedule', schedule_id))
+    await query.answer("✅ 重复任务已停用", show_alert=True)
+    await show_promo_schedules(update, context, query=query)
+
+
+@callbacks.route("promo_logs", prefixes=("promo_logs:",), admin=True)
+async def cb_promo_logs(update: Update, context: ContextTypes.DEFAULT_TYPE, query, user_id: int, arg: str):
+    """广告发送记录（分页）"""
+    after, before = parse_page_callback(query.data, "promo_logs")
+    await show_promo_logs(update, context, query=query, after=after, before=before)
+
+
+@callbacks.route("promo_create_template", admin=True)
+async def cb_promo_create_template(update: Update, context: ContextTypes.DEFAULT_TYPE, query, user_id: int, arg: str):
+    """开始创建广告模板"""
+    user_states[user_id] = {'action': 'create_promo_template', 'step': 'name'}
+    await query.edit_message_text(
+        "📝 创建广告模板\n\n"
+        "步骤 1/4: 请输入模板名称（用于识别）：\n\n"
+        "发送 /cancel 取消创建"
+    )
+
+
+@callbacks.route("promo_create_task", admin=True)
+async def cb_promo_create_task(update: Update, context: ContextTypes.DEFAULT_TYPE, query, user_id: int, arg: str):
+    """创建定时任务：选择模板"""
+    templates = db.get_all_promo_templates(active_only=True)
+    if not templates:
+        await query.answer("❌ 请先创建广告模板", show_alert=True)
+        await show_promo_menu(update, context, query=query)
+        return
     
-    elif data == "promo_logs":
-        if not is_admin(user_id):
-            await query.answer("⛔ 您没有权限", show_alert=True)
-            return
-        
-        await show_promo_logs(update, context, query=query)
+    keyboard = []
+    for tmpl in templates:
+        keyboard.append([InlineKeyboardButton(
+            tmpl['name'],
+            callback_data=f"promo_task_select_template_{tmpl['id']}"
+        )])
+    keyboard.append([InlineKeyboardButton("« 返回", callback_data="promo_manage")])
     
-    elif data == "promo_create_template":
-        if not is_admin(user_id):
-            await query.answer("⛔ 您没有权限", show_alert=True)
-            return
-        
-        user_states[user_id] = {'action': 'create_promo_template', 'step': 'name'}
-        await query.edit_message_text(
-            "📝 创建广告模板\n\n"
-            "步骤 1/4: 请输入模板名称（用于识别）：\n\n"
-            "发送 /cancel 取消创建"
-        )
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    await query.edit_message_text("⏰ 选择要使用的广告模板：", reply_markup=reply_markup)
+
+
+@callbacks.route(prefixes=("promo_task_select_template_",), admin=True)
+async def cb_promo_task_select_template(update: Update, context: ContextTypes.DEFAULT_TYPE, query, user_id: int, arg: str):
+    """创建定时任务：已选择模板，等待输入目标"""
+    template_id = int(arg)
+    user_states[user_id] = {
+        'action': 'create_scheduled_task',
+        'template_id': template_id,
+        'step': 'target_chats'
+    }
+    await query.edit_message_text(
+        "⏰ 创建定时任务\n\n"
+        "步骤 1/2: 请输入目标频道/群组 ID\n\n"
+        "格式：\n"
+        "• 单个: @channel 或 -1001234567890\n"
+        "• 多个: @channel1,@channel2,-1001234567890\n\n"
+        "发送 /cancel 取消创建"
+    )
+
+
+@callbacks.route(prefixes=("promo_use_template_",), admin=True)
+async def cb_promo_use_template(update: Update, context: ContextTypes.DEFAULT_TYPE, query, user_id: int, arg: str):
+    """立即发送：已选择模板，等待输入目标"""
+    template_id = int(arg)
+    user_states[user_id] = {
+        'action': 'send_promo_now',
+        'template_id': template_id
+    }
+    await query.edit_message_text(
+        "📤 立即发送广告\n\n"
+        "请输入目标频道/群组 ID\n\n"
+        "格式：\n"
+        "• 单个: @channel 或 -1001234567890\n"
+        "• 多个: @channel1,@channel2,-1001234567890\n\n"
+        "发送 /cancel 取消发送"
+    )
+
+
+@callbacks.route(prefixes=("promo_delete_template_",), admin=True)
+async def cb_promo_delete_template(update: Update, context: ContextTypes.DEFAULT_TYPE, query, user_id: int, arg: str):
+    """删除广告模板"""
+    template_id = int(arg)
+    db.delete_promo_template(template_id)
+    await query.answer("✅ 模板已删除", show_alert=True)
+    await show_promo_templates(update, context, query=query)
+
+
+@callbacks.route(prefixes=("promo_cancel_task_",), admin=True)
+async def cb_promo_cancel_task(update: Update, context: ContextTypes.DEFAULT_TYPE, query, user_id: int, arg: str):
+    """取消定时任务"""
+    task_id = int(arg)
+    db.cancel_scheduled_task(task_id)
+    promo_scheduler.remove(task_id)
+    await query.answer("✅ 任务已取消", show_alert=True)
+    await show_scheduled_tasks(update, context, query=query)
+
+
+@callbacks.route("promo_send_now", admin=True)
+async def cb_promo_send_now(update: Update, context: ContextTypes.DEFAULT_TYPE, query, user_id: int, arg: str):
+    """立即发送：选择模板"""
+    templates = db.get_all_promo_templates(active_only=True)
+    if not templates:
+        await query.answer("❌ 请先创建广告模板", show_alert=True)
+        await show_promo_menu(update, context, query=query)
+        return
     
-    elif data == "promo_create_task":
-        if not is_admin(user_id):
-            await query.answer("⛔ 您没有权限", show_alert=True)
-            return
-        
-        templates = db.get_all_promo_templates(active_only=True)
-        if not templates:
-            await query.answer("❌ 请先创建广告模板", show_alert=True)
-            await show_promo_menu(update, context, query=query)
-            return
-        
-        keyboard = []
-        for tmpl in templates:
-            keyboard.append([InlineKeyboardButton(
-                tmpl['name'],
-                callback_data=f"promo_task_select_template_{tmpl['id']}"
-            )])
-        keyboard.append([InlineKeyboardButton("« 返回", callback_data="promo_manage")])
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text("⏰ 选择要使用的广告模板：", reply_markup=reply_markup)
+    keyboard = []
+    for tmpl in templates:
+        keyboard.append([InlineKeyboardButton(
+            tmpl['name'],
+            callback_data=f"promo_use_template_{tmpl['id']}"
+        )])
+    keyboard.append([InlineKeyboardButton("« 返回", callback_data="promo_manage")])
     
-    elif data.startswith("promo_task_select_template_"):
-        if not is_admin(user_id):
-            await query.answer("⛔ 您没有权限", show_alert=True)
-            return
-        
-        template_id = int(data.replace("promo_task_select_template_", ""))
-        user_states[user_id] = {
-            'action': 'create_scheduled_task',
-            'template_id': template_id,
-            'step': 'target_chats'
-        }
-        await query.edit_message_text(
-            "⏰ 创建定时任务\n\n"
-            "步骤 1/2: 请输入目标频道/群组 ID\n\n"
-            "格式：\n"
-            "• 单个: @channel 或 -1001234567890\n"
-            "• 多个: @channel1,@channel2,-1001234567890\n\n"
-            "发送 /cancel 取消创建"
-        )
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    await query.edit_message_text("📤 选择要发送的广告模板：", reply_markup=reply_markup)
+
+
+# 取消订单
+@callbacks.route(prefixes=("cancel_order_",))
+async def cb_cancel_order(update: Update, context: ContextTypes.DEFAULT_TYPE, query, user_id: int, arg: str):
+    """用户取消自己的待支付订单"""
+    order_id = arg
+    order = db.get_order(order_id)
     
-    elif data.startswith("promo_use_template_"):
-        if not is_admin(user_id):
-            await query.answer("⛔ 您没有权限", show_alert=True)
-            return
-        
-        template_id = int(data.replace("promo_use_template_", ""))
-        user_states[user_id] = {
-            'action': 'send_promo_now',
-            'template_id': template_id
-        }
-        await query.edit_message_text(
-            "📤 立即发送广告\n\n"
-            "请输入目标频道/群组 ID\n\n"
-            "格式：\n"
-            "• 单个: @channel 或 -1001234567890\n"
-            "• 多个: @channel1,@channel2,-1001234567890\n\n"
-            "发送 /cancel 取消发送"
-        )
+    if not order:
+        await query.answer("❌ 订单不存在", show_alert=True)
+        return
     
-    elif data.startswith("promo_delete_template_"):
-        if not is_admin(user_id):
-            await query.answer("⛔ 您没有权限", show_alert=True)
-            return
-        
-        template_id = int(data.replace("promo_delete_template_", ""))
-        db.delete_promo_template(template_id)
-        await query.answer("✅ 模板已删除", show_alert=True)
-        await show_promo_templates(update, context, query=query)
+    if order['user_id'] != user_id:
+        await query.answer("❌ 这不是您的订单", show_alert=True)
+        return
     
-    elif data.startswith("promo_cancel_task_"):
-        if not is_admin(user_id):
-            await query.answer("⛔ 您没有权限", show_alert=True)
-            return
-        
-        task_id = int(data.replace("promo_cancel_task_", ""))
-        db.cancel_scheduled_task(task_id)
-        await query.answer("✅ 任务已取消", show_alert=True)
-        await show_scheduled_tasks(update, context, query=query)
+    # 更新订单状态为已取消（期间已支付/过期的订单不会被取消）
+    if not db.transition_order(order_id, 'pending', 'cancelled'):
+        await query.answer("❌ 该订单无法取消", show_alert=True)
+        return
+    order_limiter.order_closed(user_id)
     
-    elif data == "promo_send_now":
-        if not is_admin(user_id):
-            await query.answer("⛔ 您没有权限", show_alert=True)
-            return
-        
-        templates = db.get_all_promo_templates(active_only=True)
-        if not templates:
-            await query.answer("❌ 请先创建广告模板", show_alert=True)
-            await show_promo_menu(update, context, query=query)
-            return
-        
-        keyboard = []
-        for tmpl in templates:
-            keyboard.append([InlineKeyboardButton(
-                tmpl['name'],
-                callback_data=f"promo_use_template_{tmpl['id']}"
-            )])
-        keyboard.append([InlineKeyboardButton("« 返回", callback_data="promo_manage")])
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text("📤 选择要发送的广告模板：", reply_markup=reply_markup)
+    # 清除用户状态
+    if user_id in user_states:
+        del user_states[user_id]
     
-    # 取消订单
-    elif data.startswith("cancel_order_"):
-        order_id = data.replace("cancel_order_", "")
-        order = db.get_order(order_id)
-        
-        if not order:
-            await query.answer("❌ 订单不存在", show_alert=True)
-            return
-        
-        if order['user_id'] != user_id:
-            await query.answer("❌ 这不是您的订单", show_alert=True)
-            return
-        
-        if order['status'] != 'pending':
-            await query.answer("❌ 该订单无法取消", show_alert=True)
-            return
-        
-        # 更新订单状态为已取消
-        db.update_order_status(order_id, 'cancelled')
-        
-        # 清除用户状态
-        if user_id in user_states:
-            del user_states[user_id]
-        
-        await query.answer("✅ 订单已取消", show_alert=True)
-        
-        # 返回主菜单
-        welcome_text = WELCOME_MESSAGE
-        keyboard = []
-        
-        if ENABLE_MULTIPLE_PLANS:
-            usdt_btn_text = "💎 USDT 支付"
-            xianyu_btn_text = "🏪 闲鱼支付"
-        else:
-            usdt_btn_text = f"💎 USDT 支付 - {DEFAULT_PLAN['price_usdt']} USDT"
-            xianyu_btn_text = f"🏪 闲鱼支付 - ¥{DEFAULT_PLAN['price_cny']}"
-        
-        keyboard.append([
-            InlineKeyboardButton(usdt_btn_text, callback_data="direct_usdt_payment"),
-            InlineKeyboardButton(xianyu_btn_text, callback_data="direct_xianyu_payment")
-        ])
-        keyboard.append([
-            InlineKeyboardButton("📋 我的订单", callback_data="my_orders"),
-            InlineKeyboardButton("👤 会员状态", callback_data="my_status")
-        ])
-        keyboard.append([
-            InlineKeyboardButton("👨‍💼 联系客服", url=CUSTOMER_SERVICE_URL),
-            InlineKeyboardButton("❓ 使用帮助", callback_data="help")
-        ])
-        
-        if is_admin(user_id):
-            keyboard.append([InlineKeyboardButton("👑 管理员面板", callback_data="admin_panel")])
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text(welcome_text, reply_markup=reply_markup)
+    await query.answer("✅ 订单已取消", show_alert=True)
     
     # 返回主菜单
-    elif data == "back_to_main":
-        # 清除用户状态
-        if user_id in user_states:
-            del user_states[user_id]
-        
-        # 使用自定义欢迎消息
-        welcome_text = WELCOME_MESSAGE
-        
-        # 构建按钮布局（与 start_command 相同）
-        keyboard = []
-        
-        # 第一行：支付方式
-        # 根据配置决定按钮文字
-        if ENABLE_MULTIPLE_PLANS:
-            usdt_btn_text = "💎 USDT 支付"
-            xianyu_btn_text = "🏪 闲鱼支付"
-        else:
-            usdt_btn_text = f"💎 USDT 支付 - {DEFAULT_PLAN['price_usdt']} USDT"
-            xianyu_btn_text = f"🏪 闲鱼支付 - ¥{DEFAULT_PLAN['price_cny']}"
-        
-        keyboard.append([
-            InlineKeyboardButton(usdt_btn_text, callback_data="direct_usdt_payment"),
-            InlineKeyboardButton(xianyu_btn_text, callback_data="direct_xianyu_payment")
-        ])
-        
-        # 第二行：查询功能
-        keyboard.append([
-            InlineKeyboardButton("📋 我的订单", callback_data="my_orders"),
-            InlineKeyboardButton("👤 会员状态", callback_data="my_status")
-        ])
-        
-        # 第三行：客服和帮助
-        keyboard.append([
-            InlineKeyboardButton("👨‍💼 联系客服", url=CUSTOMER_SERVICE_URL),
-            InlineKeyboardButton("❓ 使用帮助", callback_data="help")
-        ])
-        
-        # 管理员功能
-        if is_admin(user_id):
-            keyboard.append([InlineKeyboardButton("👑 管理员面板", callback_data="admin_panel")])
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        # 判断当前消息是否有照片（如USDT支付页面）
-        try:
-            if query.message.photo:
-                # 如果是图片消息，发送新消息并删除旧消息
-                await context.bot.send_message(
-                    chat_id=user_id,
-                    text=welcome_text,
-                    reply_markup=reply_markup
-                )
-                await query.message.delete()
-            else:
-                # 普通文本消息，直接编辑
-                await query.edit_message_text(welcome_text, reply_markup=reply_markup)
-        except Exception as e:
-            # 如果编辑失败（如消息太旧），发送新消息
+    menu = screens.get('main_menu', is_admin(user_id))
+    await query.edit_message_text(menu.text, reply_markup=menu.reply_markup)
+
+
+# 返回主菜单
+@callbacks.route("back_to_main")
+async def cb_back_to_main(update: Update, context: ContextTypes.DEFAULT_TYPE, query, user_id: int, arg: str):
+    """返回主菜单"""
+    # 清除用户状态
+    if user_id in user_states:
+        del user_states[user_id]
+    
+    menu = screens.get('main_menu', is_admin(user_id))
+    welcome_text = menu.text
+    reply_markup = menu.reply_markup
+    
+    # 判断当前消息是否有照片（如USDT支付页面）
+    try:
+        if query.message.photo:
+            # 如果是图片消息，发送新消息并删除旧消息
             await context.bot.send_message(
                 chat_id=user_id,
                 text=welcome_text,
                 reply_markup=reply_markup
             )
+            await query.message.delete()
+        else:
+            # 普通文本消息，直接编辑
+            await query.edit_message_text(welcome_text, reply_markup=reply_markup)
+    except Exception as e:
+        # 如果编辑失败（如消息太旧），发送新消息
+        await context.bot.send_message(
+            chat_id=user_id,
+            text=welcome_text,
+            reply_markup=reply_markup
+        )
 
 
 # ========== 业务逻辑函数 ==========
@@ -1144,35 +1304,8 @@ async def show_membership_plans(update: Update, context: ContextTypes.DEFAULT_TY
     Args:
         payment_method: 如果提供，选择套餐后直接跳转到该支付方式（'usdt' 或 'xianyu'）
     """
-    if payment_method == 'usdt':
-        text = "💎 USDT 支付 - 选择会员套餐：\n\n"
-    elif payment_method == 'xianyu':
-        text = "🏪 闲鱼支付 - 选择会员套餐：\n\n"
-    else:
-        text = "💎 选择会员套餐：\n\n"
-    
-    keyboard = []
-    
-    for plan_key, plan_info in MEMBERSHIP_PLANS.items():
-        text += f"🔹 {plan_info['name']}\n"
-        text += f"   时长: {plan_info['days']} 天\n"
-        text += f"   USDT: {plan_info['price_usdt']} | 人民币: ¥{plan_info['price_cny']}\n\n"
-        
-        # 如果已选择支付方式，直接跳转到支付处理
-        if payment_method == 'usdt':
-            callback_data = f"pay_tron_{plan_key}"
-        elif payment_method == 'xianyu':
-            callback_data = f"pay_xianyu_{plan_key}"
-        else:
-            callback_data = f"plan_{plan_key}"
-        
-        keyboard.append([InlineKeyboardButton(
-            f"{plan_info['name']} - {plan_info['days']}天",
-            callback_data=callback_data
-        )])
-    
-    keyboard.append([InlineKeyboardButton("« 返回", callback_data="back_to_main")])
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    screen = screens.get('membership_plans', payment_method)
+    text, reply_markup = screen.text, screen.reply_markup
     
     if query:
         await query.edit_message_text(text, reply_markup=reply_markup)
@@ -1182,132 +1315,31 @@ async def show_membership_plans(update: Update, context: ContextTypes.DEFAULT_TY
 
 async def show_payment_methods(update: Update, context: ContextTypes.DEFAULT_TYPE, plan_type: str, query=None):
     """显示支付方式"""
-    plan_info = MEMBERSHIP_PLANS.get(plan_type)
+    screen = screens.get('payment_methods', plan_type)
     
-    if not plan_info:
+    if not screen:
         await query.edit_message_text("套餐不存在")
         return
     
-    text = f"""
-您选择的套餐：{plan_info['name']}
+    await query.edit_message_text(screen.text, reply_markup=screen.reply_markup)
 
-请选择支付方式：
-"""
-    
-    keyboard = [
-        [InlineKeyboardButton(
-            f"💎 USDT (TRC20) - {plan_info['price_usdt']} USDT",
-            callback_data=f"pay_tron_{plan_type}"
-        )],
-        [InlineKeyboardButton(
-            f"🛒 闲鱼支付 - ¥{plan_info['price_cny']}",
-            callback_data=f"pay_xianyu_{plan_type}"
-        )],
-        [InlineKeyboardButton("« 返回套餐选择", callback_data="buy_membership")]
-    ]
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await query.edit_message_text(text, reply_markup=reply_markup)
-
-
-async def process_payment_selection(update: Update, context: ContextTypes.DEFAULT_TYPE, 
-                                   method: str, plan_type: str, query=None):
-    """处理支付方式选择"""
-    user_id = update.effective_user.id
-    plan_info = MEMBERSHIP_PLANS.get(plan_type)
-    
-    if not plan_info:
-        await query.edit_message_text("套餐不存在")
-        return
-    
-    # 检查防刷限制 - 待支付订单数量
-    pending_count = db.count_user_pending_orders(user_id)
-    if pending_count >= MAX_PENDING_ORDERS_PER_USER:
-        await query.answer("⚠️ 待支付订单已达上限", show_alert=True)
-        
-        from config import XIANYU_ORDER_TIMEOUT_MINUTES
-        message = f"""
-⚠️ **订单数量已达上限**
-
-您当前有 **{pending_count}** 个待支付订单
-系统限制：最多 **{MAX_PENDING_ORDERS_PER_USER}** 个待支付订单
-
-📋 **如何处理：**
-
-1️⃣ **查看订单** - 点击下方「📋 我的订单」
-2️⃣ **完成支付** - 如果准备购买，请尽快支付
-3️⃣ **取消订单** - 不再购买可以取消订单
-
-⏰ **自动清理**
-超过 {XIANYU_ORDER_TIMEOUT_MINUTES} 分钟未支付的订单会自动过期
-
-💡 订单过期或取消后，您就可以创建新订单了
-"""
-        keyboard = [
-            [InlineKeyboardButton("📋 我的订单", callback_data='my_orders')],
-            [InlineKeyboardButton("« 返回主菜单", callback_data='back_to_main')]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text(text=message, reply_markup=reply_markup, parse_mode='Markdown')
-        return
-    
-    # 检查防刷限制 - 下单时间间隔
-    last_order_time = db.get_user_last_order_time(user_id)
-    if last_order_time:
-        time_since_last = (datetime.now() - last_order_time).total_seconds()
-        if time_since_last < MIN_ORDER_INTERVAL_SECONDS:
-            wait_time = int(MIN_ORDER_INTERVAL_SECONDS - time_since_last)
-            
-            await query.answer(f"⏳ 请等待 {wait_time} 秒", show_alert=True)
-            
-            message = f"""
-⏳ **下单过于频繁**
-
-为了防止误操作和刷单，系统限制了下单速度。
-
-⏰ **请等待：{wait_time} 秒**
-
-💡 **提示**
-系统会在 {wait_time} 秒后自动允许您创建新订单
-请稍候片刻再试
-
-🔒 **防刷保护**
-这是为了保护您的账户安全和系统稳定性
-"""
-            keyboard = [[InlineKeyboardButton("« 返回主菜单", callback_data='back_to_main')]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.edit_message_text(text=message, reply_markup=reply_markup, parse_mode='Markdown')
-            return
-    
-    if method == 'tron':
-        await process_tron_payment(update, context, plan_type, plan_info, query)
-    elif method == 'xianyu':
-        await process_xianyu_payment(update, context, plan_type, plan_info, query)
-
-
-async def create_xianyu_order_direct(update: Update, context: ContextTypes.DEFAULT_TYPE, 
-                                     plan_type: str, plan_info: dict, query):
-    """单套餐模式：直接创建闲鱼订单"""
-    user_id = update.effective_user.id
-    logger.info(f"create_xianyu_order_direct: Starting for user {user_id}")
-    
-    # 检查防刷限制
-    logger.info(f"Checking pending orders for user {user_id}")
-    try:
-        pending_count = db.count_user_pending_orders(user_id)
-        logger.info(f"User {user_id} has {pending_count} pending orders")
-    except Exception as e:
-        logger.error(f"Error counting pending orders: {e}", exc_info=True)
-        await query.answer("❌ 系统错误，请稍后重试", show_alert=True)
-        return
-    if pending_count >= MAX_PENDING_ORDERS_PER_USER:
-        logger.warning(f"User {user_id} blocked due to too many pending orders: {pending_count}/{MAX_PENDING_ORDERS_PER_USER}")
-        
-        # 发送弹窗提示
+
+async def check_order_limits(user_id: int, query) -> bool:
+    """下单前的防刷检查（内存计数，只在待支付订单数达到上限时查库确认），超限时提示用户并返回 False"""
+    limit = order_limiter.check(user_id)
+    if limit is not None and limit[0] == 'pending':
+        # 订单可能在本进程之外被清理/取消（manage.py、其他 Bot 进程），以数据库为准
+        order_limiter.set_pending(user_id, db.count_user_pending_orders(user_id))
+        limit = order_limiter.check(user_id)
+    if limit is None:
+        return True
+    
+    reason, value = limit
+    if reason == 'pending':
+        pending_count = value
+        logger.warning(f"User {user_id} blocked due to too many pending orders: "
+                       f"{pending_count}/{MAX_PENDING_ORDERS_PER_USER}")
         await query.answer("⚠️ 待支付订单已达上限", show_alert=True)
-        
-        # 发送详细的消息到聊天窗口
-        from config import XIANYU_ORDER_TIMEOUT_MINUTES
         message = f"""
 ⚠️ **订单数量已达上限**
 
@@ -1316,46 +1348,23 @@ async def create_xianyu_order_direct(update: Update, context: ContextTypes.DEFAU
 
 📋 **如何处理：**
 
-1️⃣ **查看订单**
-   点击下方「📋 我的订单」查看待支付订单
-
-2️⃣ **完成支付**
-   如果准备购买，请尽快完成支付
-
-3️⃣ **取消订单**
-   如果不再购买，可以在订单中点击取消
+1️⃣ **查看订单** - 点击下方「📋 我的订单」
+2️⃣ **完成支付** - 如果准备购买，请尽快支付
+3️⃣ **取消订单** - 不再购买可以取消订单
 
 ⏰ **自动清理**
-   超过 {XIANYU_ORDER_TIMEOUT_MINUTES} 分钟未支付的订单会自动过期
+超过 {XIANYU_ORDER_TIMEOUT_MINUTES} 分钟未支付的订单会自动过期
 
-💡 **提示**
-   订单过期或取消后，您就可以创建新订单了
+💡 订单过期或取消后，您就可以创建新订单了
 """
-        
         keyboard = [
             [InlineKeyboardButton("📋 我的订单", callback_data='my_orders')],
             [InlineKeyboardButton("« 返回主菜单", callback_data='back_to_main')]
         ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await query.edit_message_text(
-            text=message,
-            reply_markup=reply_markup,
-            parse_mode='Markdown'
-        )
-        return
-    
-    last_order_time = db.get_user_last_order_time(user_id)
-    if last_order_time:
-        time_since_last = (datetime.now() - last_order_time).total_seconds()
-        if time_since_last < MIN_ORDER_INTERVAL_SECONDS:
-            wait_time = int(MIN_ORDER_INTERVAL_SECONDS - time_since_last)
-            
-            # 发送弹窗提示
-            await query.answer(f"⏳ 请等待 {wait_time} 秒", show_alert=True)
-            
-            # 发送详细消息
-            message = f"""
+    else:
+        wait_time = value
+        await query.answer(f"⏳ 请等待 {wait_time} 秒", show_alert=True)
+        message = f"""
 ⏳ **下单过于频繁**
 
 为了防止误操作和刷单，系统限制了下单速度。
@@ -1369,16 +1378,52 @@ async def create_xianyu_order_direct(update: Update, context: ContextTypes.DEFAU
 🔒 **防刷保护**
 这是为了保护您的账户安全和系统稳定性
 """
-            
-            keyboard = [[InlineKeyboardButton("« 返回主菜单", callback_data='back_to_main')]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await query.edit_message_text(
-                text=message,
-                reply_markup=reply_markup,
-                parse_mode='Markdown'
-            )
-            return
+        keyboard = [[InlineKeyboardButton("« 返回主菜单", callback_data='back_to_main')]]
+    
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    await query.edit_message_text(text=message, reply_markup=reply_markup, parse_mode='Markdown')
+    return False
+
+
+def create_pending_order(order_data: dict) -> bool:
+    """创建待支付订单并计入防刷限制"""
+    if not db.create_order(order_data):
+        return False
+    order_limiter.order_created(order_data['user_id'])
+    if order_data['payment_method'] == 'xianyu':
+        xianyu_awaiting_users.add(order_data['user_id'])
+    return True
+
+
+async def process_payment_selection(update: Update, context: ContextTypes.DEFAULT_TYPE, 
+                                   method: str, plan_type: str, query=None):
+    """处理支付方式选择"""
+    user_id = update.effective_user.id
+    plan_info = MEMBERSHIP_PLANS.get(plan_type)
+    
+    if not plan_info:
+        await query.edit_message_text("套餐不存在")
+        return
+    
+    # 检查防刷限制（待支付订单数量、下单时间间隔）
+    if not await check_order_limits(user_id, query):
+        return
+    
+    if method == 'tron':
+        await process_tron_payment(update, context, plan_type, plan_info, query)
+    elif method == 'xianyu':
+        await process_xianyu_payment(update, context, plan_type, plan_info, query)
+
+
+async def create_xianyu_order_direct(update: Update, context: ContextTypes.DEFAULT_TYPE, 
+                                     plan_type: str, plan_info: dict, query):
+    """单套餐模式：直接创建闲鱼订单"""
+    user_id = update.effective_user.id
+    logger.info(f"create_xianyu_order_direct: Starting for user {user_id}")
+    
+    # 检查防刷限制（待支付订单数量、下单时间间隔）
+    if not await check_order_limits(user_id, query):
+        return
     
     # 创建订单
     order_id = f"XY_{user_id}_{int(time.time())}"
@@ -1386,7 +1431,7 @@ async def create_xianyu_order_direct(update: Update, context: ContextTypes.DEFAU
     logger.info(f"Order data: user_id={user_id}, plan_type={plan_type}, amount={plan_info['price_cny']}")
     
     try:
-        success = db.create_order({
+        success = create_pending_order({
             'order_id': order_id,
             'user_id': user_id,
             'payment_method': 'xianyu',
@@ -1394,7 +1439,8 @@ async def create_xianyu_order_direct(update: Update, context: ContextTypes.DEFAU
             'amount': plan_info['price_cny'],
             'currency': 'CNY',
             'status': 'pending',
-            'membership_days': plan_info['days']
+            'membership_days': plan_info['days'],
+            'expires_at': datetime.now() + timedelta(minutes=XIANYU_ORDER_TIMEOUT_MINUTES)
         })
         
         if not success:
@@ -1486,7 +1532,7 @@ async def process_tron_payment(update: Update, context: ContextTypes.DEFAULT_TYP
         
         # 保存到数据库
         order_id = f"TG_{user_id}_{int(time.time())}"
-        db.create_order({
+        create_pending_order({
             'order_id': order_id,
             'user_id': user_id,
             'payment_method': 'tron',
@@ -1495,7 +1541,8 @@ async def process_tron_payment(update: Update, context: ContextTypes.DEFAULT_TYP
             'currency': 'USDT',
             'status': 'pending',
             'membership_days': plan_info['days'],
-            'tron_order_id': tron_order['order_id']
+            'tron_order_id': tron_order['order_id'],
+            'expires_at': datetime.now() + timedelta(minutes=ORDER_TIMEOUT_MINUTES)
         })
         
         # 发送支付信息
@@ -1591,7 +1638,7 @@ async def process_xianyu_payment(update: Update, context: ContextTypes.DEFAULT_T
     
     # 创建订单
     order_id = f"XY_{user_id}_{int(time.time())}"
-    db.create_order({
+    create_pending_order({
         'order_id': order_id,
         'user_id': user_id,
         'payment_method': 'xianyu',
@@ -1599,7 +1646,8 @@ async def process_xianyu_payment(update: Update, context: ContextTypes.DEFAULT_T
         'amount': plan_info['price_cny'],
         'currency': 'CNY',
         'status': 'pending',
-        'membership_days': plan_info['days']
+        'membership_days': plan_info['days'],
+        'expires_at': datetime.now() + timedelta(minutes=XIANYU_ORDER_TIMEOUT_MINUTES)
     })
     
     # 保存用户状态，等待订单号
@@ -1660,9 +1708,11 @@ async def process_xianyu_payment(update: Update, context: ContextTypes.DEFAULT_T
     db.add_log('order_created', user_id, order_id, f'Xianyu order created: {plan_type}')
 
 
-async def show_pending_orders(update: Update, context: ContextTypes.DEFAULT_TYPE, query=None):
-    """显示待审核订单"""
-    orders = db.get_pending_xianyu_orders()
+async def show_pending_orders(update: Update, context: ContextTypes.DEFAULT_TYPE, query=None,
+                              after: str = None, before: str = None):
+    """显示待审核订单（每页5个）"""
+    page = db.get_pending_xianyu_orders_page(limit=5, after=after, before=before)
+    orders = page.items
     
     if not orders:
         text = "✅ 暂无待审核订单"
@@ -1675,7 +1725,7 @@ async def show_pending_orders(update: Update, context: ContextTypes.DEFAULT_TYPE
             await update.message.reply_text(text, reply_markup=reply_markup)
         return
     
-    for order in orders[:5]:  # 每次显示5个
+    for order in orders:
         user = db.get_user(order['user_id'])
         plan_info = MEMBERSHIP_PLANS.get(order['plan_type'], {})
         
@@ -1706,40 +1756,29 @@ async def show_pending_orders(update: Update, context: ContextTypes.DEFAULT_TYPE
             )
         else:
             await update.message.reply_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+    
+    # 还有更多订单时单独发送翻页按钮
+    nav_row = page_nav_row("admin_pending_orders", page)
+    if nav_row:
+        await context.bot.send_message(
+            chat_id=update.effective_user.id,
+            text="📄 还有更多待审核订单",
+            reply_markup=InlineKeyboardMarkup([nav_row, [InlineKeyboardButton("« 返回", callback_data="admin_panel")]])
+        )
 
 
 async def approve_order(update: Update, context: ContextTypes.DEFAULT_TYPE, order_id: str, query):
     """批准订单"""
-    order = db.get_order(order_id)
+    # pending -> paid + 激活会员 + 累计消费（同一事务，只有一次点击能成功）
+    order = db.activate_order(order_id)
     
     if not order:
-        await query.answer("订单不存在", show_alert=True)
-        return
-    
-    if order['status'] != 'pending':
-        await query.answer("订单状态不正确", show_alert=True)
+        if db.get_order(order_id) is None:
+            await query.answer("订单不存在", show_alert=True)
+        else:
+            await query.answer("订单状态不正确（可能已被处理）", show_alert=True)
         return
-    
-    # 更新订单状态
-    db.update_order_status(order_id, 'paid')
-    
-    # 更新用户会员状态
-    db.update_user_membership(order['user_id'], order['membership_days'], order_id)
-    
-    # 更新用户消费统计
-    user = db.get_user(order['user_id'])
-    if order['currency'] == 'USDT':
-        new_usdt = (user['total_spent_usdt'] or 0) + order['amount']
-        db.get_connection().execute(
-            "UPDATE users SET total_spent_usdt=? WHERE user_id=?",
-            (new_usdt, order['user_id'])
-        )
-    else:
-        new_cny = (user['total_spent_cny'] or 0) + order['amount']
-        db.get_connection().execute(
-            "UPDATE users SET total_spent_cny=? WHERE user_id=?",
-            (new_cny, order['user_id'])
-        )
+    order_limiter.order_closed(order['user_id'])
     
     # 邀请用户加入频道
     await invite_user_to_channel(context.application, order['user_id'], order_id)
@@ -1759,14 +1798,15 @@ async def approve_order(update: Update, context: ContextTypes.DEFAULT_TYPE, orde
 
 async def reject_order(update: Update, context: ContextTypes.DEFAULT_TYPE, order_id: str, query):
     """拒绝订单"""
-    order = db.get_order(order_id)
+    order = db.transition_order(order_id, 'pending', 'cancelled', admin_notes='Rejected by admin')
     
     if not order:
-        await query.answer("订单不存在", show_alert=True)
+        if db.get_order(order_id) is None:
+            await query.answer("订单不存在", show_alert=True)
+        else:
+            await query.answer("订单状态不正确（可能已被处理）", show_alert=True)
         return
-    
-    # 更新订单状态
-    db.update_order_status(order_id, 'cancelled', admin_notes='Rejected by admin')
+    order_limiter.order_closed(order['user_id'])
     
     # 通知用户
     await context.bot.send_message(
@@ -1786,11 +1826,13 @@ async def show_promo_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, qu
     """显示广告管理菜单"""
     templates = db.get_all_promo_templates(active_only=True)
     tasks = db.get_all_scheduled_tasks(status='pending')
+    schedules = db.get_active_promo_schedules()
     
     text = f"""📢 广告管理
 
 📝 广告模板: {len(templates)} 个
 ⏰ 待发送任务: {len(tasks)} 个
+🔁 重复任务: {len(schedules)} 个
 
 选择操作："""
     
@@ -1799,6 +1841,7 @@ async def show_promo_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, qu
         [InlineKeyboardButton("📝 查看模板列表", callback_data="promo_list_templates")],
         [InlineKeyboardButton("⏰ 创建定时任务", callback_data="promo_create_task")],
         [InlineKeyboardButton("📋 查看任务列表", callback_data="promo_list_tasks")],
+        [InlineKeyboardButton("🔁 重复任务", callback_data="promo_list_schedules")],
         [InlineKeyboardButton("📤 立即发送广告", callback_data="promo_send_now")],
         [InlineKeyboardButton("📊 发送记录", callback_data="promo_logs")],
         [InlineKeyboardButton("🔙 返回管理面板", callback_data="admin_panel")]
@@ -1846,9 +1889,11 @@ async def show_promo_templates(update: Update, context: ContextTypes.DEFAULT_TYP
         await update.message.reply_text(text, reply_markup=reply_markup)
 
 
-async def show_scheduled_tasks(update: Update, context: ContextTypes.DEFAULT_TYPE, query=None):
-    """显示定时任务列表"""
-    tasks = db.get_all_scheduled_tasks()
+async def show_scheduled_tasks(update: Update, context: ContextTypes.DEFAULT_TYPE, query=None,
+                               after: str = None, before: str = None):
+    """显示定时任务列表（每页10个）"""
+    page = db.get_scheduled_tasks_page(limit=10, after=after, before=before)
+    tasks = page.items
     
     if not tasks:
         text = "⏰ 还没有创建任何定时任务\n\n点击下方按钮创建任务："
@@ -1860,7 +1905,7 @@ async def show_scheduled_tasks(update: Update, context: ContextTypes.DEFAULT_TYP
         text = "⏰ 定时任务列表：\n\n"
         keyboard = []
         
-        for task in tasks[:10]:  # 只显示前10个
+        for task in tasks:
             template = db.get_promo_template(task['template_id'])
             template_name = template['name'] if template else '未知模板'
             
@@ -1881,6 +1926,46 @@ async def show_scheduled_tasks(update: Update, context: ContextTypes.DEFAULT_TYP
                     InlineKeyboardButton("🚫 取消", callback_data=f"promo_cancel_task_{task['id']}")
                 ])
         
+        nav_row = page_nav_row("promo_list_tasks", page)
+        if nav_row:
+            keyboard.append(nav_row)
+        keyboard.append([InlineKeyboardButton("➕ 创建新任务", callback_data="promo_create_task")])
+        keyboard.append([InlineKeyboardButton("🔙 返回", callback_data="promo_manage")])
+    
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    
+    if query:
+        await query.edit_message_text(text, reply_markup=reply_markup)
+    else:
+        await update.message.reply_text(text, reply_markup=reply_markup)
+
+
+async def show_promo_schedules(update: Update, context: ContextTypes.DEFAULT_TYPE, query=None):
+    """显示启用中的重复发送规则"""
+    schedules = db.get_active_promo_schedules()
+    
+    if not schedules:
+        text = "🔁 还没有重复任务\n\n创建定时任务时输入重复规则（如 every 2h）即可创建："
+        keyboard = [
+            [InlineKeyboardButton("➕ 创建任务", callback_data="promo_create_task")],
+            [InlineKeyboardButton("🔙 返回", callback_data="promo_manage")]
+        ]
+    else:
+        text = "🔁 重复任务列表：\n\n"
+        keyboard = []
+        
+        for schedule in schedules:
+            template = db.get_promo_template(schedule['template_id'])
+            template_name = template['name'] if template else '未知模板'
+            
+            text += f"🔹 #{schedule['id']} {template_name}\n"
+            text += f"   规则: {schedule['rule']}\n"
+            text += f"   下次发送: {schedule['next_run']}\n"
+            text += f"   目标: {schedule['target_chats']}\n\n"
+            keyboard.append([
+                InlineKeyboardButton(f"🚫 停用 #{schedule['id']}", callback_data=f"promo_stop_schedule_{schedule['id']}")
+            ])
+        
         keyboard.append([InlineKeyboardButton("➕ 创建新任务", callback_data="promo_create_task")])
         keyboard.append([InlineKeyboardButton("🔙 返回", callback_data="promo_manage")])
     
@@ -1892,9 +1977,11 @@ async def show_scheduled_tasks(update: Update, context: ContextTypes.DEFAULT_TYP
         await update.message.reply_text(text, reply_markup=reply_markup)
 
 
-async def show_promo_logs(update: Update, context: ContextTypes.DEFAULT_TYPE, query=None):
-    """显示广告发送记录"""
-    logs = db.get_promo_logs(limit=20)
+async def show_promo_logs(update: Update, context: ContextTypes.DEFAULT_TYPE, query=None,
+                          after: str = None, before: str = None):
+    """显示广告发送记录（每页20条）"""
+    page = db.get_promo_logs_page(limit=20, after=after, before=before)
+    logs = page.items
     
     if not logs:
         text = "📊 还没有发送记录"
@@ -1910,7 +1997,11 @@ async def show_promo_logs(update: Update, context: ContextTypes.DEFAULT_TYPE, qu
                 text += f"   错误: {log['error_message']}\n"
             text += "\n"
     
-    keyboard = [[InlineKeyboardButton("🔙 返回", callback_data="promo_manage")]]
+    keyboard = []
+    nav_row = page_nav_row("promo_logs", page)
+    if nav_row:
+        keyboard.append(nav_row)
+    keyboard.append([InlineKeyboardButton("🔙 返回", callback_data="promo_manage")])
     reply_markup = InlineKeyboardMarkup(keyboard)
     
     if query:
@@ -1919,50 +2010,104 @@ async def show_promo_logs(update: Update, context: ContextTypes.DEFAULT_TYPE, qu
         await update.message.reply_text(text, reply_markup=reply_markup)
 
 
-async def send_promo_message(app: Application, template_id: int, target_chat: str, task_id: int = None) -> bool:
-    """发送广告消息到指定频道/群组"""
-    try:
-        template = db.get_promo_template(template_id)
-        if not template:
-            db.add_promo_log(template_id, target_chat, 'failed', task_id, error_message='Template not found')
-            return False
-        
-        # 创建按钮
-        keyboard = None
-        if template['button_text'] and template['button_url']:
-            keyboard = [[InlineKeyboardButton(template['button_text'], url=template['button_url'])]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-        else:
-            reply_markup = None
-        
-        # 判断是否有图片
-        if template.get('image_file_id'):
+def get_promo_content(template_id: int):
+    """
+    广告模板和构建好的按钮（按模板版本缓存，模板修改/删除后自动重建）
+    
+    Returns:
+        (模板, reply_markup)，模板不存在时为 (None, None)
+    """
+    version = db.promo_template_version(template_id)
+    cached = promo_content_cache.get(template_id)
+    if cached is not None and cached[0] == version:
+        return cached[1], cached[2]
+    
+    template = db.get_promo_template(template_id)
+    if not template:
+        return None, None
+    
+    # 创建按钮
+    if template['button_text'] and template['button_url']:
+        keyboard = [[InlineKeyboardButton(template['button_text'], url=template['button_url'])]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+    else:
+        reply_markup = None
+    
+    promo_content_cache[template_id] = (version, template, reply_markup)
+    return template, reply_markup
+
+
+async def broadcast_promo(app: Application, template_id: int, target_chats: list,
+                          task_id: int = None, on_progress=None) -> dict:
+    """
+    把广告并发发送到多个频道/群组，每个目标的结果即时写入发送记录
+    
+    Args:
+        on_progress: 每完成一个目标调用 on_progress(progress, total)，
+            progress 为 {'done', 'success', 'failed'}（可以是协程函数）
+    
+    Returns:
+        BroadcastEngine.deliver 的统计结果
+    """
+    template, reply_markup = get_promo_content(template_id)
+    if not template:
+        for chat in target_chats:
+            db.add_promo_log(template_id, chat, 'failed', task_id, error_message='Template not found')
+        return {'success': 0, 'failed': len(target_chats), 'elapsed': 0.0,
+                'errors': [(chat, 'Template not found') for chat in target_chats]}
+    
+    image_file_id = template['image_file_id']
+    message = template['message']
+    
+    async def send(chat: str):
+        if image_file_id:
             # 有图片：发送图片消息
-            caption = template['message'] if template['message'] else None
-            sent_message = await app.bot.send_photo(
-                chat_id=target_chat,
-                photo=template['image_file_id'],
-                caption=caption,
-                reply_markup=reply_markup
+            return await media_cache.send_photo(
+                image_file_id,
+                lambda photo: app.bot.send_photo(
+                    chat_id=chat,
+                    photo=photo,
+                    caption=message or None,
+                    reply_markup=reply_markup
+                )
             )
+        # 无图片：发送纯文字消息
+        return await app.bot.send_message(
+            chat_id=chat,
+            text=message,
+            reply_markup=reply_markup
+        )
+    
+    progress = {'done': 0, 'success': 0, 'failed': 0}
+    # 发送记录排入写队列不等待提交（不阻塞事件循环，多条记录合并提交），全部发完后统一等待
+    pending_logs = []
+    
+    def on_result(chat: str, ok: bool, result):
+        progress['done'] += 1
+        if ok:
+            progress['success'] += 1
+            pending_logs.append(db.submit_promo_log(
+                template_id, chat, 'success', task_id, message_id=result.message_id
+            ))
+            logger.info(f"Promo message sent to {chat}: template {template_id}")
         else:
-            # 无图片：发送纯文字消息
-            sent_message = await app.bot.send_message(
-                chat_id=target_chat,
-                text=template['message'],
-                reply_markup=reply_markup
-            )
-        
-        # 记录成功
-        db.add_promo_log(template_id, target_chat, 'success', task_id, message_id=sent_message.message_id)
-        logger.info(f"Promo message sent to {target_chat}: template {template_id}")
-        return True
-        
-    except TelegramError as e:
-        # 记录失败
-        db.add_promo_log(template_id, target_chat, 'failed', task_id, error_message=str(e))
-        logger.error(f"Failed to send promo to {target_chat}: {e}")
-        return False
+            progress['failed'] += 1
+            pending_logs.append(db.submit_promo_log(
+                template_id, chat, 'failed', task_id, error_message=result
+            ))
+            logger.error(f"Failed to send promo to {chat}: {result}")
+        if on_progress:
+            return on_progress(progress, len(target_chats))
+    
+    try:
+        return await promo_broadcaster.deliver(target_chats, send, on_result)
+    finally:
+        # 任务标记完成之前确认发送记录都已提交（中断后续发依赖这些记录）
+        results = await asyncio.gather(*(asyncio.wrap_future(f) for f in pending_logs),
+                                       return_exceptions=True)
+        failures = [r for r in results if isinstance(r, BaseException)]
+        if failures:
+            logger.error(f"Failed to record {len(failures)} promo log(s): {failures[0]}")
 
 
 # ========== 消息处理 ==========
@@ -1995,6 +2140,14 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("❓ 当前不需要图片，请使用命令与我交互")
 
 
+async def reply_xianyu_order_closed(update: Update, order_id: str):
+    """提交闲鱼订单号时订单已超时关闭/已处理"""
+    await update.message.reply_text(
+        f"⚠️ 订单 {order_id} 已超时关闭或已处理，无法再提交闲鱼订单编号\n\n"
+        "如需购买，请重新下单"
+    )
+
+
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """处理普通消息"""
     user_id = update.effective_user.id
@@ -2027,8 +2180,11 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             order_id = state['order_id']
             xianyu_order = text.strip()
             
-            # 更新订单
-            db.update_order_status(order_id, 'pending', xianyu_order_number=xianyu_order)
+            # 更新订单（订单仍待审核且尚未填写订单号时才写入）
+            if not db.submit_xianyu_order_number(order_id, xianyu_order):
+                del user_states[user_id]
+                await reply_xianyu_order_closed(update, order_id)
+                return
             
             await update.message.reply_text(
                 f"✅ 已收到您的订单编号：{xianyu_order}\n\n"
@@ -2057,30 +2213,27 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
     
     # 🆕 智能识别：检查用户是否有待提交订单号的闲鱼订单
-    # 即使 Bot 重启导致 user_states 丢失，也能通过数据库识别
-    conn = db.get_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT order_id FROM orders
-        WHERE user_id=? 
-        AND payment_method='xianyu' 
-        AND status='pending'
-        AND (xianyu_order_number IS NULL OR xianyu_order_number='')
-        ORDER BY created_at DESC
-        LIMIT 1
-    """, (user_id,))
-    row = cursor.fetchone()
-    conn.close()
-    
-    if row:
+    # 即使对话状态已过期，也能通过数据库识别；不在集合中的用户不查数据库
+    order_id = None
+    if user_id in xianyu_awaiting_users:
+        order_id = db.get_xianyu_awaiting_order_id(user_id)
+        if order_id is None:
+            # 订单已提交/支付/取消/过期
+            xianyu_awaiting_users.discard(user_id)
+    
+    if order_id:
         # 用户有一个待填写订单号的闲鱼订单
-        order_id = row[0]
         xianyu_order = text.strip()
         
         # 验证输入是否像订单号（至少5位数字或字母数字组合）
         if len(xianyu_order) >= 5 and not xianyu_order.startswith('/'):
-            # 更新订单
-            db.update_order_status(order_id, 'pending', xianyu_order_number=xianyu_order)
+            # 更新订单（订单仍待审核且尚未填写订单号时才写入）
+            if not db.submit_xianyu_order_number(order_id, xianyu_order):
+                xianyu_awaiting_users.discard(user_id)
+                if user_id in user_states:
+                    del user_states[user_id]
+                await reply_xianyu_order_closed(update, order_id)
+                return
             
             await update.message.reply_text(
                 f"✅ 已收到您的订单编号：{xianyu_order}\n\n"
@@ -2246,40 +2399,73 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 await update.message.reply_text(
                     f"✅ 目标频道：{state['target_chats']}\n\n"
                     "步骤 2/2: 请输入发送时间\n\n"
-                    "格式：YYYY-MM-DD HH:MM\n"
+                    "单次发送：YYYY-MM-DD HH:MM\n"
                     "例如：2025-10-28 14:30\n\n"
+                    "重复发送：\n"
+                    "• every 2h（每 2 小时）\n"
+                    "• every 30m 09:00-21:00（每天 9-21 点每 30 分钟）\n"
+                    "• cron 0 9 * * 1-5（工作日 9:00）\n\n"
                     "发送 /cancel 取消创建"
                 )
                 return
             
             elif state['step'] == 'scheduled_time':
                 try:
-                    from datetime import datetime
                     scheduled_time = datetime.strptime(text.strip(), '%Y-%m-%d %H:%M')
-                    
-                    # 创建定时任务
-                    task_id = db.create_scheduled_task(
-                        template_id=state['template_id'],
-                        target_chats=state['target_chats'],
-                        scheduled_time=scheduled_time,
-                        created_by=user_id
-                    )
+                except ValueError:
+                    scheduled_time = None
+                
+                if scheduled_time is None:
+                    # 不是具体时间时按重复规则创建
+                    try:
+                        schedule_id, next_run = db.create_promo_schedule(
+                            template_id=state['template_id'],
+                            target_chats=state['target_chats'],
+                            rule=text,
+                            created_by=user_id
+                        )
+                    except ValueError:
+                        await update.message.reply_text(
+                            "❌ 时间或规则格式错误！\n\n"
+                            "单次发送：YYYY-MM-DD HH:MM\n"
+                            "例如：2025-10-28 14:30\n\n"
+                            "重复发送：\n"
+                            "• every 2h（每 2 小时）\n"
+                            "• every 30m 09:00-21:00（每天 9-21 点每 30 分钟）\n"
+                            "• cron 0 9 * * 1-5（工作日 9:00）\n\n"
+                            "发送 /cancel 取消创建"
+                        )
+                        return
+                    promo_scheduler.add(('schedule', schedule_id), next_run)
                     
                     del user_states[user_id]
                     await update.message.reply_text(
-                        f"✅ 定时任务创建成功！\n\n"
-                        f"任务ID: {task_id}\n"
-                        f"发送时间: {scheduled_time.strftime('%Y-%m-%d %H:%M')}\n"
+                        f"✅ 重复任务创建成功！\n\n"
+                        f"规则ID: {schedule_id}\n"
+                        f"规则: {text.strip()}\n"
+                        f"下次发送: {next_run.strftime('%Y-%m-%d %H:%M')}\n"
                         f"目标: {state['target_chats']}\n\n"
-                        "任务将在指定时间自动发送"
-                    )
-                except ValueError:
-                    await update.message.reply_text(
-                        "❌ 时间格式错误！\n\n"
-                        "请使用格式：YYYY-MM-DD HH:MM\n"
-                        "例如：2025-10-28 14:30\n\n"
-                        "发送 /cancel 取消创建"
+                        "可在「重复任务」中停用"
                     )
+                    return
+                
+                # 创建定时任务
+                task_id = db.create_scheduled_task(
+                    template_id=state['template_id'],
+                    target_chats=state['target_chats'],
+                    scheduled_time=scheduled_time,
+                    created_by=user_id
+                )
+                promo_scheduler.add(task_id, scheduled_time)
+                
+                del user_states[user_id]
+                await update.message.reply_text(
+                    f"✅ 定时任务创建成功！\n\n"
+                    f"任务ID: {task_id}\n"
+                    f"发送时间: {scheduled_time.strftime('%Y-%m-%d %H:%M')}\n"
+                    f"目标: {state['target_chats']}\n\n"
+                    "任务将在指定时间自动发送"
+                )
                 return
         
         elif state['action'] == 'send_promo_now':
@@ -2289,30 +2475,35 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 await update.message.reply_text("❌ 已取消发送")
                 return
             
-            target_chats = [chat.strip() for chat in text.strip().split(',')]
+            target_chats = parse_targets(text)
             template_id = state['template_id']
+            del user_states[user_id]
             
-            await update.message.reply_text(f"📤 开始发送广告到 {len(target_chats)} 个目标...")
+            status_message = await update.message.reply_text(f"📤 开始发送广告到 {len(target_chats)} 个目标...")
+            last_shown = time.monotonic()
             
-            success_count = 0
-            failed_count = 0
+            async def show_progress(progress, total):
+                # 进度消息最多每 2 秒编辑一次
+                nonlocal last_shown
+                if progress['done'] == total or time.monotonic() - last_shown < 2:
+                    return
+                last_shown = time.monotonic()
+                try:
+                    await status_message.edit_text(
+                        f"📤 发送中 {progress['done']}/{total}\n\n"
+                        f"成功: {progress['success']}\n"
+                        f"失败: {progress['failed']}"
+                    )
+                except TelegramError:
+                    pass
             
-            for chat in target_chats:
-                result = await send_promo_message(context.application, template_id, chat)
-                if result:
-                    success_count += 1
-                else:
-                    failed_count += 1
-                
-                # 避免发送过快
-                import asyncio
-                await asyncio.sleep(1)
+            report = await broadcast_promo(context.application, template_id, target_chats,
+                                           on_progress=show_progress)
             
-            del user_states[user_id]
-            await update.message.reply_text(
-                f"✅ 发送完成！\n\n"
-                f"成功: {success_count}\n"
-                f"失败: {failed_count}\n\n"
+            await status_message.edit_text(
+                f"✅ 发送完成！（用时 {report['elapsed']:.1f} 秒）\n\n"
+                f"成功: {report['success']}\n"
+                f"失败: {report['failed']}\n\n"
                 "使用 /promo 查看详细记录"
             )
             return
@@ -2336,34 +2527,17 @@ def setup_tron_callbacks():
         logger.info(f"TRON payment received: {tron_order_id}")
         
         # 查找对应的订单
-        conn = db.get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT * FROM orders WHERE tron_order_id=? AND status='pending'",
-            (tron_order_id,)
-        )
-        row = cursor.fetchone()
-        conn.close()
+        order = db.get_pending_order_by_tron_id(tron_order_id)
         
-        if not row:
+        if not order:
             logger.warning(f"No order found for TRON order {tron_order_id}")
             return
         
-        columns = ['order_id', 'user_id', 'payment_method', 'plan_type', 'amount', 
-                  'currency', 'status', 'created_at', 'paid_at', 'expired_at', 
-                  'cancelled_at', 'tron_tx_hash', 'tron_order_id', 'xianyu_order_number',
-                  'xianyu_screenshot', 'membership_days', 'admin_notes', 'user_notes']
-        order = dict(zip(columns, row))
-        
-        # 更新订单状态
-        db.update_order_status(
-            order['order_id'], 
-            'paid', 
-            tron_tx_hash=order_info.get('tx_hash')
-        )
-        
-        # 更新用户会员
-        db.update_user_membership(order['user_id'], order['membership_days'], order['order_id'])
+        # 更新订单状态并激活会员（重复回调时只有第一次生效）
+        if not db.activate_order(order['order_id'], tron_tx_hash=order_info.get('tx_hash')):
+            logger.warning(f"Order {order['order_id']} is no longer pending, skipping activation")
+            return
+        order_limiter.order_closed(order['user_id'])
         
         # 异步邀请到频道（需要在事件循环中）
         import asyncio
@@ -2400,100 +2574,212 @@ def setup_tron_callbacks():
 
 # ========== 定时任务执行器 ==========
 
+async def rollup_statistics(context: ContextTypes.DEFAULT_TYPE):
+    """定期刷新最近几天的每日统计汇总"""
+    try:
+        db.rollup_daily_stats()
+    except Exception as e:
+        logger.error(f"Error in rollup_statistics: {e}", exc_info=True)
+
+
+async def flush_database(application: Application):
+    """Bot 停止后写完队列中尚未提交的写操作（对话状态、广告发送记录等）再关闭数据库"""
+    db.close()
+    logger.info("Database write queue flushed")
+
+
+async def purge_conversation_states(context: ContextTypes.DEFAULT_TYPE):
+    """定期删除已过期的对话状态（内存和数据库）"""
+    try:
+        purged = user_states.purge_expired()
+        if purged:
+            logger.info(f"Purged {purged} expired conversation state(s)")
+    except Exception as e:
+        logger.error(f"Error in purge_conversation_states: {e}", exc_info=True)
+
+
 async def cleanup_expired_orders(context: ContextTypes.DEFAULT_TYPE):
-    """定期清理过期的订单（TRON + 闲鱼）"""
+    """定期清理过期的订单（TRON + 闲鱼），并通知对应用户"""
     try:
-        from config import ORDER_TIMEOUT_MINUTES, XIANYU_ORDER_TIMEOUT_MINUTES
-        
         # 清理过期的 TRON 订单
-        tron_cleaned = db.cleanup_expired_tron_orders(ORDER_TIMEOUT_MINUTES)
-        if tron_cleaned > 0:
-            logger.info(f"🧹 Auto-cleanup: {tron_cleaned} TRON order(s) timed out and cleaned up")
+        tron_expired = db.expire_orders('tron', 'timeout', ORDER_TIMEOUT_MINUTES)
+        if tron_expired:
+            logger.info(f"🧹 Auto-cleanup: {len(tron_expired)} TRON order(s) timed out and cleaned up")
         
         # 清理过期的闲鱼订单
-        xianyu_cleaned = db.cleanup_expired_xianyu_orders(XIANYU_ORDER_TIMEOUT_MINUTES)
-        if xianyu_cleaned > 0:
-            logger.info(f"🧹 Auto-cleanup: {xianyu_cleaned} xianyu order(s) expired and cleaned up")
+        xianyu_expired = db.expire_orders('xianyu', 'expired', XIANYU_ORDER_TIMEOUT_MINUTES)
+        if xianyu_expired:
+            logger.info(f"🧹 Auto-cleanup: {len(xianyu_expired)} xianyu order(s) expired and cleaned up")
         
         # 汇总日志
-        total_cleaned = tron_cleaned + xianyu_cleaned
+        total_cleaned = len(tron_expired) + len(xianyu_expired)
         if total_cleaned > 0:
-            logger.info(f"🧹 Total cleaned: {total_cleaned} order(s) (TRON: {tron_cleaned}, Xianyu: {xianyu_cleaned})")
+            logger.info(f"🧹 Total cleaned: {total_cleaned} order(s) (TRON: {len(tron_expired)}, Xianyu: {len(xianyu_expired)})")
+        
+        for order_id, user_id in tron_expired + xianyu_expired:
+            order_limiter.order_closed(user_id)
+        
+        # 通知用户订单已过期（UPDATE ... RETURNING 已返回订单号，无需再查库）；
+        # 大量订单同时过期时经全局限流器发送，遇到洪水限制等待后重试
+        for order_id, user_id in tron_expired + xianyu_expired:
+            try:
+                await call_telegram_limited(
+                    context.bot.send_message,
+                    chat_id=user_id,
+                    text=f"⏰ 订单 `{order_id}` 已超时关闭。\n\n如仍需开通会员，请重新下单。",
+                    parse_mode='Markdown'
+                )
+            except TelegramError as e:
+                logger.debug(f"Failed to notify user {user_id} about expired order {order_id}: {e}")
         
     except Exception as e:
         logger.error(f"Error in cleanup_expired_orders: {e}", exc_info=True)
 
 
-async def check_and_execute_scheduled_tasks(context: ContextTypes.DEFAULT_TYPE):
-    """检查并执行待发送的定时任务"""
+async def call_telegram_limited(method, **kwargs):
+    """在全局限流器下调用 Telegram API，遇到 RetryAfter 等待后重试一次"""
+    await telegram_limiter.acquire()
+    try:
+        return await method(**kwargs)
+    except RetryAfter as e:
+        logger.warning(f"Telegram flood control, retrying after {e.retry_after}s")
+        # 洪水限制针对整个 Bot，其他批量调用也一起顺延
+        telegram_limiter.pause(float(e.retry_after))
+        await telegram_limiter.acquire()
+        return await method(**kwargs)
+
+
+MEMBER_SWEEP_CHECKPOINT = 'member_expiry_sweep'
+
+
+async def sweep_expired_members(context: ContextTypes.DEFAULT_TYPE):
+    """
+    清理过期会员：取消会员状态并移出私有频道
+    
+    从上次的检查点开始按 member_until 顺序分批处理，每批完成后保存检查点，
+    中途重启也不会重复处理已完成的批次。
+    """
     try:
-        pending_tasks = db.get_pending_tasks()
+        checkpoint = db.get_checkpoint(MEMBER_SWEEP_CHECKPOINT)
+        after = tuple(json.loads(checkpoint)) if checkpoint else None
+        until = datetime.now()
+        total_removed = 0
+        
+        while True:
+            batch = db.get_expired_members(until, after, MEMBER_SWEEP_BATCH_SIZE)
+            if not batch:
+                break
+            
+            expired_ids = db.expire_memberships([user_id for user_id, _ in batch], until)
+            
+            for user_id in expired_ids:
+                if is_admin(user_id):
+                    continue
+                try:
+                    # ban + unban = 移出频道但允许以后重新加入
+                    await call_telegram_limited(
+                        context.bot.ban_chat_member, chat_id=PRIVATE_CHANNEL_ID, user_id=user_id
+                    )
+                    await call_telegram_limited(
+                        context.bot.unban_chat_member, chat_id=PRIVATE_CHANNEL_ID,
+                        user_id=user_id, only_if_banned=True
+                    )
+                    total_removed += 1
+                except TelegramError as e:
+                    logger.warning(f"Failed to remove expired member {user_id} from channel: {e}")
+            
+            last_user_id, last_until = batch[-1]
+            after = (last_until, last_user_id)
+            db.set_checkpoint(MEMBER_SWEEP_CHECKPOINT, json.dumps(after))
         
-        if not pending_tasks:
-            return
+        if total_removed > 0:
+            logger.info(f"🧹 Membership sweep: removed {total_removed} expired member(s) from channel")
         
-        logger.info(f"Found {len(pending_tasks)} pending promo tasks to execute")
+    except Exception as e:
+        logger.error(f"Error in sweep_expired_members: {e}", exc_info=True)
+
+
+async def check_and_execute_scheduled_tasks(context: ContextTypes.DEFAULT_TYPE):
+    """
+    认领到期的定时任务，每个任务作为独立的后台任务执行（不阻塞调度器）
+    
+    数据库出错时抛出异常，由调度器稍后重新触发本次到期的任务/规则。
+    """
+    # 到期的重复规则先生成本次的一次性任务，再按下一次触发时间重新排入调度器
+    materialize_error = None
+    try:
+        for schedule_id, next_run in db.materialize_due_schedules():
+            if next_run:
+                promo_scheduler.add(('schedule', schedule_id), next_run)
+    except Exception as e:
+        # 已到期的一次性任务照常认领
+        materialize_error = e
+    
+    free_slots = PROMO_TASK_CONCURRENCY - len(running_promo_tasks)
+    if free_slots > 0:
+        # 没有空位时，有任务结束后会再次检查
+        tasks = db.claim_due_tasks(
+            PROMO_TASK_OWNER, timedelta(minutes=PROMO_TASK_LEASE_MINUTES), free_slots
+        )
+        for task in tasks:
+            if task['id'] in running_promo_tasks:
+                continue
+            logger.info(f"Claimed promo task {task['id']}")
+            running_promo_tasks.add(task['id'])
+            context.application.create_task(run_promo_task(context.application, task))
+    
+    if materialize_error is not None:
+        raise materialize_error
+
+
+async def run_promo_task(app: Application, task):
+    """执行一个已认领的定时任务；之前中断过的任务跳过已发送成功的目标"""
+    task_id = task['id']
+    try:
+        target_chats = parse_targets(task['target_chats'])
+        delivered = db.get_task_delivered_targets(task_id)
+        remaining = [chat for chat in target_chats if chat not in delivered]
+        if delivered:
+            logger.info(f"Resuming task {task_id}: {len(target_chats) - len(remaining)} already sent, "
+                        f"{len(remaining)} remaining")
+        
+        report = await broadcast_promo(app, task['template_id'], remaining, task_id)
+        success_count = len(target_chats) - len(remaining) + report['success']
+        failed_count = report['failed']
+        error_messages = [f"Failed: {chat}" for chat, _ in report['errors']]
+        
+        # 更新任务状态
+        result_message = f"Success: {success_count}, Failed: {failed_count}"
+        if error_messages:
+            result_message += f"\nErrors: {', '.join(error_messages[:5])}"
+        
+        if failed_count == 0:
+            db.update_task_status(task_id, 'completed', result_message)
+        else:
+            db.update_task_status(task_id, 'failed', result_message)
         
-        for task in pending_tasks:
+        # 通知管理员
+        for admin_id in ADMIN_USER_IDS:
             try:
-                # 更新任务状态为执行中
-                db.update_task_status(task['id'], 'executing')
-                
-                # 解析目标频道列表
-                target_chats = [chat.strip() for chat in task['target_chats'].split(',')]
-                
-                success_count = 0
-                failed_count = 0
-                error_messages = []
-                
-                # 发送到每个目标
-                for chat in target_chats:
-                    result = await send_promo_message(
-                        context.application,
-                        task['template_id'],
-                        chat,
-                        task['id']
-                    )
-                    if result:
-                        success_count += 1
-                    else:
-                        failed_count += 1
-                        error_messages.append(f"Failed: {chat}")
-                    
-                    # 避免发送过快
-                    await asyncio.sleep(1)
-                
-                # 更新任务状态
-                result_message = f"Success: {success_count}, Failed: {failed_count}"
-                if error_messages:
-                    result_message += f"\nErrors: {', '.join(error_messages[:5])}"
-                
-                if failed_count == 0:
-                    db.update_task_status(task['id'], 'completed', result_message)
-                else:
-                    db.update_task_status(task['id'], 'failed', result_message)
-                
-                # 通知管理员
-                for admin_id in ADMIN_USER_IDS:
-                    try:
-                        await context.bot.send_message(
-                            chat_id=admin_id,
-                            text=f"📢 定时广告任务完成\n\n"
-                                 f"任务ID: {task['id']}\n"
-                                 f"成功: {success_count}\n"
-                                 f"失败: {failed_count}\n"
-                        )
-                    except:
-                        pass
-                
-                logger.info(f"Task {task['id']} executed: {result_message}")
-                
-            except Exception as e:
-                logger.error(f"Error executing task {task['id']}: {e}")
-                db.update_task_status(task['id'], 'failed', str(e))
-                
+                await app.bot.send_message(
+                    chat_id=admin_id,
+                    text=f"📢 定时广告任务完成\n\n"
+                         f"任务ID: {task_id}\n"
+                         f"成功: {success_count}\n"
+                         f"失败: {failed_count}\n"
+                )
+            except:
+                pass
+        
+        logger.info(f"Task {task_id} executed: {result_message}")
+        
     except Exception as e:
-        logger.error(f"Error in check_and_execute_scheduled_tasks: {e}")
+        logger.error(f"Error executing task {task_id}: {e}")
+        db.update_task_status(task_id, 'failed', str(e))
+    finally:
+        running_promo_tasks.discard(task_id)
+        # 空出了执行名额，检查是否还有等待中的到期任务
+        promo_scheduler.add('claim', datetime.now())
 
 
 # ========== 主函数 ==========
@@ -2506,7 +2792,7 @@ def main():
     setup_tron_callbacks()
     
     # 创建 Application
-    application = Application.builder().token(BOT_TOKEN).build()
+    application = Application.builder().token(BOT_TOKEN).post_shutdown(flush_database).build()
     
     # 注册命令处理器
     application.add_handler(CommandHandler("start", start_command))
@@ -2517,6 +2803,7 @@ def main():
     application.add_handler(CommandHandler("admin", admin_command))
     application.add_handler(CommandHandler("pending", pending_command))
     application.add_handler(CommandHandler("promo", promo_command))
+    application.add_handler(CommandHandler("find", find_command))
     
     # 注册回调处理器
     application.add_handler(CallbackQueryHandler(button_callback))
@@ -2525,13 +2812,19 @@ def main():
     application.add_handler(MessageHandler(filters.PHOTO, handle_photo))  # 图片消息
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))  # 文字消息
     
-    # 添加定时任务检查器（每分钟检查一次）
-    application.job_queue.run_repeating(
+    # 定时广告任务：只在最早的待发送任务/重复规则到点时唤醒（启动前已过期的任务会立即执行）；
+    # 上次执行中断的任务在认领过期后接着发送
+    lease = timedelta(minutes=PROMO_TASK_LEASE_MINUTES)
+    promo_scheduler.start(
+        application.job_queue,
         check_and_execute_scheduled_tasks,
-        interval=60,  # 每60秒检查一次
-        first=10  # 启动后10秒开始
+        [(task['id'], datetime.fromisoformat(task['scheduled_time']))
+         for task in db.get_all_scheduled_tasks('pending')] +
+        [(task['id'], datetime.fromisoformat(task['claimed_at']) + lease if task['claimed_at'] else datetime.now())
+         for task in db.get_all_scheduled_tasks('executing')] +
+        [(('schedule', schedule['id']), datetime.fromisoformat(schedule['next_run']))
+         for schedule in db.get_active_promo_schedules()]
     )
-    logger.info("Scheduled task checker started (running every 60 seconds)")
     
     # 添加过期订单清理器
     from config import ORDER_CLEANUP_INTERVAL_MINUTES
@@ -2542,6 +2835,28 @@ def main():
     )
     logger.info(f"Order cleanup task started (running every {ORDER_CLEANUP_INTERVAL_MINUTES} minutes)")
     
+    # 过期会员清理（移出私有频道）
+    application.job_queue.run_repeating(
+        sweep_expired_members,
+        interval=MEMBER_SWEEP_INTERVAL_MINUTES * 60,
+        first=90
+    )
+    logger.info(f"Membership sweep task started (running every {MEMBER_SWEEP_INTERVAL_MINUTES} minutes)")
+    
+    # 每小时刷新一次每日统计汇总
+    application.job_queue.run_repeating(
+        rollup_statistics,
+        interval=3600,
+        first=60
+    )
+    
+    # 清理过期的对话状态（用户中途放弃的多步骤流程）
+    application.job_queue.run_repeating(
+        purge_conversation_states,
+        interval=600,
+        first=120
+    )
+    
     # 启动 Bot
     logger.info("Bot started successfully!")
     application.run_polling(allowed_updates=Update.ALL_TYPES)
@@ -0,0 +1,136 @@
+"""
+广告群发引擎
+
+多个目标并发发送，同时遵守：
+- 全局速率（所有群发共用一个令牌桶，约 30 条/秒 的 Telegram 限制）
+- 单个聊天的速率（群组约 20 条/分钟）
+- 并发上限
+遇到 RetryAfter（触发洪水限制）时按 Telegram 要求的时间暂停全局发送后重试，
+每个目标发送完成后立即回调，调用方可以实时记录和展示进度。
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+from telegram.error import RetryAfter, TelegramError, TimedOut
+
+from ratelimit import AsyncRateLimiter
+
+logger = logging.getLogger(__name__)
+
+# send(chat) -> Telegram 返回的消息对象
+SendFunc = Callable[[str], Awaitable[Any]]
+# on_result(chat, 是否成功, 消息对象或错误信息)
+ResultFunc = Callable[[str, bool, Any], Optional[Awaitable[None]]]
+
+
+def parse_targets(text: str) -> List[str]:
+    """解析逗号分隔的目标列表（去空白、去重，保持顺序）"""
+    seen = set()
+    targets = []
+    for chat in text.split(','):
+        chat = chat.strip()
+        if chat and chat not in seen:
+            seen.add(chat)
+            targets.append(chat)
+    return targets
+
+
+class BroadcastEngine:
+    """并发群发，带全局/单聊天限流和重试"""
+
+    def __init__(self, global_limiter: AsyncRateLimiter, per_chat_per_minute: float = 20,
+                 concurrency: int = 20, max_retries: int = 3):
+        """
+        Args:
+            global_limiter: 全局限流器（与其他批量 API 调用共用）
+            per_chat_per_minute: 同一聊天每分钟最多发送条数
+            concurrency: 同时进行中的发送请求数
+            max_retries: RetryAfter / 超时后的最大重试次数
+        """
+        self.global_limiter = global_limiter
+        self.per_chat_rate = per_chat_per_minute / 60
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self._chat_limiters: Dict[str, AsyncRateLimiter] = {}
+
+    def _chat_limiter(self, chat: str) -> AsyncRateLimiter:
+        limiter = self._chat_limiters.get(chat)
+        if limiter is None:
+            limiter = self._chat_limiters[chat] = AsyncRateLimiter(self.per_chat_rate, 1)
+        return limiter
+
+    def _prune_chat_limiters(self):
+        # 令牌已补满的聊天不再需要单独记录
+        for chat in [chat for chat, limiter in self._chat_limiters.items()
+                     if limiter.bucket.wait_time(limiter.bucket.capacity) == 0]:
+            del self._chat_limiters[chat]
+
+    async def _send_one(self, chat: str, send: SendFunc) -> Any:
+        attempt = 0
+        while True:
+            await self._chat_limiter(chat).acquire()
+            await self.global_limiter.acquire()
+            try:
+                return await send(chat)
+            except RetryAfter as e:
+                if attempt >= self.max_retries:
+                    raise
+                # 洪水限制针对整个 Bot，暂停所有发送
+                logger.warning(f"Flood control while sending to {chat}, pausing {e.retry_after}s")
+                self.global_limiter.pause(float(e.retry_after))
+            except TimedOut:
+                if attempt >= self.max_retries:
+                    raise
+                await asyncio.sleep(2 ** attempt)
+            attempt += 1
+
+    async def deliver(self, targets: Iterable[str], send: SendFunc,
+                      on_result: Optional[ResultFunc] = None) -> Dict[str, Any]:
+        """
+        向所有目标发送
+
+        Args:
+            targets: 目标聊天列表
+            send: 发送到单个聊天的协程函数
+            on_result: 每个目标完成后的回调（可以是协程函数）
+
+        Returns:
+            {'success': 成功数, 'failed': 失败数, 'errors': [(聊天, 错误), ...], 'elapsed': 秒}
+        """
+        targets = list(targets)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        report = {'success': 0, 'failed': 0, 'errors': [], 'elapsed': 0.0}
+        started = time.monotonic()
+
+        async def run(chat: str):
+            async with semaphore:
+                try:
+                    result, ok = await self._send_one(chat, send), True
+                except TelegramError as e:
+                    result, ok = str(e), False
+                except Exception as e:
+                    logger.error(f"Unexpected error sending to {chat}: {e}", exc_info=True)
+                    result, ok = str(e), False
+
+            if ok:
+                report['success'] += 1
+            else:
+                report['failed'] += 1
+                report['errors'].append((chat, result))
+            if on_result is not None:
+                try:
+                    callback = on_result(chat, ok, result)
+                    if asyncio.iscoroutine(callback):
+                        await callback
+                except Exception as e:
+                    logger.error(f"Broadcast result callback failed for {chat}: {e}", exc_info=True)
+
+        await asyncio.gather(*(run(chat) for chat in targets))
+        self._prune_chat_limiters()
+
+        report['elapsed'] = time.monotonic() - started
+        logger.info(f"Broadcast to {len(targets)} target(s) finished in {report['elapsed']:.1f}s: "
+                    f"{report['success']} succeeded, {report['failed']} failed")
+        return report
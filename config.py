@@ -22,7 +22,8 @@ XIANYU_PRODUCT_URL = os.getenv('XIANYU_PRODUCT_URL', 'https://m.tb.cn/h.SOQ16rD?
 CUSTOMER_SERVICE_URL = os.getenv('CUSTOMER_SERVICE_URL', 'https://t.me/youryhc')  # 客服链接（可以是 Telegram 个人/群组链接）
 
 # ========== 欢迎页面配置 ==========
-# 欢迎图片 - 可以是图片 URL 或 Telegram file_id（留空则不显示图片）
+# 欢迎图片 - 可以是图片 URL、本地文件路径或 Telegram file_id（留空则不显示图片）
+# URL/本地文件第一次发送后会缓存 Telegram 返回的 file_id，之后不再重复下载/上传
 WELCOME_IMAGE = os.getenv('WELCOME_IMAGE', '')
 
 # 欢迎消息 - 在下方"频道配置"部分统一配置（第82行）
@@ -56,6 +57,23 @@ ORDER_TIMEOUT_MINUTES = int(os.getenv('ORDER_TIMEOUT_MINUTES', '30'))  # USDT订
 XIANYU_ORDER_TIMEOUT_MINUTES = int(os.getenv('XIANYU_ORDER_TIMEOUT_MINUTES', '30'))  # 闲鱼订单超时时间（分钟）
 POLL_INTERVAL_SECONDS = int(os.getenv('POLL_INTERVAL_SECONDS', '15'))  # TRON 轮询间隔（秒）
 ORDER_CLEANUP_INTERVAL_MINUTES = int(os.getenv('ORDER_CLEANUP_INTERVAL_MINUTES', '5'))  # 订单清理任务运行间隔（分钟）
+STATS_TIMEZONE = os.getenv('STATS_TIMEZONE', '')  # 统计使用的业务时区（如 Asia/Shanghai），留空使用服务器本地时区
+MEMBER_SWEEP_INTERVAL_MINUTES = int(os.getenv('MEMBER_SWEEP_INTERVAL_MINUTES', '10'))  # 过期会员清理任务运行间隔（分钟）
+MEMBER_SWEEP_BATCH_SIZE = int(os.getenv('MEMBER_SWEEP_BATCH_SIZE', '100'))  # 每批处理的过期会员数量
+TELEGRAM_API_RATE = float(os.getenv('TELEGRAM_API_RATE', '25'))  # 批量操作时 Telegram API 调用速率上限（次/秒）
+PROMO_CONCURRENCY = int(os.getenv('PROMO_CONCURRENCY', '20'))  # 广告群发时同时进行的发送请求数
+PROMO_CHAT_MESSAGES_PER_MINUTE = float(os.getenv('PROMO_CHAT_MESSAGES_PER_MINUTE', '20'))  # 同一频道/群组每分钟最多发送条数
+PROMO_TASK_CONCURRENCY = int(os.getenv('PROMO_TASK_CONCURRENCY', '3'))  # 同时执行的定时广告任务数
+PROMO_TASK_LEASE_MINUTES = int(os.getenv('PROMO_TASK_LEASE_MINUTES', '10'))  # 执行中的任务超过这么久没有进展视为中断，由其他进程/重启后接手
+ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', 'archives')  # 日志归档目录
+LOG_RETENTION_DAYS = int(os.getenv('LOG_RETENTION_DAYS', '90'))  # 日志在主数据库中保留天数，更早的移入归档
+ARCHIVE_COMPRESS = os.getenv('ARCHIVE_COMPRESS', 'false').lower() == 'true'  # 是否压缩已归档完整的月份
+BACKUP_DIR = os.getenv('BACKUP_DIR', 'backups')  # 备份目录
+BACKUP_KEEP = int(os.getenv('BACKUP_KEEP', '7'))  # 每个数据库保留的备份份数（0 = 全部保留）
+BACKUP_COMPRESS = os.getenv('BACKUP_COMPRESS', 'false').lower() == 'true'  # 是否压缩备份文件
+CONVERSATION_STATE_TTL_MINUTES = int(os.getenv('CONVERSATION_STATE_TTL_MINUTES', '120'))  # 多步骤对话（填写闲鱼订单号、创建广告等）多久没有操作后失效
+CONVERSATION_STATE_MAX = int(os.getenv('CONVERSATION_STATE_MAX', '10000'))  # 内存中最多保存的对话状态数，超出时淘汰最久未使用的
+CONVERSATION_STATE_PERSIST = os.getenv('CONVERSATION_STATE_PERSIST', 'true').lower() == 'true'  # 是否把对话状态保存到数据库（重启后可继续）
 
 # ========== 日志配置 ==========
 LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
@@ -124,6 +142,7 @@ ADMIN_HELP_MESSAGE = """
 /admin - 管理员面板
 /pending - 待审核订单
 /promo - 广告管理
+/find - 查找订单/用户（支持片段）
 /users - 用户列表
 /stats - 统计数据
 /broadcast - 广播消息
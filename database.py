@@ -2,188 +2,715 @@
 数据库模型和操作
 """
 import sqlite3
-from datetime import datetime, timedelta
-from typing import Optional, List, Dict, Any
-from threading import Lock
+from datetime import datetime, timedelta, date, time as dtime
+from concurrent.futures import Future
+from typing import Optional, List, Dict, Any, Iterator, Tuple
+from zoneinfo import ZoneInfo
 import logging
 
+from dbwriter import WriteQueue
+from migrations import Migration, BackgroundMigration, MigrationRunner
+from recurrence import parse_rule
+from models import (
+    User, Order, PromoTemplate, ScheduledTask, PromoSchedule, Page,
+    fetch_one, fetch_all, iter_rows, make_records, row_to_dict
+)
+
 logger = logging.getLogger(__name__)
 
+# 读连接等待其他进程写锁的秒数（WAL 模式下只有检查点会短暂阻塞读取）
+READ_BUSY_TIMEOUT = 10
+
+
+def _order_counter_sql(row: str, sign: str) -> str:
+    """生成某一订单行（NEW/OLD）对统计计数器的增减语句"""
+    return f"""
+        INSERT INTO stats_counters (name, value) VALUES ('orders_total', {sign}1)
+            ON CONFLICT(name) DO UPDATE SET value = value + excluded.value;
+        INSERT INTO stats_counters (name, value) VALUES ('orders_status:' || {row}.status, {sign}1)
+            ON CONFLICT(name) DO UPDATE SET value = value + excluded.value;
+        INSERT INTO stats_counters (name, value)
+            SELECT 'revenue:' || {row}.currency, {sign}{row}.amount WHERE {row}.status = 'paid'
+            ON CONFLICT(name) DO UPDATE SET value = value + excluded.value;
+    """
+
+
+def _member_counter_sql(row: str, sign: str) -> str:
+    """生成某一用户行（NEW/OLD）对会员计数器的增减语句"""
+    return f"""
+        INSERT INTO stats_counters (name, value)
+            SELECT 'users_members', {sign}1 WHERE {row}.is_member = 1
+            ON CONFLICT(name) DO UPDATE SET value = value + excluded.value;
+    """
+
+
+# 统计计数器触发器：任何写入 users/orders 的路径（包括 manage.py 的直接 SQL）都会同步计数
+STATS_TRIGGERS = {
+    'trg_stats_orders_insert': f"""
+    CREATE TRIGGER trg_stats_orders_insert AFTER INSERT ON orders
+    BEGIN
+        {_order_counter_sql('NEW', '+')}
+    END
+    """,
+    'trg_stats_orders_update': f"""
+    CREATE TRIGGER trg_stats_orders_update
+    AFTER UPDATE OF status, amount, currency ON orders
+    WHEN OLD.status IS NOT NEW.status OR OLD.amount IS NOT NEW.amount
+        OR OLD.currency IS NOT NEW.currency
+    BEGIN
+        {_order_counter_sql('OLD', '-')}
+        {_order_counter_sql('NEW', '+')}
+    END
+    """,
+    'trg_stats_orders_delete': f"""
+    CREATE TRIGGER trg_stats_orders_delete AFTER DELETE ON orders
+    BEGIN
+        {_order_counter_sql('OLD', '-')}
+    END
+    """,
+    'trg_stats_users_insert': f"""
+    CREATE TRIGGER trg_stats_users_insert AFTER INSERT ON users
+    BEGIN
+        INSERT INTO stats_counters (name, value) VALUES ('users_total', 1)
+            ON CONFLICT(name) DO UPDATE SET value = value + excluded.value;
+        {_member_counter_sql('NEW', '+')}
+    END
+    """,
+    'trg_stats_users_update': f"""
+    CREATE TRIGGER trg_stats_users_update AFTER UPDATE OF is_member ON users
+    WHEN OLD.is_member IS NOT NEW.is_member
+    BEGIN
+        {_member_counter_sql('OLD', '-')}
+        {_member_counter_sql('NEW', '+')}
+    END
+    """,
+    'trg_stats_users_delete': f"""
+    CREATE TRIGGER trg_stats_users_delete AFTER DELETE ON users
+    BEGIN
+        INSERT INTO stats_counters (name, value) VALUES ('users_total', -1)
+            ON CONFLICT(name) DO UPDATE SET value = value + excluded.value;
+        {_member_counter_sql('OLD', '-')}
+    END
+    """,
+}
+
+
+# 全文检索（trigram 分词，任意 3 个字符以上的片段都能命中）：表 -> (检索表, 检索列)
+# 检索表的 rowid 与源表的 rowid 一致。users 的 rowid 就是 user_id，不会变化；
+# orders 的主键是 TEXT，rowid 是隐式的，VACUUM 可能重新编号，之后检索表会与订单对不上，
+# 需要执行 Database.rebuild_search_index()（python manage.py rebuild_search）
+SEARCH_COLUMNS = {
+    'orders': ('orders_fts', ('order_id', 'user_id', 'xianyu_order_number', 'tron_order_id', 'tron_tx_hash')),
+    'users': ('users_fts', ('user_id', 'username', 'first_name', 'last_name')),
+}
+
+# trigram 分词下短于 3 个字符的片段无法命中
+SEARCH_MIN_LENGTH = 3
+
+
+def _search_triggers(table: str) -> Dict[str, str]:
+    """生成让检索表与源表保持同步的触发器（检索表 rowid 与源表 rowid 一致）"""
+    fts_table, columns = SEARCH_COLUMNS[table]
+    values = ', '.join(f'NEW.{column}' for column in columns)
+    upsert = (f"INSERT OR REPLACE INTO {fts_table} (rowid, {', '.join(columns)}) "
+              f"VALUES (NEW.rowid, {values});")
+    return {
+        f'trg_search_{table}_insert': f"""
+    CREATE TRIGGER trg_search_{table}_insert AFTER INSERT ON {table}
+    BEGIN
+        {upsert}
+    END
+    """,
+        f'trg_search_{table}_update': f"""
+    CREATE TRIGGER trg_search_{table}_update AFTER UPDATE OF {', '.join(columns)} ON {table}
+    BEGIN
+        {upsert}
+    END
+    """,
+        f'trg_search_{table}_delete': f"""
+    CREATE TRIGGER trg_search_{table}_delete AFTER DELETE ON {table}
+    BEGIN
+        DELETE FROM {fts_table} WHERE rowid = OLD.rowid;
+    END
+    """,
+    }
+
+
+SEARCH_TRIGGERS = {name: sql for table in SEARCH_COLUMNS for name, sql in _search_triggers(table).items()}
+
+
+# 订单状态机：当前状态 -> 允许转换到的状态
+ORDER_TRANSITIONS = {
+    'pending': ('paid', 'cancelled', 'expired', 'timeout'),
+}
+
+# 进入某状态时记录时间的字段
+ORDER_STATUS_TIMESTAMPS = {
+    'paid': 'paid_at',
+    'cancelled': 'cancelled_at',
+    'expired': 'expired_at',
+    'timeout': 'expired_at',
+}
+
 
 class Database:
     """数据库管理类"""
     
-    def __init__(self, db_path: str):
+    def __init__(self, db_path: str, stats_timezone: Optional[str] = None):
+        """
+        Args:
+            db_path: 数据库文件路径
+            stats_timezone: 统计使用的业务时区（如 'Asia/Shanghai'），
+                为空时使用服务器本地时区
+        """
         self.db_path = db_path
-        self.lock = Lock()
+        self.stats_timezone = stats_timezone or 'local'
+        self.stats_tz = self._resolve_timezone(stats_timezone)
         self.init_db()
+        # 所有写操作经由唯一的写连接排队执行（组提交）；读操作各自使用独立连接
+        self.writer = WriteQueue(self.db_path)
+        # 广告模板缓存：修改/删除模板时作废并递增该模板的版本号
+        self._template_cache: Dict[int, PromoTemplate] = {}
+        self._template_versions: Dict[int, int] = {}
+    
+    @staticmethod
+    def _resolve_timezone(name: Optional[str]):
+        """解析时区名称，None 表示服务器本地时区"""
+        if not name:
+            return None
+        try:
+            return ZoneInfo(name)
+        except Exception as e:
+            logger.warning(f"Unknown stats timezone {name!r}, falling back to server local time: {e}")
+            return None
     
     def get_connection(self):
-        """获取数据库连接"""
-        return sqlite3.connect(self.db_path, check_same_thread=False)
+        """获取读连接（WAL 模式下读取不会被写入阻塞，写操作请使用 self.writer）"""
+        return sqlite3.connect(self.db_path, check_same_thread=False, timeout=READ_BUSY_TIMEOUT)
+    
+    def write_metrics(self) -> Dict[str, Any]:
+        """写入队列的争用指标（排队等待时间、组提交批大小等）"""
+        return self.writer.metrics()
+    
+    def close(self):
+        """处理完已排队的写操作后关闭写连接"""
+        self.writer.close()
     
     def init_db(self):
-        """初始化数据库表"""
-        with self.lock:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            
-            # 用户表
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    user_id INTEGER PRIMARY KEY,
-                    username TEXT,
-                    first_name TEXT,
-                    last_name TEXT,
-                    is_member BOOLEAN DEFAULT 0,
-                    member_since TIMESTAMP,
-                    member_until TIMESTAMP,
-                    total_spent_usdt REAL DEFAULT 0,
-                    total_spent_cny REAL DEFAULT 0,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    last_active TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    notes TEXT
-                )
-            ''')
-            
-            # 订单表
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS orders (
-                    order_id TEXT PRIMARY KEY,
-                    user_id INTEGER NOT NULL,
-                    payment_method TEXT NOT NULL,
-                    plan_type TEXT NOT NULL,
-                    amount REAL NOT NULL,
-                    currency TEXT NOT NULL,
-                    status TEXT NOT NULL,
-                    created_at TIMESTAMP NOT NULL,
-                    paid_at TIMESTAMP,
-                    expired_at TIMESTAMP,
-                    cancelled_at TIMESTAMP,
-                    
-                    -- TRON 相关
-                    tron_tx_hash TEXT,
-                    tron_order_id TEXT,
-                    
-                    -- 闲鱼相关
-                    xianyu_order_number TEXT,
-                    xianyu_screenshot TEXT,
-                    
-                    -- 其他
-                    membership_days INTEGER,
-                    admin_notes TEXT,
-                    user_notes TEXT,
-                    
-                    FOREIGN KEY (user_id) REFERENCES users(user_id)
-                )
-            ''')
-            
-            # 邀请记录表
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS channel_invites (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    order_id TEXT NOT NULL,
-                    invited_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    invite_status TEXT DEFAULT 'success',
-                    
-                    FOREIGN KEY (user_id) REFERENCES users(user_id),
-                    FOREIGN KEY (order_id) REFERENCES orders(order_id)
-                )
-            ''')
-            
-            # 系统日志表
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS system_logs (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    log_type TEXT NOT NULL,
-                    user_id INTEGER,
-                    order_id TEXT,
-                    message TEXT NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            # 广告模板表
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS promo_templates (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT NOT NULL,
-                    message TEXT NOT NULL,
-                    image_file_id TEXT,
-                    button_text TEXT,
-                    button_url TEXT,
-                    created_by INTEGER NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    is_active BOOLEAN DEFAULT 1
-                )
-            ''')
-            
-            # 为旧数据库添加 image_file_id 字段（如果不存在）
-            try:
-                cursor.execute("ALTER TABLE promo_templates ADD COLUMN image_file_id TEXT")
-                conn.commit()
-                logger.info("Added image_file_id column to promo_templates table")
-            except sqlite3.OperationalError:
-                # 字段已存在，跳过
-                pass
-            
-            # 定时任务表
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS scheduled_tasks (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    template_id INTEGER NOT NULL,
-                    target_chats TEXT NOT NULL,
-                    scheduled_time TIMESTAMP NOT NULL,
-                    status TEXT DEFAULT 'pending',
-                    created_by INTEGER NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    executed_at TIMESTAMP,
-                    result TEXT,
-                    
-                    FOREIGN KEY (template_id) REFERENCES promo_templates(id)
-                )
-            ''')
-            
-            # 广告发送记录表
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS promo_logs (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    task_id INTEGER,
-                    template_id INTEGER NOT NULL,
-                    target_chat TEXT NOT NULL,
-                    sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    status TEXT NOT NULL,
-                    message_id INTEGER,
-                    error_message TEXT,
-                    
-                    FOREIGN KEY (task_id) REFERENCES scheduled_tasks(id),
-                    FOREIGN KEY (template_id) REFERENCES promo_templates(id)
-                )
-            ''')
-            
-            # 创建索引
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_orders_user_id ON orders(user_id)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_orders_status ON orders(status)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_orders_payment_method ON orders(payment_method)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_is_member ON users(is_member)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_member_until ON users(member_until)')
-            
-            conn.commit()
-            conn.close()
-            
+        """
+        初始化/升级数据库结构
+        
+        已是最新版本时只读取一次 PRAGMA user_version；耗时的索引创建在后台线程执行，
+        进度可通过 self.migrations.status() 查看。
+        """
+        self.migrations = MigrationRunner(self.db_path, [
+            Migration(1, '基础表结构', self._migration_baseline),
+            Migration(2, '统计计数器和每日汇总', self._migration_statistics),
+            Migration(3, '订单过期时间和任务检查点', self._migration_order_expiry),
+            BackgroundMigration(4, '时间范围查询索引', self._migration_range_indexes),
+            BackgroundMigration(5, '分页查询索引', self._migration_page_indexes),
+            Migration(6, '全文检索表', self._migration_search),
+            BackgroundMigration(7, '全文检索回填', self._migration_search_backfill),
+            Migration(8, '定时任务认领字段', self._migration_task_claims),
+            BackgroundMigration(9, '广告发送记录任务索引', self._migration_promo_log_index),
+            Migration(10, '重复广告规则', self._migration_promo_schedules),
+            Migration(11, '图片 file_id 缓存', self._migration_media_cache),
+            Migration(12, '对话状态', self._migration_conversation_states),
+            BackgroundMigration(13, '待填写闲鱼订单号索引', self._migration_xianyu_awaiting_index),
+            Migration(14, '统计触发器不再跟踪 created_at', self._migration_stats_triggers),
+            Migration(15, '移除按天分桶计数表', self._migration_drop_stats_daily),
+        ])
+        self.migrations.run()
         logger.info(f"Database initialized: {self.db_path}")
     
+    @staticmethod
+    def _add_column_if_missing(cursor: sqlite3.Cursor, table: str, column: str, definition: str):
+        """为旧数据库补充字段（已存在则跳过）"""
+        cursor.execute(f"PRAGMA table_info({table})")
+        if column not in {row[1] for row in cursor.fetchall()}:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+            logger.info(f"Added {column} column to {table} table")
+    
+    def _migration_baseline(self, cursor: sqlite3.Cursor):
+        """迁移 1：基础表结构和索引"""
+        # 用户表
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                user_id INTEGER PRIMARY KEY,
+                username TEXT,
+                first_name TEXT,
+                last_name TEXT,
+                is_member BOOLEAN DEFAULT 0,
+                member_since TIMESTAMP,
+                member_until TIMESTAMP,
+                total_spent_usdt REAL DEFAULT 0,
+                total_spent_cny REAL DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                last_active TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                notes TEXT
+            )
+        ''')
+        
+        # 订单表
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS orders (
+                order_id TEXT PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                payment_method TEXT NOT NULL,
+                plan_type TEXT NOT NULL,
+                amount REAL NOT NULL,
+                currency TEXT NOT NULL,
+                status TEXT NOT NULL,
+                created_at TIMESTAMP NOT NULL,
+                paid_at TIMESTAMP,
+                expired_at TIMESTAMP,
+                cancelled_at TIMESTAMP,
+                
+                -- TRON 相关
+                tron_tx_hash TEXT,
+                tron_order_id TEXT,
+                
+                -- 闲鱼相关
+                xianyu_order_number TEXT,
+                xianyu_screenshot TEXT,
+                
+                -- 其他
+                membership_days INTEGER,
+                admin_notes TEXT,
+                user_notes TEXT,
+                
+                FOREIGN KEY (user_id) REFERENCES users(user_id)
+            )
+        ''')
+        
+        # 邀请记录表
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS channel_invites (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                order_id TEXT NOT NULL,
+                invited_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                invite_status TEXT DEFAULT 'success',
+                
+                FOREIGN KEY (user_id) REFERENCES users(user_id),
+                FOREIGN KEY (order_id) REFERENCES orders(order_id)
+            )
+        ''')
+        
+        # 系统日志表
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS system_logs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                log_type TEXT NOT NULL,
+                user_id INTEGER,
+                order_id TEXT,
+                message TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # 广告模板表
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS promo_templates (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                message TEXT NOT NULL,
+                image_file_id TEXT,
+                button_text TEXT,
+                button_url TEXT,
+                created_by INTEGER NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                is_active BOOLEAN DEFAULT 1
+            )
+        ''')
+        
+        # 早期版本的 promo_templates 没有 image_file_id 字段
+        self._add_column_if_missing(cursor, 'promo_templates', 'image_file_id', 'TEXT')
+        
+        # 定时任务表
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS scheduled_tasks (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                template_id INTEGER NOT NULL,
+                target_chats TEXT NOT NULL,
+                scheduled_time TIMESTAMP NOT NULL,
+                status TEXT DEFAULT 'pending',
+                created_by INTEGER NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                executed_at TIMESTAMP,
+                result TEXT,
+                
+                FOREIGN KEY (template_id) REFERENCES promo_templates(id)
+            )
+        ''')
+        
+        # 广告发送记录表
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS promo_logs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                task_id INTEGER,
+                template_id INTEGER NOT NULL,
+                target_chat TEXT NOT NULL,
+                sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                status TEXT NOT NULL,
+                message_id INTEGER,
+                error_message TEXT,
+                
+                FOREIGN KEY (task_id) REFERENCES scheduled_tasks(id),
+                FOREIGN KEY (template_id) REFERENCES promo_templates(id)
+            )
+        ''')
+        
+        # 创建索引
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_orders_user_id ON orders(user_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_orders_status ON orders(status)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_orders_payment_method ON orders(payment_method)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_is_member ON users(is_member)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_member_until ON users(member_until)')
+    
+    def _migration_statistics(self, cursor: sqlite3.Cursor):
+        """迁移 2：统计计数器（触发器维护）和每日汇总表"""
+        # 统计计数器表（由触发器维护，管理面板直接读取）
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS stats_counters (
+                name TEXT PRIMARY KEY,
+                value REAL NOT NULL DEFAULT 0
+            )
+        ''')
+        
+        # 每日统计汇总表（按业务时区的自然日，已结束的日期从这里读取）
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS stats_daily_rollup (
+                tz TEXT NOT NULL,
+                day TEXT NOT NULL,
+                orders INTEGER NOT NULL DEFAULT 0,
+                paid_orders INTEGER NOT NULL DEFAULT 0,
+                revenue_usdt REAL NOT NULL DEFAULT 0,
+                revenue_cny REAL NOT NULL DEFAULT 0,
+                updated_at TIMESTAMP,
+                PRIMARY KEY (tz, day)
+            )
+        ''')
+        
+        self._install_stats_triggers(cursor)
+        
+        # 根据现有数据初始化计数器
+        self._rebuild_statistics(cursor)
+    
+    @staticmethod
+    def _install_stats_triggers(cursor: sqlite3.Cursor):
+        """（重新）创建统计计数器触发器"""
+        for name, trigger_sql in STATS_TRIGGERS.items():
+            cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+            cursor.execute(trigger_sql)
+    
+    def _migration_order_expiry(self, cursor: sqlite3.Cursor):
+        """迁移 3：订单 expires_at 字段、后台任务检查点表"""
+        self._add_column_if_missing(cursor, 'orders', 'expires_at', 'TIMESTAMP')
+        
+        # 后台任务进度检查点（如会员过期清理扫描到的位置）
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS job_checkpoints (
+                name TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+    
+    def _migration_range_indexes(self, conn: sqlite3.Connection):
+        """迁移 4（后台）：按时间范围查询用到的索引，数据量大时创建较慢"""
+        indexes = [
+            # 覆盖索引：按时间段统计时只做索引范围扫描，不回表
+            'CREATE INDEX IF NOT EXISTS idx_orders_created_at ON orders(created_at, status, currency, amount)',
+            # 过期清理：status + payment_method 等值定位，expires_at 范围扫描
+            'CREATE INDEX IF NOT EXISTS idx_orders_expiry ON orders(status, payment_method, expires_at)',
+            # 日志归档按时间范围搬迁
+            'CREATE INDEX IF NOT EXISTS idx_system_logs_created_at ON system_logs(created_at)',
+            'CREATE INDEX IF NOT EXISTS idx_channel_invites_invited_at ON channel_invites(invited_at)',
+            'CREATE INDEX IF NOT EXISTS idx_promo_logs_sent_at ON promo_logs(sent_at)',
+        ]
+        for done, sql in enumerate(indexes, 1):
+            conn.execute(sql)
+            yield done, len(indexes)
+    
+    def _migration_page_indexes(self, conn: sqlite3.Connection):
+        """迁移 5（后台）：分页排序键上的索引"""
+        indexes = [
+            'CREATE INDEX IF NOT EXISTS idx_users_last_active ON users(last_active)',
+            'CREATE INDEX IF NOT EXISTS idx_scheduled_tasks_time ON scheduled_tasks(scheduled_time)',
+        ]
+        for done, sql in enumerate(indexes, 1):
+            conn.execute(sql)
+            yield done, len(indexes)
+    
+    def _migration_search(self, cursor: sqlite3.Cursor):
+        """迁移 6：订单/用户的 FTS5 检索表和同步触发器（已有数据由迁移 7 回填）"""
+        for fts_table, columns in SEARCH_COLUMNS.values():
+            cursor.execute(f"""
+                CREATE VIRTUAL TABLE IF NOT EXISTS {fts_table}
+                USING fts5({', '.join(columns)}, tokenize='trigram')
+            """)
+        for name, trigger_sql in SEARCH_TRIGGERS.items():
+            cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+            cursor.execute(trigger_sql)
+    
+    def _migration_search_backfill(self, conn: sqlite3.Connection, chunk_size: int = 5000):
+        """迁移 7（后台）：按 rowid 分批把已有订单/用户写入检索表"""
+        totals = {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                  for table in SEARCH_COLUMNS}
+        total = sum(totals.values())
+        done = 0
+        for table, (fts_table, columns) in SEARCH_COLUMNS.items():
+            last_rowid = 0
+            while True:
+                # 与触发器写入的是同一份数据，INSERT OR REPLACE 保证重复执行无副作用
+                rows = conn.execute(f"""
+                    INSERT OR REPLACE INTO {fts_table} (rowid, {', '.join(columns)})
+                    SELECT rowid, {', '.join(columns)} FROM {table}
+                    WHERE rowid > ? ORDER BY rowid LIMIT ?
+                    RETURNING rowid
+                """, (last_rowid, chunk_size)).fetchall()
+                if not rows:
+                    break
+                last_rowid = max(row[0] for row in rows)
+                done += len(rows)
+                yield min(done, total), total
+    
+    def _migration_task_claims(self, cursor: sqlite3.Cursor):
+        """迁移 8：定时任务的认领者和认领（续约）时间"""
+        self._add_column_if_missing(cursor, 'scheduled_tasks', 'claimed_by', 'TEXT')
+        self._add_column_if_missing(cursor, 'scheduled_tasks', 'claimed_at', 'TIMESTAMP')
+    
+    def _migration_promo_log_index(self, conn: sqlite3.Connection):
+        """迁移 9（后台）：按任务查询已发送成功的目标（任务中断后续发用）"""
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_promo_logs_task ON promo_logs(task_id, target_chat) "
+            "WHERE status='success'"
+        )
+        yield 1, 1
+    
+    def _migration_promo_schedules(self, cursor: sqlite3.Cursor):
+        """迁移 10：重复发送规则表，每条规则只保存下一次触发时间"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS promo_schedules (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                template_id INTEGER NOT NULL,
+                target_chats TEXT NOT NULL,
+                rule TEXT NOT NULL,
+                next_run TIMESTAMP,
+                last_run TIMESTAMP,
+                is_active INTEGER DEFAULT 1,
+                created_by INTEGER NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                
+                FOREIGN KEY (template_id) REFERENCES promo_templates(id)
+            )
+        ''')
+        cursor.execute(
+            'CREATE INDEX IF NOT EXISTS idx_promo_schedules_next_run ON promo_schedules(next_run) '
+            'WHERE is_active=1'
+        )
+        # 由规则生成的任务记录来源
+        self._add_column_if_missing(cursor, 'scheduled_tasks', 'schedule_id', 'INTEGER')
+    
+    def _migration_media_cache(self, cursor: sqlite3.Cursor):
+        """迁移 11：URL/本地图片上传后得到的 Telegram file_id"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS media_cache (
+                source TEXT PRIMARY KEY,
+                file_id TEXT NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+    
+    def _migration_conversation_states(self, cursor: sqlite3.Cursor):
+        """迁移 12：多步骤对话的用户状态（updated_at 为 Unix 时间戳）"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS conversation_states (
+                user_id INTEGER PRIMARY KEY,
+                state TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        ''')
+    
+    def _migration_xianyu_awaiting_index(self, conn: sqlite3.Connection):
+        """迁移 13（后台）：还没有提交闲鱼订单号的待审核订单（只索引这一小部分订单）"""
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_orders_xianyu_awaiting ON orders(user_id, created_at) "
+            "WHERE payment_method='xianyu' AND status='pending' AND xianyu_order_number IS NULL"
+        )
+        yield 1, 1
+    
+    def _migration_stats_triggers(self, cursor: sqlite3.Cursor):
+        """迁移 14：重建订单更新触发器，只修改 created_at 时不再增减计数器"""
+        self._install_stats_triggers(cursor)
+    
+    def _migration_drop_stats_daily(self, cursor: sqlite3.Cursor):
+        """迁移 15：按天分桶已改为 stats_daily_rollup，移除旧的触发器计数表"""
+        # 旧版触发器会写入 stats_daily，先换成当前版本再删表
+        self._install_stats_triggers(cursor)
+        cursor.execute('DROP TABLE IF EXISTS stats_daily')
+    
+    # ========== 分页 ==========
+    
+    @staticmethod
+    def _encode_cursor(values: Tuple[Any, ...]) -> str:
+        return '|'.join(str(value) for value in values)
+    
+    @staticmethod
+    def _decode_cursor(cursor_value: str, types: Tuple[type, ...]) -> List[Any]:
+        parts = cursor_value.split('|')
+        if len(parts) != len(types):
+            raise ValueError(f"Invalid page cursor: {cursor_value!r}")
+        return [kind(part) for kind, part in zip(types, parts)]
+    
+    def _fetch_page(self, select: str, conditions: List[str], params: List[Any],
+                    keys: List[Tuple[str, str, type]], limit: int,
+                    after: Optional[str] = None, before: Optional[str] = None,
+                    cls=None) -> Page:
+        """
+        键集分页（按 keys 倒序）
+        
+        不使用 OFFSET，而是用上一页最后一条的排序键做范围条件，
+        翻到多深每页都只读 limit+1 行。
+        
+        Args:
+            select: "SELECT ... FROM ..." 部分
+            conditions / params: 额外的 WHERE 条件及参数
+            keys: 排序键 [(SQL 表达式, 结果列名, 类型)]，组合起来必须唯一
+            limit: 每页条数
+            after: 下一页游标（取比它更旧的记录）
+            before: 上一页游标（取比它更新的记录）
+            cls: 记录类型，None 时返回字典
+        """
+        conditions = list(conditions)
+        params = list(params)
+        key_exprs = ', '.join(expr for expr, _, _ in keys)
+        key_types = tuple(kind for _, _, kind in keys)
+        placeholders = ', '.join('?' * len(keys))
+        
+        if before:
+            conditions.append(f"({key_exprs}) > ({placeholders})")
+            params.extend(self._decode_cursor(before, key_types))
+            direction = 'ASC'
+        else:
+            if after:
+                conditions.append(f"({key_exprs}) < ({placeholders})")
+                params.extend(self._decode_cursor(after, key_types))
+            direction = 'DESC'
+        
+        query = select
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY " + ", ".join(f"{expr} {direction}" for expr, _, _ in keys)
+        query += " LIMIT ?"
+        params.append(limit + 1)
+        
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if before:
+            rows.reverse()
+        
+        columns = [desc[0] for desc in cursor.description]
+        key_indexes = [columns.index(field) for _, field, _ in keys]
+        if cls is None:
+            items = [row_to_dict(cursor, row) for row in rows]
+        else:
+            items = make_records(cursor, rows, cls)
+        conn.close()
+        
+        has_newer = has_more if before else bool(after)
+        has_older = True if before else has_more
+        
+        def key_of(row):
+            return self._encode_cursor(tuple(row[i] for i in key_indexes))
+        
+        return Page(
+            items,
+            key_of(rows[-1]) if rows and has_older else None,
+            key_of(rows[0]) if rows and has_newer else None,
+        )
+    
+    def get_users_page(self, is_member: Optional[bool] = None, limit: int = 20,
+                       after: Optional[str] = None, before: Optional[str] = None) -> Page:
+        """按最后活跃时间倒序分页获取用户"""
+        conditions, params = [], []
+        if is_member is not None:
+            conditions.append("is_member=?")
+            params.append(int(is_member))
+        return self._fetch_page(
+            "SELECT * FROM users", conditions, params,
+            [('last_active', 'last_active', str), ('user_id', 'user_id', int)],
+            limit, after, before, User
+        )
+    
+    def get_orders_page(self, status: Optional[str] = None, payment_method: Optional[str] = None,
+                        user_id: Optional[int] = None, limit: int = 20,
+                        after: Optional[str] = None, before: Optional[str] = None) -> Page:
+        """
+        按创建顺序倒序分页获取订单
+        
+        排序键用 rowid（与创建顺序一致），status / user_id 索引中的条目本身按 rowid 排列，
+        游标也足够短，可以放进 callback_data。orders 的 rowid 是隐式的，VACUUM 后可能重新编号，
+        此前生成的游标（已发出的翻页按钮）会翻到错误的位置，重新打开列表即可。
+        """
+        conditions, params = [], []
+        if status:
+            conditions.append("status=?")
+            params.append(status)
+        if payment_method:
+            conditions.append("payment_method=?")
+            params.append(payment_method)
+        if user_id is not None:
+            conditions.append("user_id=?")
+            params.append(user_id)
+        return self._fetch_page(
+            "SELECT rowid AS row_key, * FROM orders", conditions, params,
+            [('rowid', 'row_key', int)],
+            limit, after, before, Order
+        )
+    
+    def get_pending_xianyu_orders_page(self, limit: int = 5, after: Optional[str] = None,
+                                       before: Optional[str] = None) -> Page:
+        """分页获取待审核的闲鱼订单"""
+        return self.get_orders_page('pending', 'xianyu', limit=limit, after=after, before=before)
+    
+    def get_scheduled_tasks_page(self, status: Optional[str] = None, limit: int = 10,
+                                 after: Optional[str] = None, before: Optional[str] = None) -> Page:
+        """按发送时间倒序分页获取定时任务"""
+        conditions, params = [], []
+        if status:
+            conditions.append("status=?")
+            params.append(status)
+        return self._fetch_page(
+            "SELECT * FROM scheduled_tasks", conditions, params,
+            [('scheduled_time', 'scheduled_time', str), ('id', 'id', int)],
+            limit, after, before, ScheduledTask
+        )
+    
+    def get_promo_logs_page(self, limit: int = 20, after: Optional[str] = None,
+                            before: Optional[str] = None) -> Page:
+        """分页获取广告发送记录（按记录 ID 倒序，即发送时间倒序）"""
+        return self._fetch_page(
+            """SELECT pl.*, pt.name as template_name
+               FROM promo_logs pl
+               LEFT JOIN promo_templates pt ON pl.template_id = pt.id""",
+            [], [],
+            [('pl.id', 'id', int)],
+            limit, after, before
+        )
+    
     # ========== 用户操作 ==========
     
     def get_or_create_user(self, user_id: int, username: str = None, 
-                          first_name: str = None, last_name: str = None) -> Dict[str, Any]:
+                          first_name: str = None, last_name: str = None) -> User:
         """获取或创建用户"""
-        with self.lock:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            
+        def write(cursor: sqlite3.Cursor) -> User:
             cursor.execute("SELECT * FROM users WHERE user_id=?", (user_id,))
             row = cursor.fetchone()
             
@@ -193,73 +720,129 @@ class Database:
                     UPDATE users SET last_active=?, username=?, first_name=?, last_name=?
                     WHERE user_id=?
                 """, (datetime.now(), username, first_name, last_name, user_id))
-                conn.commit()
             else:
                 # 创建新用户
                 cursor.execute("""
                     INSERT INTO users (user_id, username, first_name, last_name, last_active)
                     VALUES (?, ?, ?, ?, ?)
                 """, (user_id, username, first_name, last_name, datetime.now()))
-                conn.commit()
             
             # 返回用户信息
             cursor.execute("SELECT * FROM users WHERE user_id=?", (user_id,))
-            row = cursor.fetchone()
-            columns = [desc[0] for desc in cursor.description]
-            conn.close()
-            
-            return dict(zip(columns, row))
+            return fetch_one(cursor, User)
+        
+        return self.writer.execute(write)
     
-    def update_user_membership(self, user_id: int, days: int, order_id: str) -> bool:
-        """更新用户会员状态"""
-        with self.lock:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute("SELECT member_until FROM users WHERE user_id=?", (user_id,))
-            row = cursor.fetchone()
-            
-            if row and row[0]:
-                # 已有会员，延期
-                current_until = datetime.fromisoformat(row[0])
-                if current_until > datetime.now():
-                    new_until = current_until + timedelta(days=days)
-                else:
-                    new_until = datetime.now() + timedelta(days=days)
+    def update_user_membership(self, user_id: int, days: int, order_id: str,
+                               amount: float = 0, currency: Optional[str] = None) -> bool:
+        """
+        更新用户会员状态（延期 + 累计消费在同一事务中完成）
+        
+        Args:
+            user_id: 用户 ID
+            days: 延长天数
+            order_id: 关联订单号（写入日志）
+            amount / currency: 本次消费金额和币种，为空时不累计消费
+        """
+        return self.writer.execute(
+            lambda cursor: self._extend_membership(cursor, user_id, days, order_id, amount, currency)
+        )
+    
+    def _extend_membership(self, cursor: sqlite3.Cursor, user_id: int, days: int, order_id: str,
+                           amount: float = 0, currency: Optional[str] = None) -> bool:
+        """在当前写事务中延长会员、累计消费并记录日志"""
+        now = datetime.now()
+        cursor.execute("SELECT member_until FROM users WHERE user_id=?", (user_id,))
+        row = cursor.fetchone()
+        
+        if row and row[0]:
+            # 已有会员，延期
+            current_until = datetime.fromisoformat(row[0])
+            if current_until > now:
+                new_until = current_until + timedelta(days=days)
             else:
-                # 新会员
-                new_until = datetime.now() + timedelta(days=days)
-            
+                new_until = now + timedelta(days=days)
+        else:
+            # 新会员
+            new_until = now + timedelta(days=days)
+        
+        spend_field = {'USDT': 'total_spent_usdt', 'CNY': 'total_spent_cny'}.get(currency)
+        spend_sql = f", {spend_field}=COALESCE({spend_field}, 0) + ?" if spend_field and amount else ''
+        params: List[Any] = [now, new_until]
+        if spend_sql:
+            params.append(amount)
+        params.append(user_id)
+        
+        cursor.execute(f"""
+            UPDATE users 
+            SET is_member=1, member_since=COALESCE(member_since, ?), member_until=?{spend_sql}
+            WHERE user_id=?
+        """, params)
+        success = cursor.rowcount > 0
+        
+        if success:
             cursor.execute("""
-                UPDATE users 
-                SET is_member=1, member_since=COALESCE(member_since, ?), member_until=?
-                WHERE user_id=?
-            """, (datetime.now(), new_until, user_id))
-            
-            conn.commit()
-            success = cursor.rowcount > 0
-            conn.close()
+                INSERT INTO system_logs (log_type, user_id, order_id, message)
+                VALUES ('membership_updated', ?, ?, ?)
+            """, (user_id, order_id, f"Membership extended to {new_until}"))
+        
+        return success
+    
+    def activate_order(self, order_id: str, from_status: str = 'pending', **kwargs) -> Optional[Order]:
+        """
+        确认订单已支付并激活会员
+        
+        订单状态 from_status -> paid、会员延期、累计消费、日志在同一个事务中提交，
+        任何一步失败都会整体回滚；订单已被其他请求处理时返回 None。
+        
+        Args:
+            order_id: 订单号
+            from_status: 期望的当前状态
+            **kwargs: 同时更新的订单字段（如 tron_tx_hash）
             
-            if success:
-                self.add_log('membership_updated', user_id, order_id, 
-                           f"Membership extended to {new_until}")
+        Returns:
+            激活成功时返回更新后的订单，否则返回 None
+        """
+        if 'paid' not in ORDER_TRANSITIONS.get(from_status, ()):
+            raise ValueError(f"Invalid order transition: {from_status} -> paid")
+        
+        update_fields = ['status=?', 'paid_at=?']
+        params: List[Any] = ['paid', datetime.now()]
+        for key, value in kwargs.items():
+            update_fields.append(f'{key}=?')
+            params.append(value)
+        params.extend([order_id, from_status])
+        
+        def write(cursor: sqlite3.Cursor) -> Optional[Order]:
+            cursor.execute(f"""
+                UPDATE orders SET {', '.join(update_fields)}
+                WHERE order_id=? AND status=?
+                RETURNING *
+            """, params)
+            order = fetch_one(cursor, Order)
+            if order is None:
+                return None
             
-            return success
+            # 下单用户理论上都已存在，缺失时补建，保证会员不会丢
+            cursor.execute("INSERT OR IGNORE INTO users (user_id) VALUES (?)", (order.user_id,))
+            self._extend_membership(
+                cursor, order.user_id, order.membership_days, order_id,
+                order.amount, order.currency
+            )
+            return order
+        
+        return self.writer.execute(write)
     
-    def get_user(self, user_id: int) -> Optional[Dict[str, Any]]:
+    def get_user(self, user_id: int) -> Optional[User]:
         """获取用户信息"""
         conn = self.get_connection()
         cursor = conn.cursor()
         cursor.execute("SELECT * FROM users WHERE user_id=?", (user_id,))
-        row = cursor.fetchone()
+        user = fetch_one(cursor, User)
         conn.close()
-        
-        if row:
-            columns = [desc[0] for desc in cursor.description]
-            return dict(zip(columns, row))
-        return None
+        return user
     
-    def get_all_users(self, is_member: Optional[bool] = None, limit: int = 100) -> List[Dict[str, Any]]:
+    def get_all_users(self, is_member: Optional[bool] = None, limit: int = 100) -> List[User]:
         """获取所有用户"""
         conn = self.get_connection()
         cursor = conn.cursor()
@@ -272,120 +855,217 @@ class Database:
         else:
             cursor.execute("SELECT * FROM users ORDER BY last_active DESC LIMIT ?", (limit,))
         
-        rows = cursor.fetchall()
-        columns = [desc[0] for desc in cursor.description]
+        users = fetch_all(cursor, User)
         conn.close()
-        
-        return [dict(zip(columns, row)) for row in rows]
+        return users
     
     def check_expired_members(self) -> List[int]:
         """检查过期会员"""
+        def write(cursor: sqlite3.Cursor) -> List[int]:
+            cursor.execute("""
+                UPDATE users SET is_member=0 
+                WHERE is_member=1 AND member_until < ?
+                RETURNING user_id
+            """, (datetime.now(),))
+            return [row[0] for row in cursor.fetchall()]
+        
+        return self.writer.execute(write)
+    
+    def get_expired_members(self, until: datetime, after: Optional[Tuple[str, int]] = None,
+                            limit: int = 100) -> List[Tuple[int, str]]:
+        """
+        按 (member_until, user_id) 顺序获取已过期的用户（走 idx_users_member_until）
+        
+        Args:
+            until: 过期截止时间
+            after: 上次处理到的 (member_until, user_id)，只返回其后的用户
+            limit: 每批数量
+            
+        Returns:
+            [(user_id, member_until), ...]
+        """
+        last_until, last_user_id = after if after else ('', 0)
+        
         conn = self.get_connection()
         cursor = conn.cursor()
-        
         cursor.execute("""
-            SELECT user_id FROM users 
-            WHERE is_member=1 AND member_until < ?
-        """, (datetime.now(),))
+            SELECT user_id, member_until FROM users
+            WHERE member_until <= ? AND (member_until, user_id) > (?, ?)
+            ORDER BY member_until, user_id
+            LIMIT ?
+        """, (until, last_until, last_user_id, limit))
+        rows = cursor.fetchall()
+        conn.close()
+        return rows
+    
+    def expire_memberships(self, user_ids: List[int], until: datetime) -> List[int]:
+        """
+        取消一批用户的会员状态（期间已续费的用户会被跳过）
+        
+        Returns:
+            仍处于过期状态的用户 ID 列表（包括之前已被取消的，便于中断后重新移出频道）
+        """
+        if not user_ids:
+            return []
         
-        expired_users = [row[0] for row in cursor.fetchall()]
+        placeholders = ','.join('?' * len(user_ids))
         
-        if expired_users:
-            cursor.execute("""
-                UPDATE users SET is_member=0 
-                WHERE user_id IN ({})
-            """.format(','.join('?' * len(expired_users))), expired_users)
-            conn.commit()
+        def write(cursor: sqlite3.Cursor) -> List[int]:
+            cursor.execute(f"""
+                UPDATE users SET is_member=0
+                WHERE user_id IN ({placeholders}) AND is_member=1 AND member_until <= ?
+                RETURNING user_id
+            """, list(user_ids) + [until])
+            cursor.executemany("""
+                INSERT INTO system_logs (log_type, user_id, order_id, message)
+                VALUES ('membership_expired', ?, NULL, 'Membership expired')
+            """, cursor.fetchall())
+            
+            cursor.execute(f"""
+                SELECT user_id FROM users
+                WHERE user_id IN ({placeholders}) AND member_until <= ?
+            """, list(user_ids) + [until])
+            return [row[0] for row in cursor.fetchall()]
         
-        conn.close()
-        return expired_users
+        return self.writer.execute(write)
     
     # ========== 订单操作 ==========
     
     def create_order(self, order_data: Dict[str, Any]) -> bool:
         """创建订单"""
-        with self.lock:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            
-            try:
-                cursor.execute("""
-                    INSERT INTO orders 
-                    (order_id, user_id, payment_method, plan_type, amount, currency, 
-                     status, created_at, membership_days, user_notes, tron_order_id)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """, (
-                    order_data['order_id'],
-                    order_data['user_id'],
-                    order_data['payment_method'],
-                    order_data['plan_type'],
-                    order_data['amount'],
-                    order_data['currency'],
-                    order_data.get('status', 'pending'),
-                    order_data.get('created_at', datetime.now()),
-                    order_data['membership_days'],
-                    order_data.get('user_notes', ''),
-                    order_data.get('tron_order_id', '')
-                ))
-                conn.commit()
-                return True
-            except Exception as e:
-                logger.error(f"Failed to create order: {e}")
-                return False
-            finally:
-                conn.close()
+        def write(cursor: sqlite3.Cursor):
+            cursor.execute("""
+                INSERT INTO orders 
+                (order_id, user_id, payment_method, plan_type, amount, currency, 
+                 status, created_at, membership_days, user_notes, tron_order_id, expires_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (
+                order_data['order_id'],
+                order_data['user_id'],
+                order_data['payment_method'],
+                order_data['plan_type'],
+                order_data['amount'],
+                order_data['currency'],
+                order_data.get('status', 'pending'),
+                order_data.get('created_at', datetime.now()),
+                order_data['membership_days'],
+                order_data.get('user_notes', ''),
+                order_data.get('tron_order_id', ''),
+                order_data.get('expires_at')
+            ))
+        
+        try:
+            self.writer.execute(write)
+            return True
+        except Exception as e:
+            logger.error(f"Failed to create order: {e}")
+            return False
     
     def update_order_status(self, order_id: str, status: str, **kwargs) -> bool:
         """更新订单状态"""
-        with self.lock:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            
-            update_fields = ['status=?']
-            params = [status]
-            
-            if status == 'paid':
-                update_fields.append('paid_at=?')
-                params.append(datetime.now())
-            elif status == 'cancelled':
-                update_fields.append('cancelled_at=?')
-                params.append(datetime.now())
-            elif status == 'expired':
-                update_fields.append('expired_at=?')
-                params.append(datetime.now())
-            
-            # 额外字段
-            for key, value in kwargs.items():
-                update_fields.append(f'{key}=?')
-                params.append(value)
-            
-            params.append(order_id)
-            
+        update_fields = ['status=?']
+        params = [status]
+        
+        if status in ORDER_STATUS_TIMESTAMPS:
+            update_fields.append(f'{ORDER_STATUS_TIMESTAMPS[status]}=?')
+            params.append(datetime.now())
+        
+        # 额外字段
+        for key, value in kwargs.items():
+            update_fields.append(f'{key}=?')
+            params.append(value)
+        
+        params.append(order_id)
+        
+        def write(cursor: sqlite3.Cursor) -> bool:
             cursor.execute(f"""
                 UPDATE orders SET {', '.join(update_fields)}
                 WHERE order_id=?
             """, params)
+            return cursor.rowcount > 0
+        
+        return self.writer.execute(write)
+    
+    def submit_xianyu_order_number(self, order_id: str, xianyu_order_number: str) -> bool:
+        """
+        为待审核的闲鱼订单填写闲鱼订单号（比较并设置）
+        
+        订单已过期/取消/支付或已填写过订单号时不修改，返回 False。
+        """
+        def write(cursor: sqlite3.Cursor) -> bool:
+            cursor.execute("""
+                UPDATE orders SET xianyu_order_number=?
+                WHERE order_id=? AND status='pending' AND xianyu_order_number IS NULL
+            """, (xianyu_order_number, order_id))
+            return cursor.rowcount > 0
+        
+        return self.writer.execute(write)
+    
+    def transition_order(self, order_id: str, from_status: str, to_status: str,
+                         **kwargs) -> Optional[Order]:
+        """
+        按状态机转换订单状态（比较并设置）
+        
+        只有订单当前状态仍为 from_status 时才会更新，并发的多次操作（管理员重复点击、
+        支付回调与人工审核同时到达）只有一个会成功。
+        
+        Args:
+            order_id: 订单号
+            from_status: 期望的当前状态
+            to_status: 目标状态
+            **kwargs: 同时更新的其他字段（如 tron_tx_hash、admin_notes）
             
-            conn.commit()
-            success = cursor.rowcount > 0
-            conn.close()
+        Returns:
+            转换成功时返回更新后的订单，否则返回 None
             
-            return success
+        Raises:
+            ValueError: 不允许的状态转换
+        """
+        if to_status not in ORDER_TRANSITIONS.get(from_status, ()):
+            raise ValueError(f"Invalid order transition: {from_status} -> {to_status}")
+        
+        update_fields = ['status=?']
+        params: List[Any] = [to_status]
+        if to_status in ORDER_STATUS_TIMESTAMPS:
+            update_fields.append(f'{ORDER_STATUS_TIMESTAMPS[to_status]}=?')
+            params.append(datetime.now())
+        for key, value in kwargs.items():
+            update_fields.append(f'{key}=?')
+            params.append(value)
+        params.extend([order_id, from_status])
+        
+        def write(cursor: sqlite3.Cursor) -> Optional[Order]:
+            cursor.execute(f"""
+                UPDATE orders SET {', '.join(update_fields)}
+                WHERE order_id=? AND status=?
+                RETURNING *
+            """, params)
+            return fetch_one(cursor, Order)
+        
+        return self.writer.execute(write)
     
-    def get_order(self, order_id: str) -> Optional[Dict[str, Any]]:
+    def get_order(self, order_id: str) -> Optional[Order]:
         """获取订单信息"""
         conn = self.get_connection()
         cursor = conn.cursor()
         cursor.execute("SELECT * FROM orders WHERE order_id=?", (order_id,))
-        row = cursor.fetchone()
+        order = fetch_one(cursor, Order)
         conn.close()
-        
-        if row:
-            columns = [desc[0] for desc in cursor.description]
-            return dict(zip(columns, row))
-        return None
+        return order
     
-    def get_user_orders(self, user_id: int, status: Optional[str] = None, limit: int = 50) -> List[Dict[str, Any]]:
+    def get_pending_order_by_tron_id(self, tron_order_id: str) -> Optional[Order]:
+        """根据 TRON 支付单号查询待支付订单"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT * FROM orders WHERE tron_order_id=? AND status='pending'",
+            (tron_order_id,)
+        )
+        order = fetch_one(cursor, Order)
+        conn.close()
+        return order
+    
+    def get_user_orders(self, user_id: int, status: Optional[str] = None, limit: int = 50) -> List[Order]:
         """获取用户订单"""
         conn = self.get_connection()
         cursor = conn.cursor()
@@ -403,13 +1083,41 @@ class Database:
                 ORDER BY created_at DESC LIMIT ?
             """, (user_id, limit))
         
-        rows = cursor.fetchall()
-        columns = [desc[0] for desc in cursor.description]
+        orders = fetch_all(cursor, Order)
         conn.close()
+        return orders
+    
+    def get_all_orders(self, status: Optional[str] = None, limit: int = 100) -> List[Order]:
+        """获取最近的订单（管理功能）"""
+        return list(self.iter_orders(status=status, limit=limit))
+    
+    def iter_orders(self, status: Optional[str] = None, limit: Optional[int] = None,
+                    chunk_size: int = 500) -> Iterator[Order]:
+        """
+        按创建时间倒序惰性遍历订单
+        
+        用于导出等批量场景：逐批读取，不会一次性把所有订单载入内存。
+        迭代结束（或生成器被关闭）时释放数据库连接。
+        """
+        query = "SELECT * FROM orders"
+        params: List[Any] = []
+        if status:
+            query += " WHERE status=?"
+            params.append(status)
+        query += " ORDER BY created_at DESC"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
         
-        return [dict(zip(columns, row)) for row in rows]
+        conn = self.get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            yield from iter_rows(cursor, Order, chunk_size)
+        finally:
+            conn.close()
     
-    def get_pending_xianyu_orders(self) -> List[Dict[str, Any]]:
+    def get_pending_xianyu_orders(self) -> List[Order]:
         """获取待审核的闲鱼订单"""
         conn = self.get_connection()
         cursor = conn.cursor()
@@ -420,26 +1128,43 @@ class Database:
             ORDER BY created_at DESC
         """)
         
-        rows = cursor.fetchall()
-        columns = [desc[0] for desc in cursor.description]
+        orders = fetch_all(cursor, Order)
         conn.close()
-        
-        return [dict(zip(columns, row)) for row in rows]
+        return orders
+    
+    def get_xianyu_awaiting_users(self) -> set:
+        """有待提交闲鱼订单号订单的用户（启动时加载）"""
+        conn = self.get_connection()
+        rows = conn.execute("""
+            SELECT DISTINCT user_id FROM orders
+            WHERE payment_method='xianyu' AND status='pending' AND xianyu_order_number IS NULL
+        """).fetchall()
+        conn.close()
+        return {row[0] for row in rows}
+    
+    def get_xianyu_awaiting_order_id(self, user_id: int) -> Optional[str]:
+        """用户最近一个待提交闲鱼订单号的订单（走 idx_orders_xianyu_awaiting）"""
+        conn = self.get_connection()
+        row = conn.execute("""
+            SELECT order_id FROM orders
+            WHERE user_id=?
+            AND payment_method='xianyu' AND status='pending' AND xianyu_order_number IS NULL
+            ORDER BY created_at DESC
+            LIMIT 1
+        """, (user_id,)).fetchone()
+        conn.close()
+        return row[0] if row else None
     
-    def get_order_by_xianyu_number(self, xianyu_number: str) -> Optional[Dict[str, Any]]:
+    def get_order_by_xianyu_number(self, xianyu_number: str) -> Optional[Order]:
         """根据闲鱼订单号查询"""
         conn = self.get_connection()
         cursor = conn.cursor()
         cursor.execute("""
             SELECT * FROM orders WHERE xianyu_order_number=?
         """, (xianyu_number,))
-        row = cursor.fetchone()
+        order = fetch_one(cursor, Order)
         conn.close()
-        
-        if row:
-            columns = [desc[0] for desc in cursor.description]
-            return dict(zip(columns, row))
-        return None
+        return order
     
     def count_user_pending_orders(self, user_id: int) -> int:
         """统计用户待支付订单数"""
@@ -467,6 +1192,72 @@ class Database:
             return datetime.fromisoformat(row[0])
         return None
     
+    def get_pending_order_counts(self) -> Dict[int, int]:
+        """各用户的待支付订单数（用于初始化防刷限制）"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT user_id, COUNT(*) FROM orders
+            WHERE status='pending'
+            GROUP BY user_id
+        """)
+        counts = dict(cursor.fetchall())
+        conn.close()
+        return counts
+    
+    def get_last_order_times(self, since: datetime) -> Dict[int, datetime]:
+        """since 之后下过单的用户及其最后下单时间（走 idx_orders_created_at）"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT user_id, MAX(created_at) FROM orders
+            WHERE created_at >= ?
+            GROUP BY user_id
+        """, (since,))
+        times = {user_id: datetime.fromisoformat(created_at) for user_id, created_at in cursor.fetchall()}
+        conn.close()
+        return times
+    
+    def expire_orders(self, payment_method: str, new_status: str,
+                      timeout_minutes: int) -> List[Tuple[str, int]]:
+        """
+        将已过期的待支付订单批量标记为过期（单条 UPDATE ... RETURNING）
+        
+        Args:
+            payment_method: 支付方式（'tron' / 'xianyu'）
+            new_status: 过期后的状态（'timeout' / 'expired'）
+            timeout_minutes: 超时时间（分钟），仅用于补齐没有 expires_at 的旧订单
+            
+        Returns:
+            被过期的 (order_id, user_id) 列表，供调用方通知用户
+        """
+        now = datetime.now()
+        
+        def write(cursor: sqlite3.Cursor) -> List[Tuple[str, int]]:
+            # 旧订单创建时没有写 expires_at，按 created_at + 超时时间补齐
+            cursor.execute("""
+                UPDATE orders
+                SET expires_at = strftime('%Y-%m-%d %H:%M:%f', created_at, ?)
+                WHERE status='pending' AND payment_method=? AND expires_at IS NULL
+            """, (f'+{int(timeout_minutes)} minutes', payment_method))
+            
+            cursor.execute("""
+                UPDATE orders
+                SET status=?, expired_at=?
+                WHERE status='pending' AND payment_method=? AND expires_at <= ?
+                RETURNING order_id, user_id
+            """, (new_status, now, payment_method, now))
+            return cursor.fetchall()
+        
+        expired_orders = self.writer.execute(write)
+        
+        if expired_orders:
+            logger.info(f"Expired {len(expired_orders)} {payment_method} order(s) -> {new_status}")
+            for order_id, user_id in expired_orders:
+                logger.debug(f"  - Order {order_id} (user {user_id}) {new_status}")
+        
+        return expired_orders
+    
     def cleanup_expired_xianyu_orders(self, timeout_minutes: int) -> int:
         """
         清理过期的闲鱼待支付订单
@@ -477,51 +1268,11 @@ class Database:
         Returns:
             清理的订单数量
         """
-        with self.lock:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            
-            # 计算超时时间点
-            timeout_time = datetime.now() - timedelta(minutes=timeout_minutes)
-            
-            # 查找过期的闲鱼pending订单
-            cursor.execute("""
-                SELECT order_id, user_id FROM orders
-                WHERE payment_method='xianyu' 
-                AND status='pending'
-                AND created_at < ?
-            """, (timeout_time,))
-            
-            expired_orders = cursor.fetchall()
-            
-            if expired_orders:
-                # 批量更新为expired状态
-                order_ids = [order[0] for order in expired_orders]
-                placeholders = ','.join('?' * len(order_ids))
-                cursor.execute(f"""
-                    UPDATE orders 
-                    SET status='expired', expired_at=?
-                    WHERE order_id IN ({placeholders})
-                """, [datetime.now()] + order_ids)
-                
-                conn.commit()
-                count = cursor.rowcount
-                
-                # 记录日志
-                logger = logging.getLogger('database')
-                logger.info(f"Cleaned up {count} expired xianyu orders (timeout: {timeout_minutes} min)")
-                for order_id, user_id in expired_orders:
-                    logger.debug(f"  - Order {order_id} (user {user_id}) expired")
-                
-                conn.close()
-                return count
-            
-            conn.close()
-            return 0
+        return len(self.expire_orders('xianyu', 'expired', timeout_minutes))
     
     def cleanup_expired_tron_orders(self, timeout_minutes: int) -> int:
         """
-        清理过期的 TRON (USDT) 待支付订单
+        清理过期的 TRON (USDT) 待支付订单（状态与 tron_payment.py 保持一致）
         
         Args:
             timeout_minutes: 超时时间（分钟）
@@ -529,159 +1280,379 @@ class Database:
         Returns:
             清理的订单数量
         """
-        with self.lock:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            
-            # 计算超时时间点
-            timeout_time = datetime.now() - timedelta(minutes=timeout_minutes)
-            
-            # 查找过期的 TRON pending 订单
+        return len(self.expire_orders('tron', 'timeout', timeout_minutes))
+    
+    # ========== 检索 ==========
+    
+    @staticmethod
+    def _fts_phrase(text: str) -> str:
+        """把用户输入转成 FTS5 短语（按原样匹配，不解析查询语法）"""
+        return '"' + text.replace('"', '""') + '"'
+    
+    def search(self, text: str, limit: int = 10) -> Dict[str, list]:
+        """
+        按片段检索订单和用户（订单号、用户 ID、用户名、闲鱼订单号、TRON 订单号/交易哈希）
+        
+        完整的订单号直接走主键；其他 3 个字符以上的输入走 trigram 全文索引；
+        更短的输入只做订单号/用户 ID 精确匹配。
+        
+        Returns:
+            {'orders': [Order, ...], 'users': [User, ...]}，均按最新在前
+        """
+        text = text.strip()
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("SELECT * FROM orders WHERE order_id=?", (text,))
+        orders = fetch_all(cursor, Order)
+        
+        if len(text) >= SEARCH_MIN_LENGTH:
+            phrase = self._fts_phrase(text)
+            if not orders:
+                # 订单号前缀高度重复（如 ORD000...），完整订单号走主键比全文索引快得多
+                cursor.execute("""
+                    SELECT * FROM orders WHERE rowid IN (
+                        SELECT rowid FROM orders_fts WHERE orders_fts MATCH ?
+                        ORDER BY rowid DESC LIMIT ?
+                    )
+                    ORDER BY rowid DESC
+                """, (phrase, limit))
+                orders = fetch_all(cursor, Order)
             cursor.execute("""
-                SELECT order_id, user_id FROM orders
-                WHERE payment_method='tron' 
-                AND status='pending'
-                AND created_at < ?
-            """, (timeout_time,))
-            
-            expired_orders = cursor.fetchall()
-            
-            if expired_orders:
-                # 批量更新为 timeout 状态（与 tron_payment.py 保持一致）
-                order_ids = [order[0] for order in expired_orders]
-                placeholders = ','.join('?' * len(order_ids))
-                cursor.execute(f"""
-                    UPDATE orders 
-                    SET status='timeout', expired_at=?
-                    WHERE order_id IN ({placeholders})
-                """, [datetime.now()] + order_ids)
-                
-                conn.commit()
-                count = cursor.rowcount
-                
-                # 记录日志
-                logger = logging.getLogger('database')
-                logger.info(f"Cleaned up {count} expired TRON orders (timeout: {timeout_minutes} min)")
-                for order_id, user_id in expired_orders:
-                    logger.debug(f"  - Order {order_id} (user {user_id}) timed out")
-                
-                conn.close()
-                return count
-            
-            conn.close()
-            return 0
+                SELECT * FROM users WHERE user_id IN (
+                    SELECT rowid FROM users_fts WHERE users_fts MATCH ?
+                    ORDER BY rowid DESC LIMIT ?
+                )
+                ORDER BY user_id DESC
+            """, (phrase, limit))
+            users = fetch_all(cursor, User)
+        else:
+            users = []
+            if text.isdigit():
+                cursor.execute("SELECT * FROM users WHERE user_id=?", (int(text),))
+                users = fetch_all(cursor, User)
+        
+        conn.close()
+        return {'orders': orders, 'users': users}
     
     # ========== 邀请记录 ==========
     
     def add_channel_invite(self, user_id: int, order_id: str, status: str = 'success'):
         """记录频道邀请"""
-        with self.lock:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute("""
-                INSERT INTO channel_invites (user_id, order_id, invite_status)
-                VALUES (?, ?, ?)
-            """, (user_id, order_id, status))
-            conn.commit()
-            conn.close()
+        self.writer.execute(lambda cursor: cursor.execute("""
+            INSERT INTO channel_invites (user_id, order_id, invite_status)
+            VALUES (?, ?, ?)
+        """, (user_id, order_id, status)))
     
     # ========== 统计 ==========
     
     def get_statistics(self) -> Dict[str, Any]:
-        """获取系统统计"""
+        """
+        获取系统统计
+        
+        累计数据直接读取触发器维护的计数器；今日数据是 created_at
+        上的索引范围扫描，开销只与当天订单量有关。
+        """
         conn = self.get_connection()
         cursor = conn.cursor()
         
-        # 用户统计
+        cursor.execute("SELECT name, value FROM stats_counters")
+        counters = dict(cursor.fetchall())
+        
+        # 今日统计：按业务时区的今天做 created_at 索引范围扫描
+        today = self._aggregate_range(cursor, *self._day_range(self.business_today()))
+        
+        conn.close()
+        
+        return {
+            'total_users': int(counters.get('users_total', 0)),
+            'active_members': int(counters.get('users_members', 0)),
+            'total_orders': int(counters.get('orders_total', 0)),
+            'paid_orders': int(counters.get('orders_status:paid', 0)),
+            'pending_orders': int(counters.get('orders_status:pending', 0)),
+            'cancelled_orders': int(counters.get('orders_status:cancelled', 0)),
+            'expired_orders': int(counters.get('orders_status:expired', 0)
+                                  + counters.get('orders_status:timeout', 0)),
+            'total_usdt': counters.get('revenue:USDT', 0),
+            'total_cny': counters.get('revenue:CNY', 0),
+            'today_orders': today['orders'],
+            'today_paid': today['paid_orders']
+        }
+    
+    def rebuild_statistics(self):
+        """根据现有数据重建统计计数器（用于修正计数漂移）"""
+        self.writer.execute(self._rebuild_statistics)
+        logger.info("Statistics counters rebuilt")
+    
+    def rebuild_search_index(self, tables: Optional[List[str]] = None) -> Dict[str, int]:
+        """
+        按源表当前的 rowid 重建检索表（VACUUM 重新编号 orders 的 rowid 后使用）
+
+        每张表在一个写事务中完成，期间其他写入排队等待。
+
+        Returns:
+            {表名: 写入检索表的记录数}
+        """
+        counts = {}
+        for table in tables or SEARCH_COLUMNS:
+            fts_table, columns = SEARCH_COLUMNS[table]
+            
+            def rebuild(cursor: sqlite3.Cursor) -> int:
+                cursor.execute(f"DELETE FROM {fts_table}")
+                cursor.execute(f"""
+                    INSERT INTO {fts_table} (rowid, {', '.join(columns)})
+                    SELECT rowid, {', '.join(columns)} FROM {table}
+                """)
+                return cursor.rowcount
+            
+            counts[table] = self.writer.execute(rebuild)
+            logger.info(f"Search index {fts_table} rebuilt ({counts[table]} rows)")
+        return counts
+    
+    def _rebuild_statistics(self, cursor: sqlite3.Cursor):
+        cursor.execute("DELETE FROM stats_counters")
+        
         cursor.execute("""
-            SELECT 
-                COUNT(*) as total_users,
-                SUM(CASE WHEN is_member=1 THEN 1 ELSE 0 END) as active_members
-            FROM users
+            INSERT INTO stats_counters (name, value)
+            SELECT 'users_total', COUNT(*) FROM users
+            UNION ALL
+            SELECT 'users_members', COUNT(*) FROM users WHERE is_member=1
+            UNION ALL
+            SELECT 'orders_total', COUNT(*) FROM orders
         """)
-        user_stats = cursor.fetchone()
-        
-        # 订单统计
         cursor.execute("""
-            SELECT 
-                COUNT(*) as total_orders,
-                SUM(CASE WHEN status='paid' THEN 1 ELSE 0 END) as paid_orders,
-                SUM(CASE WHEN status='pending' THEN 1 ELSE 0 END) as pending_orders,
-                SUM(CASE WHEN status='paid' AND currency='USDT' THEN amount ELSE 0 END) as total_usdt,
-                SUM(CASE WHEN status='paid' AND currency='CNY' THEN amount ELSE 0 END) as total_cny
-            FROM orders
+            INSERT INTO stats_counters (name, value)
+            SELECT 'orders_status:' || status, COUNT(*) FROM orders GROUP BY status
+        """)
+        cursor.execute("""
+            INSERT INTO stats_counters (name, value)
+            SELECT 'revenue:' || currency, SUM(amount) FROM orders
+            WHERE status='paid' GROUP BY currency
         """)
-        order_stats = cursor.fetchone()
         
-        # 今日统计
+        # 每日汇总会在下次查询时按需重新计算
+        cursor.execute("DELETE FROM stats_daily_rollup")
+    
+    # ========== 分时段统计 ==========
+    
+    def business_today(self) -> date:
+        """业务时区的今天"""
+        if self.stats_tz is None:
+            return date.today()
+        return datetime.now(self.stats_tz).date()
+    
+    def _to_storage_time(self, business_time: datetime) -> datetime:
+        """业务时区的本地时间 -> created_at 的存储时间（服务器本地时间）"""
+        if self.stats_tz is None:
+            return business_time
+        return business_time.replace(tzinfo=self.stats_tz).astimezone().replace(tzinfo=None)
+    
+    def _to_business_time(self, stored: str) -> datetime:
+        """created_at 的存储值 -> 业务时区的本地时间"""
+        value = datetime.fromisoformat(stored)
+        if self.stats_tz is None:
+            return value
+        return value.astimezone(self.stats_tz).replace(tzinfo=None)
+    
+    def _day_range(self, day: date) -> Tuple[datetime, datetime]:
+        """业务日 [00:00, 次日00:00) 对应的 created_at 存储区间"""
+        start = datetime.combine(day, dtime.min)
+        return self._to_storage_time(start), self._to_storage_time(start + timedelta(days=1))
+    
+    @staticmethod
+    def _aggregate_range(cursor: sqlite3.Cursor, start: datetime, end: datetime) -> Dict[str, Any]:
+        """统计 created_at 在 [start, end) 内的订单（走 idx_orders_created_at 覆盖索引）"""
         cursor.execute("""
             SELECT 
-                COUNT(*) as today_orders,
-                SUM(CASE WHEN status='paid' THEN 1 ELSE 0 END) as today_paid
+                COUNT(*),
+                SUM(CASE WHEN status='paid' THEN 1 ELSE 0 END),
+                SUM(CASE WHEN status='paid' AND currency='USDT' THEN amount ELSE 0 END),
+                SUM(CASE WHEN status='paid' AND currency='CNY' THEN amount ELSE 0 END)
             FROM orders
-            WHERE DATE(created_at) = DATE('now')
-        """)
-        today_stats = cursor.fetchone()
-        
+            WHERE created_at >= ? AND created_at < ?
+        """, (start, end))
+        row = cursor.fetchone()
+        return {
+            'orders': row[0],
+            'paid_orders': row[1] or 0,
+            'revenue_usdt': row[2] or 0,
+            'revenue_cny': row[3] or 0
+        }
+    
+    def get_today_stats(self) -> Dict[str, Any]:
+        """今日统计（业务时区）"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        today = self.business_today()
+        stats = self._aggregate_range(cursor, *self._day_range(today))
         conn.close()
+        stats['day'] = today.isoformat()
+        return stats
+    
+    def get_daily_stats(self, days: int = 7) -> List[Dict[str, Any]]:
+        """
+        最近 N 天的每日统计（按日期升序，最后一项为今天）
         
-        return {
-            'total_users': user_stats[0],
-            'active_members': user_stats[1],
-            'total_orders': order_stats[0],
-            'paid_orders': order_stats[1],
-            'pending_orders': order_stats[2],
-            'total_usdt': order_stats[3] or 0,
-            'total_cny': order_stats[4] or 0,
-            'today_orders': today_stats[0],
-            'today_paid': today_stats[1]
+        已结束的日期读取 stats_daily_rollup，缺失时计算一次并写入；
+        今天始终实时统计。
+        """
+        today = self.business_today()
+        first_day = today - timedelta(days=days - 1)
+        
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT day, orders, paid_orders, revenue_usdt, revenue_cny
+            FROM stats_daily_rollup
+            WHERE tz=? AND day >= ? AND day < ?
+        """, (self.stats_timezone, first_day.isoformat(), today.isoformat()))
+        rolled = {
+            row[0]: {'orders': row[1], 'paid_orders': row[2],
+                     'revenue_usdt': row[3], 'revenue_cny': row[4]}
+            for row in cursor.fetchall()
         }
+        
+        result = []
+        missing = []
+        for offset in range(days):
+            day = first_day + timedelta(days=offset)
+            key = day.isoformat()
+            if day == today:
+                stats = self._aggregate_range(cursor, *self._day_range(day))
+            elif key in rolled:
+                stats = rolled[key]
+            else:
+                stats = self._aggregate_range(cursor, *self._day_range(day))
+                missing.append((key, stats))
+            result.append(dict(stats, day=key))
+        conn.close()
+        
+        if missing:
+            self._save_rollups(missing)
+        return result
+    
+    def get_hourly_stats(self, day: Optional[date] = None) -> List[Dict[str, Any]]:
+        """某个业务日（默认今天）按小时的订单统计，共 24 项"""
+        day = day or self.business_today()
+        buckets = [{'hour': hour, 'orders': 0, 'paid_orders': 0} for hour in range(24)]
+        
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT created_at, status FROM orders
+            WHERE created_at >= ? AND created_at < ?
+        """, self._day_range(day))
+        for created_at, status in cursor:
+            bucket = buckets[self._to_business_time(created_at).hour]
+            bucket['orders'] += 1
+            if status == 'paid':
+                bucket['paid_orders'] += 1
+        conn.close()
+        return buckets
+    
+    def rollup_daily_stats(self, refresh_days: int = 2) -> int:
+        """
+        重新计算最近几个已结束日期的汇总
+        
+        订单在创建之后仍可能被支付/审核（闲鱼订单最长 24 小时），
+        所以最近几天的汇总需要定期刷新；更早的日期不再变化。
+        
+        Returns:
+            刷新的天数
+        """
+        today = self.business_today()
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        rollups = []
+        for offset in range(1, refresh_days + 1):
+            day = today - timedelta(days=offset)
+            rollups.append((day.isoformat(), self._aggregate_range(cursor, *self._day_range(day))))
+        conn.close()
+        
+        self._save_rollups(rollups)
+        return len(rollups)
+    
+    def _save_rollups(self, rollups: List[Tuple[str, Dict[str, Any]]]):
+        rows = [
+            (self.stats_timezone, day, stats['orders'], stats['paid_orders'],
+             stats['revenue_usdt'], stats['revenue_cny'], datetime.now())
+            for day, stats in rollups
+        ]
+        self.writer.execute(lambda cursor: cursor.executemany("""
+            INSERT INTO stats_daily_rollup 
+            (tz, day, orders, paid_orders, revenue_usdt, revenue_cny, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(tz, day) DO UPDATE SET
+                orders=excluded.orders,
+                paid_orders=excluded.paid_orders,
+                revenue_usdt=excluded.revenue_usdt,
+                revenue_cny=excluded.revenue_cny,
+                updated_at=excluded.updated_at
+        """, rows))
     
     # ========== 日志 ==========
     
     def add_log(self, log_type: str, user_id: Optional[int], order_id: Optional[str], message: str):
         """添加系统日志"""
-        with self.lock:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute("""
-                INSERT INTO system_logs (log_type, user_id, order_id, message)
-                VALUES (?, ?, ?, ?)
-            """, (log_type, user_id, order_id, message))
-            conn.commit()
-            conn.close()
+        self.writer.execute(lambda cursor: cursor.execute("""
+            INSERT INTO system_logs (log_type, user_id, order_id, message)
+            VALUES (?, ?, ?, ?)
+        """, (log_type, user_id, order_id, message)))
+    
+    # ========== 任务检查点 ==========
+    
+    def get_checkpoint(self, name: str) -> Optional[str]:
+        """获取后台任务检查点"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT value FROM job_checkpoints WHERE name=?", (name,))
+        row = cursor.fetchone()
+        conn.close()
+        return row[0] if row else None
+    
+    def set_checkpoint(self, name: str, value: str):
+        """保存后台任务检查点"""
+        self.writer.execute(lambda cursor: cursor.execute("""
+            INSERT INTO job_checkpoints (name, value, updated_at) VALUES (?, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET value=excluded.value, updated_at=excluded.updated_at
+        """, (name, value, datetime.now())))
     
     # ========== 广告模板操作 ==========
     
     def create_promo_template(self, name: str, message: str, button_text: str = None, 
                              button_url: str = None, created_by: int = None, image_file_id: str = None) -> int:
         """创建广告模板"""
-        with self.lock:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute("""
-                INSERT INTO promo_templates (name, message, image_file_id, button_text, button_url, created_by)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """, (name, message, image_file_id, button_text, button_url, created_by))
-            template_id = cursor.lastrowid
-            conn.commit()
-            conn.close()
-            return template_id
+        return self.writer.execute(lambda cursor: cursor.execute("""
+            INSERT INTO promo_templates (name, message, image_file_id, button_text, button_url, created_by)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (name, message, image_file_id, button_text, button_url, created_by)).lastrowid)
     
-    def get_promo_template(self, template_id: int) -> Optional[Dict[str, Any]]:
-        """获取广告模板"""
+    def get_promo_template(self, template_id: int) -> Optional[PromoTemplate]:
+        """获取广告模板（缓存，返回的记录不要修改）"""
+        template = self._template_cache.get(template_id)
+        if template is not None:
+            return template
+        
+        version = self.promo_template_version(template_id)
         conn = self.get_connection()
         cursor = conn.cursor()
         cursor.execute("SELECT * FROM promo_templates WHERE id=?", (template_id,))
-        row = cursor.fetchone()
+        template = fetch_one(cursor, PromoTemplate)
         conn.close()
-        
-        if row:
-            columns = [desc[0] for desc in cursor.description]
-            return dict(zip(columns, row))
-        return None
+        # 读取期间模板被修改时不缓存旧数据
+        if template is not None and self.promo_template_version(template_id) == version:
+            self._template_cache[template_id] = template
+        return template
+    
+    def promo_template_version(self, template_id: int) -> int:
+        """模板版本号，每次修改/删除递增（调用方据此作废由模板构建的缓存）"""
+        return self._template_versions.get(template_id, 0)
+    
+    def _invalidate_promo_template(self, template_id: int):
+        self._template_versions[template_id] = self.promo_template_version(template_id) + 1
+        self._template_cache.pop(template_id, None)
     
-    def get_all_promo_templates(self, active_only: bool = True) -> List[Dict[str, Any]]:
+    def get_all_promo_templates(self, active_only: bool = True) -> List[PromoTemplate]:
         """获取所有广告模板"""
         conn = self.get_connection()
         cursor = conn.cursor()
@@ -691,106 +1662,115 @@ class Database:
         else:
             cursor.execute("SELECT * FROM promo_templates ORDER BY created_at DESC")
         
-        rows = cursor.fetchall()
+        templates = fetch_all(cursor, PromoTemplate)
         conn.close()
-        
-        columns = [desc[0] for desc in cursor.description]
-        return [dict(zip(columns, row)) for row in rows]
+        return templates
     
     def update_promo_template(self, template_id: int, name: str = None, message: str = None,
                              button_text: str = None, button_url: str = None, image_file_id: str = None):
         """更新广告模板"""
-        with self.lock:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            
-            updates = []
-            params = []
-            
-            if name is not None:
-                updates.append("name=?")
-                params.append(name)
-            if message is not None:
-                updates.append("message=?")
-                params.append(message)
-            if image_file_id is not None:
-                updates.append("image_file_id=?")
-                params.append(image_file_id)
-            if button_text is not None:
-                updates.append("button_text=?")
-                params.append(button_text)
-            if button_url is not None:
-                updates.append("button_url=?")
-                params.append(button_url)
-            
-            if updates:
-                updates.append("updated_at=?")
-                params.append(datetime.now())
-                params.append(template_id)
-                
-                cursor.execute(f"""
-                    UPDATE promo_templates SET {', '.join(updates)}
-                    WHERE id=?
-                """, params)
-                conn.commit()
+        updates = []
+        params = []
+        
+        if name is not None:
+            updates.append("name=?")
+            params.append(name)
+        if message is not None:
+            updates.append("message=?")
+            params.append(message)
+        if image_file_id is not None:
+            updates.append("image_file_id=?")
+            params.append(image_file_id)
+        if button_text is not None:
+            updates.append("button_text=?")
+            params.append(button_text)
+        if button_url is not None:
+            updates.append("button_url=?")
+            params.append(button_url)
+        
+        if updates:
+            updates.append("updated_at=?")
+            params.append(datetime.now())
+            params.append(template_id)
             
-            conn.close()
+            self.writer.execute(lambda cursor: cursor.execute(f"""
+                UPDATE promo_templates SET {', '.join(updates)}
+                WHERE id=?
+            """, params))
+            self._invalidate_promo_template(template_id)
     
     def delete_promo_template(self, template_id: int):
         """删除广告模板（软删除）"""
-        with self.lock:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute("UPDATE promo_templates SET is_active=0 WHERE id=?", (template_id,))
-            conn.commit()
-            conn.close()
+        self.writer.execute(
+            lambda cursor: cursor.execute("UPDATE promo_templates SET is_active=0 WHERE id=?", (template_id,))
+        )
+        self._invalidate_promo_template(template_id)
     
     # ========== 定时任务操作 ==========
     
     def create_scheduled_task(self, template_id: int, target_chats: str, 
                              scheduled_time: datetime, created_by: int) -> int:
         """创建定时任务"""
-        with self.lock:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute("""
-                INSERT INTO scheduled_tasks (template_id, target_chats, scheduled_time, created_by)
-                VALUES (?, ?, ?, ?)
-            """, (template_id, target_chats, scheduled_time, created_by))
-            task_id = cursor.lastrowid
-            conn.commit()
-            conn.close()
-            return task_id
+        return self.writer.execute(lambda cursor: cursor.execute("""
+            INSERT INTO scheduled_tasks (template_id, target_chats, scheduled_time, created_by)
+            VALUES (?, ?, ?, ?)
+        """, (template_id, target_chats, scheduled_time, created_by)).lastrowid)
     
-    def get_scheduled_task(self, task_id: int) -> Optional[Dict[str, Any]]:
+    def get_scheduled_task(self, task_id: int) -> Optional[ScheduledTask]:
         """获取定时任务"""
         conn = self.get_connection()
         cursor = conn.cursor()
         cursor.execute("SELECT * FROM scheduled_tasks WHERE id=?", (task_id,))
-        row = cursor.fetchone()
+        task = fetch_one(cursor, ScheduledTask)
         conn.close()
+        return task
+    
+    def claim_due_tasks(self, owner: str, lease: timedelta, limit: int = None) -> List[ScheduledTask]:
+        """
+        认领到期的定时任务（pending -> executing）
         
-        if row:
-            columns = [desc[0] for desc in cursor.description]
-            return dict(zip(columns, row))
-        return None
+        用一条条件 UPDATE 完成认领，多个 Bot 进程同时认领也不会拿到同一个任务。
+        状态为 executing 但超过 lease 没有续约的任务（执行它的进程已退出）会被重新认领，
+        由调用方跳过已发送成功的目标后继续执行。
+        
+        Args:
+            owner: 认领者标识（主机名:进程号）
+            lease: 认领的有效期，每发送完一个目标续约一次
+            limit: 最多认领的任务数
+        """
+        now = datetime.now()
+        
+        def claim(cursor):
+            cursor.execute("""
+                UPDATE scheduled_tasks
+                SET status='executing', claimed_by=?, claimed_at=?
+                WHERE id IN (
+                    SELECT id FROM scheduled_tasks
+                    WHERE (status='pending' AND scheduled_time <= ?)
+                       OR (status='executing' AND (claimed_at IS NULL OR claimed_at < ?))
+                    ORDER BY scheduled_time ASC
+                    LIMIT ?
+                )
+                RETURNING *
+            """, (owner, now, now, now - lease, -1 if limit is None else limit))
+            return fetch_all(cursor, ScheduledTask)
+        
+        tasks = self.writer.execute(claim)
+        return sorted(tasks, key=lambda task: task['scheduled_time'])
     
-    def get_pending_tasks(self) -> List[Dict[str, Any]]:
-        """获取待执行的任务"""
+    def get_task_delivered_targets(self, task_id: int) -> set:
+        """任务中已发送成功的目标（发送记录即进度检查点）"""
         conn = self.get_connection()
         cursor = conn.cursor()
-        cursor.execute("""
-            SELECT * FROM scheduled_tasks 
-            WHERE status='pending' AND scheduled_time <= ?
-            ORDER BY scheduled_time ASC
-        """, (datetime.now(),))
-        rows = cursor.fetchall()
+        cursor.execute(
+            "SELECT target_chat FROM promo_logs WHERE task_id=? AND status='success'",
+            (task_id,)
+        )
+        targets = {row[0] for row in cursor.fetchall()}
         conn.close()
-        
-        columns = [desc[0] for desc in cursor.description]
-        return [dict(zip(columns, row)) for row in rows]
+        return targets
     
-    def get_all_scheduled_tasks(self, status: str = None) -> List[Dict[str, Any]]:
+    def get_all_scheduled_tasks(self, status: str = None) -> List[ScheduledTask]:
         """获取所有定时任务"""
         conn = self.get_connection()
         cursor = conn.cursor()
@@ -800,52 +1780,182 @@ class Database:
         else:
             cursor.execute("SELECT * FROM scheduled_tasks ORDER BY scheduled_time DESC")
         
-        rows = cursor.fetchall()
+        tasks = fetch_all(cursor, ScheduledTask)
         conn.close()
-        
-        columns = [desc[0] for desc in cursor.description]
-        return [dict(zip(columns, row)) for row in rows]
+        return tasks
     
     def update_task_status(self, task_id: int, status: str, result: str = None):
         """更新任务状态"""
-        with self.lock:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            
-            if status in ['completed', 'failed']:
-                cursor.execute("""
-                    UPDATE scheduled_tasks 
-                    SET status=?, executed_at=?, result=?
-                    WHERE id=?
-                """, (status, datetime.now(), result, task_id))
-            else:
-                cursor.execute("""
-                    UPDATE scheduled_tasks 
-                    SET status=?, result=?
-                    WHERE id=?
-                """, (status, result, task_id))
-            
-            conn.commit()
-            conn.close()
+        if status in ['completed', 'failed']:
+            self.writer.execute(lambda cursor: cursor.execute("""
+                UPDATE scheduled_tasks 
+                SET status=?, executed_at=?, result=?
+                WHERE id=?
+            """, (status, datetime.now(), result, task_id)))
+        else:
+            self.writer.execute(lambda cursor: cursor.execute("""
+                UPDATE scheduled_tasks 
+                SET status=?, result=?
+                WHERE id=?
+            """, (status, result, task_id)))
     
     def cancel_scheduled_task(self, task_id: int):
         """取消定时任务"""
         self.update_task_status(task_id, 'cancelled')
     
+    # ========== 重复发送规则 ==========
+    
+    def create_promo_schedule(self, template_id: int, target_chats: str, rule: str,
+                              created_by: int) -> Tuple[int, datetime]:
+        """
+        创建重复发送规则
+        
+        Returns:
+            (规则ID, 第一次触发时间)
+        
+        Raises:
+            ValueError: 规则无法解析
+        """
+        parsed = parse_rule(rule)
+        next_run = parsed.next_after(datetime.now())
+        schedule_id = self.writer.execute(lambda cursor: cursor.execute("""
+            INSERT INTO promo_schedules (template_id, target_chats, rule, next_run, created_by)
+            VALUES (?, ?, ?, ?, ?)
+        """, (template_id, target_chats, parsed.text, next_run, created_by)).lastrowid)
+        return schedule_id, next_run
+    
+    def get_active_promo_schedules(self) -> List[PromoSchedule]:
+        """获取启用中的重复发送规则（按下次触发时间）"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM promo_schedules WHERE is_active=1 ORDER BY next_run ASC")
+        schedules = fetch_all(cursor, PromoSchedule)
+        conn.close()
+        return schedules
+    
+    def deactivate_promo_schedule(self, schedule_id: int):
+        """停用重复发送规则（已生成的任务不受影响）"""
+        self.writer.execute(lambda cursor: cursor.execute(
+            "UPDATE promo_schedules SET is_active=0, next_run=NULL WHERE id=?", (schedule_id,)
+        ))
+    
+    def materialize_due_schedules(self, now: datetime = None) -> List[Tuple[int, Optional[datetime]]]:
+        """
+        为到期的重复规则各生成一条一次性定时任务，并推进到下一次触发时间
+        
+        在同一个写事务里完成，多个 Bot 进程同时调用也只会生成一次。
+        Bot 停机期间错过的多次触发只补发一次。
+        
+        Returns:
+            [(规则ID, 下一次触发时间), ...]，规则失效时下一次触发时间为 None
+        """
+        now = now or datetime.now()
+        
+        def materialize(cursor):
+            cursor.execute("""
+                SELECT * FROM promo_schedules
+                WHERE is_active=1 AND next_run <= ?
+                ORDER BY next_run ASC
+            """, (now,))
+            advanced = []
+            for schedule in fetch_all(cursor, PromoSchedule):
+                cursor.execute("""
+                    INSERT INTO scheduled_tasks (template_id, target_chats, scheduled_time, created_by, schedule_id)
+                    VALUES (?, ?, ?, ?, ?)
+                """, (schedule['template_id'], schedule['target_chats'], schedule['next_run'],
+                      schedule['created_by'], schedule['id']))
+                try:
+                    next_run = parse_rule(schedule['rule']).next_after(now)
+                except ValueError as e:
+                    logger.error(f"Promo schedule {schedule['id']} disabled: {e}")
+                    next_run = None
+                cursor.execute("""
+                    UPDATE promo_schedules
+                    SET next_run=?, last_run=?, is_active=?
+                    WHERE id=?
+                """, (next_run, schedule['next_run'], 1 if next_run else 0, schedule['id']))
+                advanced.append((schedule['id'], next_run))
+            return advanced
+        
+        return self.writer.execute(materialize)
+    
+    # ========== 图片 file_id 缓存 ==========
+    
+    def get_media_file_ids(self) -> Dict[str, str]:
+        """全部已缓存的 来源 -> file_id"""
+        conn = self.get_connection()
+        rows = conn.execute("SELECT source, file_id FROM media_cache").fetchall()
+        conn.close()
+        return dict(rows)
+    
+    def save_media_file_id(self, source: str, file_id: str):
+        """记录（或更新）图片来源对应的 file_id"""
+        self.writer.execute(lambda cursor: cursor.execute("""
+            INSERT INTO media_cache (source, file_id, updated_at) VALUES (?, ?, ?)
+            ON CONFLICT(source) DO UPDATE SET file_id=excluded.file_id, updated_at=excluded.updated_at
+        """, (source, file_id, datetime.now())))
+    
+    def delete_media_file_id(self, source: str):
+        """删除失效的 file_id"""
+        self.writer.execute(lambda cursor: cursor.execute(
+            "DELETE FROM media_cache WHERE source=?", (source,)
+        ))
+    
+    # ========== 对话状态 ==========
+    
+    def get_conversation_states(self, limit: int) -> List[Tuple[int, str, float]]:
+        """最近修改的 limit 个对话状态 (user_id, 状态 JSON, 修改时间)，按修改时间从新到旧"""
+        conn = self.get_connection()
+        rows = conn.execute(
+            "SELECT user_id, state, updated_at FROM conversation_states "
+            "ORDER BY updated_at DESC LIMIT ?", (limit,)
+        ).fetchall()
+        conn.close()
+        return [tuple(row) for row in rows]
+    
+    def save_conversation_state(self, user_id: int, state_json: str, updated_at: float) -> Future:
+        """保存对话状态（不等待提交）"""
+        return self.writer.submit(lambda cursor: cursor.execute("""
+            INSERT INTO conversation_states (user_id, state, updated_at) VALUES (?, ?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET state=excluded.state, updated_at=excluded.updated_at
+        """, (user_id, state_json, updated_at)))
+    
+    def delete_conversation_state(self, user_id: int) -> Future:
+        """删除对话状态（不等待提交）"""
+        return self.writer.submit(lambda cursor: cursor.execute(
+            "DELETE FROM conversation_states WHERE user_id=?", (user_id,)
+        ))
+    
+    def delete_conversation_states_before(self, cutoff: float) -> int:
+        """删除 cutoff（Unix 时间戳）之前修改的对话状态，返回删除数"""
+        return self.writer.execute(lambda cursor: cursor.execute(
+            "DELETE FROM conversation_states WHERE updated_at < ?", (cutoff,)
+        ).rowcount)
+    
     # ========== 广告发送记录 ==========
     
     def add_promo_log(self, template_id: int, target_chat: str, status: str,
                      task_id: int = None, message_id: int = None, error_message: str = None):
-        """添加广告发送记录"""
-        with self.lock:
-            conn = self.get_connection()
-            cursor = conn.cursor()
+        """添加广告发送记录（属于定时任务时同时为任务的认领续约）"""
+        self.submit_promo_log(template_id, target_chat, status, task_id,
+                              message_id, error_message).result()
+    
+    def submit_promo_log(self, template_id: int, target_chat: str, status: str,
+                         task_id: int = None, message_id: int = None,
+                         error_message: str = None) -> Future:
+        """同 add_promo_log，但不等待提交（群发时逐个目标记录，由写队列合并提交）"""
+        def write(cursor):
             cursor.execute("""
                 INSERT INTO promo_logs (task_id, template_id, target_chat, status, message_id, error_message)
                 VALUES (?, ?, ?, ?, ?, ?)
             """, (task_id, template_id, target_chat, status, message_id, error_message))
-            conn.commit()
-            conn.close()
+            if task_id is not None:
+                cursor.execute(
+                    "UPDATE scheduled_tasks SET claimed_at=? WHERE id=? AND status='executing'",
+                    (datetime.now(), task_id)
+                )
+        
+        return self.writer.submit(write)
     
     def get_promo_logs(self, limit: int = 50) -> List[Dict[str, Any]]:
         """获取广告发送记录"""
@@ -858,10 +1968,8 @@ class Database:
             ORDER BY pl.sent_at DESC
             LIMIT ?
         """, (limit,))
-        rows = cursor.fetchall()
+        logs = [row_to_dict(cursor, row) for row in cursor.fetchall()]
         conn.close()
-        
-        columns = [desc[0] for desc in cursor.description]
-        return [dict(zip(columns, row)) for row in rows]
+        return logs
 
 
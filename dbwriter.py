@@ -0,0 +1,239 @@
+"""
+SQLite 写入队列
+
+SQLite 同一时刻只允许一个写事务，这里用一个专门的写线程持有唯一的写连接，
+所有写操作排队交给它执行；队列中积压的多个写操作合并到同一个事务里提交（组提交），
+一次 fsync 覆盖一批写入。读操作使用各自独立的连接，在 WAL 模式下不会被写入阻塞。
+"""
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class _WriteJob:
+    __slots__ = ('fn', 'future', 'enqueued_at')
+
+    def __init__(self, fn: Callable[[sqlite3.Cursor], Any]):
+        self.fn = fn
+        self.future: Future = Future()
+        self.enqueued_at = time.monotonic()
+
+
+class WriteQueue:
+    """单写连接 + 队列 + 组提交"""
+
+    def __init__(self, db_path: str, max_batch: int = 64, busy_timeout: float = 30):
+        """
+        Args:
+            db_path: 数据库文件路径
+            max_batch: 每个事务最多合并的写操作数
+            busy_timeout: 等待其他进程（如 manage.py）释放写锁的秒数
+        """
+        self.db_path = db_path
+        self.max_batch = max_batch
+        self.busy_timeout = busy_timeout
+        self._queue: "queue.Queue[Optional[_WriteJob]]" = queue.Queue()
+        # 关闭后不再接受写操作；与入队放在同一把锁下，保证停止标记之后没有写操作排队
+        self._closed = False
+        self._submit_lock = threading.Lock()
+        self._cursor: Optional[sqlite3.Cursor] = None
+        self._metrics_lock = threading.Lock()
+        self._metrics = {
+            'writes': 0,
+            'failed_writes': 0,
+            'transactions': 0,
+            'wait_total': 0.0,
+            'wait_max': 0.0,
+            'commit_total': 0.0,
+            'max_batch_seen': 0,
+        }
+        # 在调用方线程中打开写连接，打不开时直接在这里报错，而不是让写线程静默退出
+        self._conn = self._connect()
+        self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+        self._thread.start()
+
+    # ========== 对外接口 ==========
+
+    def execute(self, fn: Callable[[sqlite3.Cursor], Any]) -> Any:
+        """
+        在写事务中执行 fn(cursor) 并等待其结果
+
+        fn 不需要（也不能）自己提交或回滚；fn 抛出的异常只回滚它自己的修改，
+        并原样抛给调用方，不影响同一批里的其他写操作。写入队列已关闭时抛出 RuntimeError。
+        """
+        if threading.current_thread() is self._thread:
+            # 写操作内部再次发起写操作：直接在当前事务中执行
+            return fn(self._cursor)
+        return self.submit(fn).result()
+
+    def submit(self, fn: Callable[[sqlite3.Cursor], Any]) -> Future:
+        """
+        提交写操作，不等待结果
+
+        Raises:
+            RuntimeError: 写入队列已关闭
+        """
+        job = _WriteJob(fn)
+        with self._submit_lock:
+            if self._closed:
+                raise RuntimeError("Write queue is closed")
+            self._queue.put(job)
+        return job.future
+
+    def close(self):
+        """处理完队列中的写操作后停止写线程（可重复调用）"""
+        with self._submit_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+        self._thread.join()
+
+    def metrics(self) -> Dict[str, Any]:
+        """写入争用指标（排队等待时间、组提交批大小、提交耗时）"""
+        with self._metrics_lock:
+            m = dict(self._metrics)
+        writes = m['writes'] or 1
+        transactions = m['transactions'] or 1
+        return {
+            'writes': m['writes'],
+            'failed_writes': m['failed_writes'],
+            'transactions': m['transactions'],
+            'queue_depth': self._queue.qsize(),
+            'avg_wait_ms': m['wait_total'] / writes * 1000,
+            'max_wait_ms': m['wait_max'] * 1000,
+            'avg_commit_ms': m['commit_total'] / transactions * 1000,
+            'avg_batch': m['writes'] / transactions,
+            'max_batch': m['max_batch_seen'],
+        }
+
+    # ========== 写线程 ==========
+
+    def _connect(self) -> sqlite3.Connection:
+        # 连接只在写线程中使用；WAL 模式由 MigrationRunner 在启动时设置
+        return sqlite3.connect(self.db_path, isolation_level=None, timeout=self.busy_timeout,
+                               check_same_thread=False)
+
+    def _run(self):
+        conn = self._conn
+        self._cursor = conn.cursor()
+        try:
+            while True:
+                job = self._queue.get()
+                if job is None:
+                    return
+                batch = [job]
+                stop = False
+                while len(batch) < self.max_batch:
+                    try:
+                        job = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if job is None:
+                        stop = True
+                        break
+                    batch.append(job)
+                try:
+                    self._run_batch(conn, batch)
+                except Exception as e:
+                    # 写线程不能退出，否则之后所有写操作都会一直等待
+                    logger.error(f"Write batch failed unexpectedly: {e}", exc_info=True)
+                    self._abort_batch(conn, batch, e)
+                if stop:
+                    return
+        finally:
+            conn.close()
+
+    def _run_batch(self, conn: sqlite3.Connection, batch: list):
+        cursor = self._cursor
+        started = time.monotonic()
+        results = []
+
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+        except sqlite3.Error as e:
+            for job in batch:
+                job.future.set_exception(e)
+            return
+
+        # 整个事务已被 SQLite 回滚（磁盘满、IO 错误、中断）或被写操作自己结束时的错误
+        aborted: Optional[BaseException] = None
+        for job in batch:
+            try:
+                cursor.execute("SAVEPOINT write_job")
+            except sqlite3.Error as e:
+                aborted = e
+                break
+
+            error = None
+            try:
+                result = job.fn(cursor)
+            except BaseException as e:
+                result, error = None, e
+
+            if not conn.in_transaction:
+                aborted = error or sqlite3.OperationalError("Write transaction ended inside a write job")
+                break
+            try:
+                if error is not None:
+                    cursor.execute("ROLLBACK TO write_job")
+                cursor.execute("RELEASE write_job")
+            except sqlite3.Error as e:
+                aborted = e
+                break
+            results.append((job, result, error))
+
+        commit_started = time.monotonic()
+        if aborted is not None:
+            # 同一事务里的写入都已无效，整批失败
+            logger.error(f"Write transaction of {len(batch)} write(s) aborted: {aborted}")
+            self._rollback(conn)
+            results = [(job, None, aborted) for job in batch]
+        else:
+            try:
+                cursor.execute("COMMIT")
+            except sqlite3.Error as e:
+                logger.error(f"Group commit of {len(batch)} write(s) failed: {e}")
+                self._rollback(conn)
+                results = [(job, None, e) for job, _, _ in results]
+        commit_time = time.monotonic() - commit_started
+
+        with self._metrics_lock:
+            m = self._metrics
+            m['transactions'] += 1
+            m['commit_total'] += commit_time
+            m['max_batch_seen'] = max(m['max_batch_seen'], len(batch))
+            for job, _, error in results:
+                wait = started - job.enqueued_at
+                m['writes'] += 1
+                m['wait_total'] += wait
+                m['wait_max'] = max(m['wait_max'], wait)
+                if error is not None:
+                    m['failed_writes'] += 1
+
+        for job, result, error in results:
+            if error is not None:
+                job.future.set_exception(error)
+            else:
+                job.future.set_result(result)
+
+    @staticmethod
+    def _rollback(conn: sqlite3.Connection):
+        if conn.in_transaction:
+            try:
+                conn.execute("ROLLBACK")
+            except sqlite3.Error:
+                pass
+
+    def _abort_batch(self, conn: sqlite3.Connection, batch: list, error: BaseException):
+        """意外异常后回滚并让这一批中尚未完成的写操作失败"""
+        self._rollback(conn)
+        for job in batch:
+            if not job.future.done():
+                job.future.set_exception(error)
@@ -0,0 +1,208 @@
+"""
+流式订单导出
+
+按 rowid 分批读取（每批一条短查询，不会长时间占用读锁），边读边写，
+内存占用只与批大小有关。支持格式：
+- json：JSON 数组（默认，与原来的导出文件相同）
+- jsonl：每行一个 JSON 对象
+- csv：带表头的 CSV
+- columnar：按列存储的压缩格式（gzip，每批一个行组：{"columns": [...], "count": N, "data": [[列值...], ...]}）
+
+增量导出：每批写完后把最后的 rowid 记录到水位文件，下次只导出之后新增的订单，
+中途中断也能从上次的位置继续。注意增量导出只包含新增的订单：已导出订单之后的状态变化
+（如 pending -> paid/expired）不会再次导出（orders 没有更新时间字段），需要最新状态时请全量导出。
+"""
+import csv
+import gzip
+import json
+import logging
+import os
+import sqlite3
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = ('json', 'jsonl', 'csv', 'columnar')
+
+FORMAT_EXTENSIONS = {
+    'json': '.json',
+    'jsonl': '.jsonl',
+    'csv': '.csv',
+    'columnar': '.cols.gz',
+}
+
+
+def _json_value(value: Any) -> Any:
+    return str(value) if isinstance(value, (datetime, bytes)) else value
+
+
+def iter_chunks(connect: Callable[[], sqlite3.Connection], table: str,
+                conditions: List[str], params: List[Any], after_rowid: int = 0,
+                chunk_size: int = 1000) -> Iterator[Tuple[List[str], List[tuple], int]]:
+    """
+    按 rowid 顺序分批读取
+
+    Yields:
+        (列名, 本批行, 本批最后的 rowid)
+    """
+    where = ''.join(f" AND {condition}" for condition in conditions)
+    query = f"SELECT rowid, * FROM {table} WHERE rowid > ?{where} ORDER BY rowid LIMIT ?"
+
+    last_rowid = after_rowid
+    while True:
+        conn = connect()
+        try:
+            cursor = conn.execute(query, [last_rowid] + list(params) + [chunk_size])
+            rows = cursor.fetchall()
+            columns = [desc[0] for desc in cursor.description][1:]
+        finally:
+            conn.close()
+        if not rows:
+            return
+        last_rowid = rows[-1][0]
+        yield columns, [row[1:] for row in rows], last_rowid
+        if len(rows) < chunk_size:
+            return
+
+
+class _JsonArrayWriter:
+    def __init__(self, path: str):
+        self.file = open(path, 'w', encoding='utf-8')
+        self.file.write('[')
+        self.count = 0
+
+    def write(self, columns: List[str], rows: List[tuple]):
+        for row in rows:
+            record = {name: _json_value(value) for name, value in zip(columns, row)}
+            self.file.write(',\n' if self.count else '\n')
+            self.file.write(json.dumps(record, indent=2, ensure_ascii=False))
+            self.count += 1
+        self.file.flush()
+
+    def close(self):
+        self.file.write('\n]' if self.count else ']')
+        self.file.close()
+
+
+class _JsonlWriter:
+    def __init__(self, path: str):
+        self.file = open(path, 'w', encoding='utf-8')
+
+    def write(self, columns: List[str], rows: List[tuple]):
+        for row in rows:
+            record = {name: _json_value(value) for name, value in zip(columns, row)}
+            self.file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class _CsvWriter:
+    def __init__(self, path: str):
+        self.file = open(path, 'w', encoding='utf-8-sig', newline='')
+        self.writer = csv.writer(self.file)
+        self.header_written = False
+
+    def write(self, columns: List[str], rows: List[tuple]):
+        if not self.header_written:
+            self.writer.writerow(columns)
+            self.header_written = True
+        self.writer.writerows(rows)
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class _ColumnarWriter:
+    def __init__(self, path: str):
+        self.file = gzip.open(path, 'wt', encoding='utf-8')
+
+    def write(self, columns: List[str], rows: List[tuple]):
+        data = [[_json_value(value) for value in column] for column in zip(*rows)]
+        self.file.write(json.dumps({'columns': columns, 'count': len(rows), 'data': data},
+                                   ensure_ascii=False) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+_WRITERS = {
+    'json': _JsonArrayWriter,
+    'jsonl': _JsonlWriter,
+    'csv': _CsvWriter,
+    'columnar': _ColumnarWriter,
+}
+
+
+def read_watermark(path: str) -> int:
+    """读取增量导出水位（最后导出的 rowid），不存在时为 0"""
+    try:
+        with open(path, encoding='utf-8') as f:
+            return int(json.load(f).get('last_rowid', 0))
+    except (OSError, ValueError):
+        return 0
+
+
+def write_watermark(path: str, last_rowid: int):
+    """原子地更新增量导出水位"""
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump({'last_rowid': last_rowid, 'updated_at': datetime.now().isoformat()}, f)
+    os.replace(temp_path, path)
+
+
+def export_orders(connect: Callable[[], sqlite3.Connection], filepath: str, fmt: str = 'json',
+                  status: Optional[str] = None, start_date: Optional[datetime] = None,
+                  end_date: Optional[datetime] = None, watermark_path: Optional[str] = None,
+                  chunk_size: int = 1000) -> Dict[str, Any]:
+    """
+    流式导出 orders 表
+
+    Args:
+        connect: 返回新数据库连接的函数
+        filepath: 导出文件
+        fmt: json / jsonl / csv / columnar
+        status: 状态筛选
+        start_date / end_date: 创建时间范围（含边界）
+        watermark_path: 增量导出水位文件，为空时全量导出（增量只导出新增的订单，不含已导出订单的状态变化）
+        chunk_size: 每批行数
+
+    Returns:
+        {'count': 导出条数, 'last_rowid': 最后的 rowid, 'path': 文件}
+    """
+    if fmt not in _WRITERS:
+        raise ValueError(f"Unsupported export format: {fmt} (choose from {', '.join(EXPORT_FORMATS)})")
+
+    conditions, params = [], []
+    if status:
+        conditions.append("status=?")
+        params.append(status)
+    if start_date:
+        conditions.append("created_at >= ?")
+        params.append(start_date)
+    if end_date:
+        conditions.append("created_at <= ?")
+        params.append(end_date)
+
+    after_rowid = read_watermark(watermark_path) if watermark_path else 0
+    last_rowid = after_rowid
+    count = 0
+
+    writer = _WRITERS[fmt](filepath)
+    try:
+        for columns, rows, last_rowid in iter_chunks(connect, 'orders', conditions, params,
+                                                     after_rowid, chunk_size):
+            writer.write(columns, rows)
+            count += len(rows)
+            if watermark_path:
+                # 本批已落盘后再推进水位，中断后从这里继续
+                write_watermark(watermark_path, last_rowid)
+    finally:
+        writer.close()
+
+    logger.info(f"Exported {count} orders to {filepath} ({fmt})")
+    return {'count': count, 'last_rowid': last_rowid, 'path': filepath}
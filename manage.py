@@ -4,12 +4,20 @@
 """
 import sys
 import os
+import time
 from datetime import datetime, timedelta
-import shutil
 from database import Database
-from config import DATABASE_PATH, MEMBERSHIP_PLANS
+from config import (
+    DATABASE_PATH, MEMBERSHIP_PLANS, STATS_TIMEZONE,
+    ARCHIVE_DIR, LOG_RETENTION_DAYS, ARCHIVE_COMPRESS,
+    BACKUP_DIR, BACKUP_KEEP, BACKUP_COMPRESS
+)
+from archive import LogArchiver, ARCHIVE_TABLES
+import backup
+import exporter
 
-db = Database(DATABASE_PATH)
+db = Database(DATABASE_PATH, STATS_TIMEZONE)
+archiver = LogArchiver(db, ARCHIVE_DIR, compress=ARCHIVE_COMPRESS)
 
 
 def show_statistics():
@@ -35,6 +43,11 @@ def show_statistics():
     print(f"\n📅 今日数据:")
     print(f"  新订单: {stats['today_orders']}")
     print(f"  已支付: {stats['today_paid']}")
+    
+    print(f"\n📈 最近 7 天:")
+    for day in db.get_daily_stats(7):
+        print(f"  {day['day']}  新订单 {day['orders']:<5} 已支付 {day['paid_orders']:<5} "
+              f"USDT {day['revenue_usdt']:.2f}  ¥{day['revenue_cny']:.2f}")
     print("="*50 + "\n")
 
 
@@ -124,47 +137,76 @@ def check_expired():
 
 
 def backup_database():
-    """备份数据库"""
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    backup_dir = 'backups'
-    
-    if not os.path.exists(backup_dir):
-        os.makedirs(backup_dir)
-    
-    # 备份主数据库
-    if os.path.exists(DATABASE_PATH):
-        backup_path = os.path.join(backup_dir, f'payment_bot_backup_{timestamp}.db')
-        shutil.copy2(DATABASE_PATH, backup_path)
-        print(f"✅ 主数据库已备份: {backup_path}")
+    """在线备份数据库（Bot 运行中也可安全执行）"""
+    databases = [('payment_bot', DATABASE_PATH), ('tron_orders', 'tron_orders.db')]
     
-    # 备份 TRON 订单数据库
-    tron_db_path = 'tron_orders.db'
-    if os.path.exists(tron_db_path):
-        backup_path = os.path.join(backup_dir, f'tron_orders_backup_{timestamp}.db')
-        shutil.copy2(tron_db_path, backup_path)
-        print(f"✅ TRON 数据库已备份: {backup_path}")
+    for name, path in databases:
+        if not os.path.exists(path):
+            continue
+        try:
+            result = backup.backup_database(path, BACKUP_DIR, name, compress=BACKUP_COMPRESS, keep=BACKUP_KEEP)
+        except Exception as e:
+            print(f"❌ {path} 备份失败: {e}")
+            continue
+        
+        if result['status'] == 'unchanged':
+            print(f"✅ {path} 自上次备份后没有变化: {result['path']}")
+        else:
+            print(f"✅ {path} 已备份: {result['path']}")
+            print(f"   SHA-256: {result['checksum']}")
+        for removed in result['removed']:
+            print(f"   🗑️ 已删除过期备份: {removed}")
     
-    print(f"\n📁 备份目录: {os.path.abspath(backup_dir)}\n")
+    print(f"\n📁 备份目录: {os.path.abspath(BACKUP_DIR)}\n")
+
+
+def verify_backups():
+    """校验备份文件"""
+    print("\n🔍 校验备份...")
+    for name in ('payment_bot', 'tron_orders'):
+        for path in backup.list_backups(BACKUP_DIR, name):
+            status = "✅" if backup.verify_backup(path) else "❌"
+            print(f"{status} {path}")
+    print()
 
 
-def export_orders():
-    """导出订单到 JSON"""
+def export_orders(fmt='json', status=None, start_date=None, end_date=None, incremental=False):
+    """
+    流式导出订单（不限条数）
+    
+    Args:
+        fmt: json / jsonl / csv / columnar
+        status: 状态筛选
+        start_date / end_date: 创建日期范围（YYYY-MM-DD）
+        incremental: 只导出上次增量导出之后新增的订单（已导出订单的状态变化不会再次导出）
+    """
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
     export_dir = 'exports'
     
     if not os.path.exists(export_dir):
         os.makedirs(export_dir)
     
-    filepath = os.path.join(export_dir, f'orders_export_{timestamp}.json')
+    if fmt not in exporter.EXPORT_FORMATS:
+        print(f"❌ 不支持的格式: {fmt}（可选: {', '.join(exporter.EXPORT_FORMATS)}）")
+        return
+    
+    filepath = os.path.join(export_dir, f'orders_export_{timestamp}{exporter.FORMAT_EXTENSIONS[fmt]}')
+    watermark_path = os.path.join(export_dir, 'orders.watermark') if incremental else None
     
-    orders = db.get_all_orders(limit=10000)
+    start = datetime.strptime(start_date, '%Y-%m-%d') if start_date else None
+    # 结束日期包含当天
+    end = datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1, microseconds=-1) if end_date else None
     
-    import json
-    with open(filepath, 'w', encoding='utf-8') as f:
-        json.dump(orders, f, indent=2, ensure_ascii=False, default=str)
+    result = exporter.export_orders(
+        db.get_connection, filepath, fmt,
+        status=status, start_date=start, end_date=end, watermark_path=watermark_path
+    )
     
     print(f"✅ 订单已导出: {filepath}")
-    print(f"   共 {len(orders)} 条记录\n")
+    print(f"   共 {result['count']} 条记录")
+    if incremental:
+        print(f"   增量水位: {result['last_rowid']}（只包含新增订单，状态变化请全量导出）")
+    print()
 
 
 def cleanup_old_data():
@@ -186,11 +228,10 @@ def cleanup_old_data():
     if count > 0:
         confirm = input(f"将删除 {count} 条旧订单记录，确认吗? (yes/no): ")
         if confirm.lower() == 'yes':
-            cursor.execute("""
+            db.writer.execute(lambda write_cursor: write_cursor.execute("""
                 DELETE FROM orders 
                 WHERE created_at < ? AND status IN ('cancelled', 'expired')
-            """, (cutoff_date,))
-            conn.commit()
+            """, (cutoff_date,)))
             print(f"✅ 已删除 {count} 条旧记录")
         else:
             print("❌ 已取消")
@@ -201,6 +242,121 @@ def cleanup_old_data():
     print()
 
 
+def rebuild_statistics():
+    """重建统计计数器（计数与实际数据不一致时使用）"""
+    db.rebuild_statistics()
+    print("\n✅ 主数据库统计计数器已重建")
+    
+    tron_db_path = 'tron_orders.db'
+    if os.path.exists(tron_db_path):
+        try:
+            from tron_payment import TronPayment
+            from config import TRON_WALLET_ADDRESS, TRONSCAN_API_KEY
+            tron = TronPayment(
+                wallet_address=TRON_WALLET_ADDRESS,
+                tronscan_api_key=TRONSCAN_API_KEY,
+                db_path=tron_db_path
+            )
+            tron.rebuild_statistics()
+            print("✅ TRON 数据库统计计数器已重建")
+        except Exception as e:
+            print(f"❌ TRON 数据库统计重建失败: {e}")
+    
+    show_statistics()
+
+
+def rebuild_search_index():
+    """重建订单/用户检索表（对数据库执行 VACUUM 后使用，订单的 rowid 可能已重新编号）"""
+    counts = db.rebuild_search_index()
+    print("\n✅ 检索表已重建")
+    for table, count in counts.items():
+        print(f"   {table}: {count} 条")
+    print()
+
+
+def archive_logs(retention_days=None):
+    """将旧日志移入月度归档库（Bot 运行中也可执行）"""
+    days = retention_days if retention_days is not None else LOG_RETENTION_DAYS
+    print(f"\n📦 归档 {days} 天前的日志...")
+    
+    moved = archiver.archive(days)
+    for table, count in moved.items():
+        print(f"  {table}: {count} 条")
+    
+    months = archiver.list_months()
+    if months:
+        print(f"\n📁 归档目录: {os.path.abspath(ARCHIVE_DIR)} （{months[0]} ~ {months[-1]}）")
+    print()
+
+
+def show_logs(table='system_logs', user_id=None, limit=20):
+    """查看日志（包含已归档的记录）"""
+    filters = {'user_id': user_id} if user_id is not None else {}
+    logs = archiver.query(table, limit=limit, **filters)
+    
+    print(f"\n📜 {table}（最近 {len(logs)} 条）")
+    print("="*50)
+    ts_column = ARCHIVE_TABLES[table]
+    for log in logs:
+        details = ', '.join(f"{k}={v}" for k, v in log.items() if k not in ('id', ts_column) and v is not None)
+        print(f"[{log[ts_column]}] {details}")
+    print()
+
+
+def show_migrations():
+    """查看数据库结构迁移进度（等待后台迁移完成）"""
+    while not db.migrations.wait(timeout=2):
+        for item in db.migrations.status():
+            if item['status'] == 'running':
+                print(f"  ⏳ {item['version']}. {item['name']}: {item['progress']}/{item['total']}")
+    
+    status_emoji = {'done': '✅', 'pending': '⏳', 'running': '⏳', 'failed': '❌'}
+    print("\n🗂️  数据库结构版本")
+    print("="*50)
+    for item in db.migrations.status():
+        kind = '后台' if item['background'] else '同步'
+        progress = f" ({item['progress']}/{item['total']})" if item['total'] else ''
+        print(f"{status_emoji.get(item['status'], '❓')} {item['version']}. {item['name']} [{kind}] "
+              f"{item['status']}{progress}")
+    print()
+
+
+def search(text, limit=20):
+    """按片段查找订单和用户"""
+    started = time.perf_counter()
+    results = db.search(text, limit=limit)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    users, orders = results['users'], results['orders']
+    
+    print("\n" + "="*80)
+    print(f"🔍 「{text}」: {len(users)} 个用户, {len(orders)} 个订单 ({elapsed_ms:.1f} ms)")
+    print("="*80)
+    
+    if users:
+        print(f"{'用户ID':<12} {'用户名':<20} {'姓名':<24} {'会员'}")
+        print("-"*80)
+        for user in users:
+            username = f"@{user['username']}" if user['username'] else 'N/A'
+            name = ' '.join(filter(None, [user['first_name'], user['last_name']]))
+            member = '是' if user['is_member'] else '否'
+            print(f"{user['user_id']:<12} {username:<20} {name:<24} {member}")
+        print()
+    
+    if orders:
+        print(f"{'订单号':<30} {'用户ID':<12} {'金额':<10} {'状态':<10} {'时间'}")
+        print("-"*80)
+        for order in orders:
+            amount = f"{order['amount']} {order['currency']}"
+            print(f"{order['order_id']:<30} {order['user_id']:<12} {amount:<10} "
+                  f"{order['status']:<10} {order['created_at'][:16]}")
+            if order['xianyu_order_number']:
+                print(f"    闲鱼订单号: {order['xianyu_order_number']}")
+            if order['tron_tx_hash']:
+                print(f"    交易哈希: {order['tron_tx_hash']}")
+    
+    print("="*80 + "\n")
+
+
 def show_menu():
     """显示菜单"""
     print("\n" + "="*50)
@@ -214,6 +370,9 @@ def show_menu():
     print("6. 备份数据库")
     print("7. 导出订单")
     print("8. 清理旧数据")
+    print("9. 重建统计计数器")
+    print("10. 归档旧日志")
+    print("11. 查找订单/用户")
     print("0. 退出")
     print("="*50)
 
@@ -237,10 +396,36 @@ def main():
             check_expired()
         elif command == 'backup':
             backup_database()
+        elif command == 'verify_backup':
+            verify_backups()
         elif command == 'export':
-            export_orders()
+            # 参数格式: format=csv status=paid from=2025-01-01 to=2025-01-31 incremental=yes
+            options = dict(arg.split('=', 1) for arg in sys.argv[2:] if '=' in arg)
+            export_orders(
+                fmt=options.get('format', 'json'),
+                status=options.get('status'),
+                start_date=options.get('from'),
+                end_date=options.get('to'),
+                incremental=options.get('incremental', '').lower() in ('1', 'yes', 'true')
+            )
         elif command == 'cleanup':
             cleanup_old_data()
+        elif command == 'rebuild_stats':
+            rebuild_statistics()
+        elif command == 'rebuild_search':
+            rebuild_search_index()
+        elif command == 'migrations':
+            show_migrations()
+        elif command == 'archive':
+            days = int(sys.argv[2]) if len(sys.argv) > 2 else None
+            archive_logs(days)
+        elif command == 'logs':
+            table = sys.argv[2] if len(sys.argv) > 2 else 'system_logs'
+            user_id = int(sys.argv[3]) if len(sys.argv) > 3 else None
+            show_logs(table, user_id)
+        elif command == 'search' and len(sys.argv) > 2:
+            limit = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+            search(sys.argv[2], limit)
         else:
             print(f"未知命令: {command}")
             print("\n可用命令:")
@@ -250,14 +435,22 @@ def main():
             print("  python manage.py members [N]    - 查看会员列表")
             print("  python manage.py expired        - 检查过期会员")
             print("  python manage.py backup         - 备份数据库")
-            print("  python manage.py export         - 导出订单")
+            print("  python manage.py verify_backup  - 校验备份文件")
+            print("  python manage.py export [format=json|jsonl|csv|columnar] [status=] [from=] [to=] [incremental=yes]")
+            print("                                  - 导出订单")
             print("  python manage.py cleanup        - 清理旧数据")
+            print("  python manage.py rebuild_stats  - 重建统计计数器")
+            print("  python manage.py rebuild_search - 重建检索表（VACUUM 之后执行）")
+            print("  python manage.py migrations     - 查看数据库结构迁移进度")
+            print("  python manage.py archive [天数]  - 归档旧日志")
+            print("  python manage.py logs [表] [用户ID] - 查看日志（含归档）")
+            print("  python manage.py search <关键字> [N] - 查找订单/用户（支持片段）")
         return
     
     # 交互式菜单
     while True:
         show_menu()
-        choice = input("\n请选择操作 (0-8): ").strip()
+        choice = input("\n请选择操作 (0-11): ").strip()
         
         if choice == '1':
             show_statistics()
@@ -283,6 +476,14 @@ def main():
             export_orders()
         elif choice == '8':
             cleanup_old_data()
+        elif choice == '9':
+            rebuild_statistics()
+        elif choice == '10':
+            archive_logs()
+        elif choice == '11':
+            text = input("关键字（订单号/用户名/闲鱼订单号/交易哈希片段）: ").strip()
+            if text:
+                search(text)
         elif choice == '0':
             print("\n👋 再见！\n")
             break
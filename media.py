@@ -0,0 +1,111 @@
+"""
+图片 file_id 缓存
+
+配置成 URL 或本地文件的图片（欢迎图片、广告图片），第一次发送后记下 Telegram 返回的 file_id，
+之后直接用 file_id 发送，Telegram 不再重新下载 URL，本地文件也不再重复上传。
+URL 按地址缓存，本地文件按内容的 SHA-256 缓存（文件内容变化后自动重新上传）；
+本身就是 file_id 的不需要缓存。缓存持久化在数据库 media_cache 表中，重启后仍然有效。
+"""
+import asyncio
+import hashlib
+import logging
+import os
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from telegram.error import BadRequest
+
+logger = logging.getLogger(__name__)
+
+
+def _is_url(source: str) -> bool:
+    return source.startswith(('http://', 'https://'))
+
+
+class MediaCache:
+    """图片来源（URL / 本地文件）-> file_id"""
+
+    def __init__(self, db):
+        self.db = db
+        self._file_ids: Dict[str, str] = db.get_media_file_ids()
+        # 本地文件路径 -> (修改时间, 大小, 缓存键)，文件没变时不重复计算哈希
+        self._file_keys: Dict[str, Tuple[float, int, str]] = {}
+        # 同一来源尚未缓存时，只让第一个发送请求上传，其余等待它的 file_id
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    def cache_key(self, source: str) -> Optional[str]:
+        """缓存键：URL 本身 / 本地文件内容的哈希；file_id 返回 None（不需要缓存）"""
+        if _is_url(source):
+            return source
+        try:
+            stat = os.stat(source)
+        except (OSError, ValueError):
+            return None
+        cached = self._file_keys.get(source)
+        if cached and cached[:2] == (stat.st_mtime, stat.st_size):
+            return cached[2]
+        digest = hashlib.sha256()
+        with open(source, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        key = f"sha256:{digest.hexdigest()}"
+        self._file_keys[source] = (stat.st_mtime, stat.st_size, key)
+        return key
+
+    def _forget(self, key: str):
+        self._file_ids.pop(key, None)
+        self.db.delete_media_file_id(key)
+
+    async def send_photo(self, source: str, send: Callable[[Any], Awaitable[Any]]) -> Any:
+        """
+        发送图片，优先使用已缓存的 file_id
+
+        Args:
+            source: URL、本地文件路径或 file_id
+            send: 以 photo 参数调用的发送函数，如 lambda photo: bot.send_photo(chat, photo, ...)
+
+        Returns:
+            send 返回的消息
+        """
+        key = self.cache_key(source)
+        if key is None:
+            return await send(source)
+
+        file_id = self._file_ids.get(key)
+        if file_id is None:
+            lock = self._locks.setdefault(key, asyncio.Lock())
+            async with lock:
+                file_id = self._file_ids.get(key)
+                if file_id is None:
+                    message = await self._upload(source, send)
+                    self._remember(key, message)
+                    self._locks.pop(key, None)
+                    return message
+
+        try:
+            return await send(file_id)
+        except BadRequest as e:
+            # file_id 失效（如 Bot token 更换）时重新上传；其他错误与缓存无关
+            if 'file' not in str(e).lower():
+                raise
+            logger.warning(f"Cached file_id for {key} rejected ({e}), uploading again")
+            self._forget(key)
+            message = await self._upload(source, send)
+            self._remember(key, message)
+            return message
+
+    @staticmethod
+    async def _upload(source: str, send: Callable[[Any], Awaitable[Any]]) -> Any:
+        if _is_url(source):
+            return await send(source)
+        with open(source, 'rb') as f:
+            return await send(f.read())
+
+    def _remember(self, key: str, message: Any):
+        photos = getattr(message, 'photo', None)
+        if not photos:
+            return
+        # 最后一个是最大尺寸
+        file_id = photos[-1].file_id
+        self._file_ids[key] = file_id
+        self.db.save_media_file_id(key, file_id)
+        logger.info(f"Cached file_id for {key}")
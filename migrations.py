@@ -0,0 +1,242 @@
+"""
+数据库结构版本迁移
+
+当前版本号保存在 PRAGMA user_version 中，已是最新版本时启动只需读取一次该值。
+每个迁移只执行一次：
+- Migration：启动时同步执行，单个事务内完成
+- BackgroundMigration：耗时操作（建索引、回填数据），在后台线程分步执行并记录进度，
+  中途退出后下次启动会继续
+
+执行记录和后台进度保存在 schema_migrations 表中。
+"""
+import logging
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 同一进程内多个 Database 实例同时启动时，串行执行同步迁移
+_sync_lock = threading.Lock()
+
+
+class Migration:
+    """同步迁移：apply(cursor) 在事务中执行，不需要自己提交"""
+
+    background = False
+
+    def __init__(self, version: int, name: str, apply: Callable[[sqlite3.Cursor], None]):
+        self.version = version
+        self.name = name
+        self.apply = apply
+
+
+class BackgroundMigration:
+    """
+    后台迁移：apply(conn) 是一个生成器，每完成一步 yield (已完成, 总数)
+
+    连接为自动提交模式，每一步应当是独立可重复执行的（如 CREATE INDEX IF NOT EXISTS、
+    按批 UPDATE ... WHERE 字段 IS NULL），这样中断后重新执行不会出错。
+    """
+
+    background = True
+
+    def __init__(self, version: int, name: str,
+                 apply: Callable[[sqlite3.Connection], Iterator[Tuple[int, int]]]):
+        self.version = version
+        self.name = name
+        self.apply = apply
+
+
+class MigrationRunner:
+    """按版本顺序执行迁移"""
+
+    def __init__(self, db_path: str, migrations: List[Any]):
+        self.db_path = db_path
+        self.migrations = sorted(migrations, key=lambda m: m.version)
+        self.latest_version = self.migrations[-1].version if self.migrations else 0
+        self._thread: Optional[threading.Thread] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        # 自动提交模式，事务由这里显式控制
+        return sqlite3.connect(self.db_path, isolation_level=None, timeout=30, check_same_thread=False)
+
+    def run(self, background: bool = True):
+        """
+        执行未完成的迁移
+
+        Args:
+            background: 后台迁移是否放到后台线程执行（False 时在当前线程执行完再返回）
+        """
+        conn = self._connect()
+        try:
+            current = conn.execute("PRAGMA user_version").fetchone()[0]
+            if current >= self.latest_version:
+                return
+
+            # WAL 设置持久化在数据库文件中，只需在执行迁移时（包括新建数据库）切换一次
+            self._enable_wal(conn)
+            with _sync_lock:
+                pending = self._apply_sync(conn, current)
+        finally:
+            conn.close()
+
+        if not pending:
+            return
+        if background:
+            self._thread = threading.Thread(
+                target=self._run_background, args=(pending,), name='schema-migrations', daemon=True
+            )
+            self._thread.start()
+        else:
+            self._run_background(pending)
+
+    @staticmethod
+    def _enable_wal(conn: sqlite3.Connection):
+        """切换到 WAL 模式（读连接不会被写事务阻塞；设置持久化到数据库文件，已是 WAL 时无操作）"""
+        try:
+            mode = conn.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+        except sqlite3.OperationalError as e:
+            # 切换需要独占数据库，其他进程正在使用时跳过，下次启动再切换
+            logger.warning(f"Could not switch to WAL journal mode: {e}")
+            return
+        if mode.lower() != 'wal':
+            logger.warning(f"Database journal mode is {mode}, not WAL")
+
+    def _apply_sync(self, conn: sqlite3.Connection, current: int) -> List[BackgroundMigration]:
+        """执行同步迁移，返回待执行的后台迁移"""
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                status TEXT NOT NULL,
+                progress INTEGER NOT NULL DEFAULT 0,
+                total INTEGER NOT NULL DEFAULT 0,
+                started_at TIMESTAMP,
+                finished_at TIMESTAMP
+            )
+        """)
+        done = {row[0] for row in conn.execute("SELECT version FROM schema_migrations WHERE status='done'")}
+
+        pending = []
+        for migration in self.migrations:
+            if migration.version <= current or migration.version in done:
+                continue
+
+            if migration.background:
+                conn.execute("""
+                    INSERT INTO schema_migrations (version, name, status, started_at)
+                    VALUES (?, ?, 'pending', ?)
+                    ON CONFLICT(version) DO NOTHING
+                """, (migration.version, migration.name, datetime.now()))
+                pending.append(migration)
+                continue
+
+            cursor = conn.cursor()
+            cursor.execute("BEGIN")
+            try:
+                migration.apply(cursor)
+                cursor.execute("""
+                    INSERT OR REPLACE INTO schema_migrations
+                    (version, name, status, started_at, finished_at)
+                    VALUES (?, ?, 'done', ?, ?)
+                """, (migration.version, migration.name, datetime.now(), datetime.now()))
+                cursor.execute("COMMIT")
+            except Exception:
+                cursor.execute("ROLLBACK")
+                logger.error(f"Migration {migration.version} ({migration.name}) failed", exc_info=True)
+                raise
+            logger.info(f"Applied migration {migration.version}: {migration.name}")
+
+        self._advance_version(conn)
+        return pending
+
+    def _advance_version(self, conn: sqlite3.Connection):
+        """user_version 前进到"此前所有迁移都已完成"的最大版本"""
+        current = conn.execute("PRAGMA user_version").fetchone()[0]
+        done = {row[0] for row in conn.execute("SELECT version FROM schema_migrations WHERE status='done'")}
+        version = current
+        for migration in self.migrations:
+            if migration.version <= current:
+                continue
+            if migration.version not in done:
+                break
+            version = migration.version
+        if version != current:
+            conn.execute(f"PRAGMA user_version = {int(version)}")
+
+    def _run_background(self, migrations: List[BackgroundMigration]):
+        conn = self._connect()
+        try:
+            for migration in migrations:
+                started = time.monotonic()
+                logger.info(f"Background migration {migration.version} started: {migration.name}")
+                try:
+                    for progress, total in migration.apply(conn):
+                        conn.execute("""
+                            UPDATE schema_migrations SET status='running', progress=?, total=?
+                            WHERE version=?
+                        """, (progress, total, migration.version))
+                        logger.info(f"Background migration {migration.version}: {progress}/{total}")
+                except Exception:
+                    conn.execute("UPDATE schema_migrations SET status='failed' WHERE version=?",
+                                 (migration.version,))
+                    logger.error(f"Background migration {migration.version} ({migration.name}) failed",
+                                 exc_info=True)
+                    # 后续迁移可能依赖这一步，停止执行，下次启动重试
+                    return
+
+                conn.execute("""
+                    UPDATE schema_migrations SET status='done', finished_at=? WHERE version=?
+                """, (datetime.now(), migration.version))
+                self._advance_version(conn)
+                logger.info(f"Background migration {migration.version} finished "
+                            f"in {time.monotonic() - started:.1f}s")
+        finally:
+            conn.close()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """等待后台迁移结束，返回是否已结束"""
+        if self._thread is None:
+            return True
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+    def status(self) -> List[Dict[str, Any]]:
+        """各迁移的执行状态（用于进度展示）"""
+        conn = self._connect()
+        try:
+            current = conn.execute("PRAGMA user_version").fetchone()[0]
+            try:
+                rows = conn.execute("""
+                    SELECT version, status, progress, total, started_at, finished_at
+                    FROM schema_migrations
+                """).fetchall()
+            except sqlite3.OperationalError:
+                rows = []
+        finally:
+            conn.close()
+
+        records = {row[0]: row for row in rows}
+        result = []
+        for migration in self.migrations:
+            row = records.get(migration.version)
+            if row:
+                status, progress, total, started_at, finished_at = row[1:]
+            elif migration.version <= current:
+                status, progress, total, started_at, finished_at = 'done', 0, 0, None, None
+            else:
+                status, progress, total, started_at, finished_at = 'pending', 0, 0, None, None
+            result.append({
+                'version': migration.version,
+                'name': migration.name,
+                'background': migration.background,
+                'status': status,
+                'progress': progress,
+                'total': total,
+                'started_at': started_at,
+                'finished_at': finished_at,
+            })
+        return result
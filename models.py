@@ -0,0 +1,216 @@
+"""
+数据记录类型和行工厂
+
+database.py 与 tron_payment.py 共用。每个记录类使用 __slots__，
+同时兼容原来的字典访问方式（record['order_id'] / record.get(...)），
+调用方无需修改。
+"""
+import sqlite3
+from operator import itemgetter
+from typing import Any, Dict, Iterator, Optional, Sequence, Tuple, Type
+
+
+class Record:
+    """带 __slots__ 的轻量记录基类"""
+
+    __slots__ = ()
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            object.__setattr__(self, name, value)
+        # 未提供的字段（旧数据库缺少的列）统一置为 None
+        for name in self.__slots__[len(values):]:
+            object.__setattr__(self, name, None)
+
+    def __getitem__(self, key: str) -> Any:
+        try:
+            return getattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key) from None
+
+    def __setitem__(self, key: str, value: Any):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.__slots__
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.__slots__)
+
+    def __len__(self) -> int:
+        return len(self.__slots__)
+
+    def __eq__(self, other) -> bool:
+        if type(other) is not type(self):
+            return NotImplemented
+        return self.values() == other.values()
+
+    def __repr__(self) -> str:
+        fields = ', '.join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return getattr(self, key, default) if key in self.__slots__ else default
+
+    def keys(self) -> Tuple[str, ...]:
+        return self.__slots__
+
+    def values(self) -> Tuple[Any, ...]:
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def items(self):
+        return zip(self.__slots__, self.values())
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为普通字典（用于 JSON 导出等）"""
+        return dict(self.items())
+
+
+class User(Record):
+    """users 表记录"""
+
+    __slots__ = (
+        'user_id', 'username', 'first_name', 'last_name', 'is_member',
+        'member_since', 'member_until', 'total_spent_usdt', 'total_spent_cny',
+        'created_at', 'last_active', 'notes',
+    )
+
+
+class Order(Record):
+    """orders 表记录"""
+
+    __slots__ = (
+        'order_id', 'user_id', 'payment_method', 'plan_type', 'amount', 'currency',
+        'status', 'created_at', 'paid_at', 'expired_at', 'cancelled_at',
+        'tron_tx_hash', 'tron_order_id', 'xianyu_order_number', 'xianyu_screenshot',
+        'membership_days', 'admin_notes', 'user_notes', 'expires_at',
+    )
+
+
+class PromoTemplate(Record):
+    """promo_templates 表记录"""
+
+    __slots__ = (
+        'id', 'name', 'message', 'image_file_id', 'button_text', 'button_url',
+        'created_by', 'created_at', 'updated_at', 'is_active',
+    )
+
+
+class ScheduledTask(Record):
+    """scheduled_tasks 表记录"""
+
+    __slots__ = (
+        'id', 'template_id', 'target_chats', 'scheduled_time', 'status',
+        'created_by', 'created_at', 'executed_at', 'result',
+        'claimed_by', 'claimed_at', 'schedule_id',
+    )
+
+
+class PromoSchedule(Record):
+    """promo_schedules 表记录（重复发送规则）"""
+
+    __slots__ = (
+        'id', 'template_id', 'target_chats', 'rule', 'next_run', 'last_run',
+        'is_active', 'created_by', 'created_at',
+    )
+
+
+class TronOrder(Record):
+    """tron_payment 订单表记录"""
+
+    __slots__ = (
+        'order_id', 'user_id', 'amount', 'status', 'created_at', 'paid_at',
+        'cancelled_at', 'timeout_at', 'memo', 'tx_hash', 'refund_address',
+        'refund_status', 'refund_tx_hash', 'notes',
+    )
+
+
+class Page(Record):
+    """
+    分页结果
+
+    next_cursor / prev_cursor 为翻页游标（字符串，可直接放进 callback_data），
+    没有下一页 / 上一页时为 None。
+    """
+
+    __slots__ = ('items', 'next_cursor', 'prev_cursor')
+
+
+# (记录类, 查询列名) -> 行转换函数
+_row_makers: Dict[Tuple[Type[Record], Tuple[str, ...]], Any] = {}
+
+
+def _row_maker(cls: Type[Record], columns: Tuple[str, ...]):
+    """构建并缓存 "数据库行 -> 记录" 的转换函数"""
+    key = (cls, columns)
+    maker = _row_makers.get(key)
+    if maker is not None:
+        return maker
+
+    positions = {name: index for index, name in enumerate(columns)}
+    indexes = [positions.get(name) for name in cls.__slots__]
+
+    if all(index is not None for index in indexes):
+        if list(indexes) == list(range(len(indexes))):
+            # 列顺序与字段顺序一致（SELECT * 的常见情况），直接解包
+            def maker(row, _cls=cls):
+                return _cls(*row)
+        else:
+            getter = itemgetter(*indexes)
+
+            def maker(row, _cls=cls, _getter=getter):
+                return _cls(*_getter(row))
+    else:
+        # 旧数据库可能缺少部分列，缺失字段补 None
+        def maker(row, _cls=cls, _indexes=tuple(indexes)):
+            return _cls(*[row[i] if i is not None else None for i in _indexes])
+
+    _row_makers[key] = maker
+    return maker
+
+
+def _columns(cursor: sqlite3.Cursor) -> Tuple[str, ...]:
+    return tuple(desc[0] for desc in cursor.description)
+
+
+def fetch_one(cursor: sqlite3.Cursor, cls: Type[Record]) -> Optional[Record]:
+    """读取一行并转换为记录，无结果返回 None"""
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    return _row_maker(cls, _columns(cursor))(row)
+
+
+def fetch_all(cursor: sqlite3.Cursor, cls: Type[Record]) -> list:
+    """读取全部行并转换为记录列表"""
+    rows = cursor.fetchall()
+    if not rows:
+        return []
+    maker = _row_maker(cls, _columns(cursor))
+    return [maker(row) for row in rows]
+
+
+def iter_rows(cursor: sqlite3.Cursor, cls: Type[Record], chunk_size: int = 500) -> Iterator[Record]:
+    """按批次惰性读取记录（峰值内存只与 chunk_size 有关）"""
+    maker = _row_maker(cls, _columns(cursor))
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            return
+        for row in rows:
+            yield maker(row)
+
+
+def make_records(cursor: sqlite3.Cursor, rows: Sequence[Sequence[Any]], cls: Type[Record]) -> list:
+    """将已读取的行转换为记录列表"""
+    if not rows:
+        return []
+    maker = _row_maker(cls, _columns(cursor))
+    return [maker(row) for row in rows]
+
+
+def row_to_dict(cursor: sqlite3.Cursor, row: Sequence[Any]) -> Dict[str, Any]:
+    """将任意查询行转换为字典（用于联表、统计等没有固定记录类型的查询）"""
+    return dict(zip(_columns(cursor), row))
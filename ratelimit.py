@@ -0,0 +1,167 @@
+"""
+令牌桶限流器
+
+TokenBucket 为同步实现（只做计算，不等待）；AsyncRateLimiter 在 asyncio
+中按速率排队等待，用于控制 Telegram API 调用频率；OrderLimiter 是按用户的
+下单防刷限制。
+"""
+import asyncio
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+
+class TokenBucket:
+    """令牌桶：以 rate 个/秒 的速度补充，最多存 capacity 个"""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated_at')
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(rate, 1))
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        if now > self.updated_at:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+
+    def try_acquire(self, tokens: float = 1) -> bool:
+        """尝试取令牌，成功返回 True，不足时返回 False（不扣减）"""
+        self._refill(time.monotonic())
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return True
+        return False
+
+    def reserve(self, tokens: float = 1) -> float:
+        """
+        预定令牌（允许透支），返回需要等待的秒数
+
+        透支后后续调用的等待时间会相应顺延，从而保证整体速率。
+        """
+        self._refill(time.monotonic())
+        self.tokens -= tokens
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+    def wait_time(self, tokens: float = 1) -> float:
+        """距离可取到 tokens 个令牌还需等待的秒数"""
+        self._refill(time.monotonic())
+        if self.tokens >= tokens:
+            return 0.0
+        return (tokens - self.tokens) / self.rate
+
+
+class AsyncRateLimiter:
+    """asyncio 限流器：每次 acquire 按令牌桶速率等待"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.bucket = TokenBucket(rate, capacity)
+
+    async def acquire(self, tokens: float = 1):
+        """等待直到允许发起下一次调用"""
+        delay = self.bucket.reserve(tokens)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def pause(self, seconds: float):
+        """暂停发放令牌 seconds 秒（如收到 RetryAfter 时），之后的 acquire 都会顺延"""
+        bucket = self.bucket
+        bucket._refill(time.monotonic())
+        bucket.tokens = min(bucket.tokens, 0) - seconds * bucket.rate
+
+
+class OrderLimiter:
+    """
+    按用户的下单防刷限制（纯内存，检查时不访问数据库）
+
+    - 待支付订单数：启动时从数据库加载，之后随订单创建/支付/取消/过期增减；
+      达到上限时由调用方查库确认后用 set_pending() 校正（计数偏高不会一直拒绝下单）
+    - 下单间隔：每个用户一个容量为 1 的令牌桶，每 min_interval 秒补充 1 个；
+      令牌已满的桶会被丢弃，内存只与最近下过单的用户数有关
+    """
+
+    def __init__(self, max_pending: int, min_interval: float):
+        self.max_pending = max_pending
+        self.min_interval = min_interval
+        self._pending: Dict[int, int] = {}
+        self._buckets: Dict[int, TokenBucket] = {}
+        # TRON 支付回调在监控线程中更新计数
+        self._lock = threading.Lock()
+
+    def load(self, pending_counts: Dict[int, int], last_order_times: Dict[int, datetime]):
+        """
+        用数据库中的状态初始化
+
+        Args:
+            pending_counts: {用户 ID: 待支付订单数}
+            last_order_times: {用户 ID: 最后下单时间}（只需最近 min_interval 秒内的）
+        """
+        now = datetime.now()
+        with self._lock:
+            self._pending = {user_id: count for user_id, count in pending_counts.items() if count > 0}
+            self._buckets = {}
+            if self.min_interval <= 0:
+                return
+            for user_id, created_at in last_order_times.items():
+                elapsed = (now - created_at).total_seconds()
+                if elapsed < self.min_interval:
+                    bucket = self._new_bucket()
+                    bucket.tokens = max(elapsed, 0) / self.min_interval
+                    self._buckets[user_id] = bucket
+
+    def _new_bucket(self) -> TokenBucket:
+        return TokenBucket(1 / self.min_interval, 1)
+
+    def check(self, user_id: int) -> Optional[Tuple[str, int]]:
+        """
+        检查用户现在能否下单
+
+        Returns:
+            None 表示允许；否则为 ('pending', 当前待支付订单数) 或 ('interval', 需等待秒数)
+        """
+        with self._lock:
+            pending = self._pending.get(user_id, 0)
+            if pending >= self.max_pending:
+                return 'pending', pending
+
+            bucket = self._buckets.get(user_id)
+            if bucket is not None:
+                wait = bucket.wait_time()
+                if wait > 0:
+                    return 'interval', max(int(wait), 1)
+                del self._buckets[user_id]
+            return None
+
+    def order_created(self, user_id: int):
+        """用户新建了一个待支付订单"""
+        with self._lock:
+            self._pending[user_id] = self._pending.get(user_id, 0) + 1
+            if self.min_interval > 0:
+                self._buckets.setdefault(user_id, self._new_bucket()).reserve()
+
+    def order_closed(self, user_id: int, count: int = 1):
+        """用户的待支付订单已支付/取消/过期"""
+        with self._lock:
+            remaining = self._pending.get(user_id, 0) - count
+            if remaining > 0:
+                self._pending[user_id] = remaining
+            else:
+                self._pending.pop(user_id, None)
+
+    def set_pending(self, user_id: int, count: int):
+        """用数据库中的实际数量校正用户的待支付订单数（订单可能在本进程之外被修改）"""
+        with self._lock:
+            if count > 0:
+                self._pending[user_id] = count
+            else:
+                self._pending.pop(user_id, None)
+
+    def pending_count(self, user_id: int) -> int:
+        """用户当前的待支付订单数"""
+        with self._lock:
+            return self._pending.get(user_id, 0)
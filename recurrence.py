@@ -0,0 +1,189 @@
+"""
+广告重复发送规则
+
+支持两种规则：
+- cron 表达式（5 段：分 时 日 月 周），如 "cron 0 9 * * 1-5"（工作日 9:00）
+- 固定间隔，可限定每天的发送时间段，如 "every 30m"、"every 2h 09:00-21:00"
+
+next_after() 按字段直接跳到下一个匹配的时间，不逐分钟扫描。数据库里每条规则只保存
+下一次触发时间，到点时才生成一条一次性的 scheduled_tasks 记录，两次触发之间没有任何开销。
+"""
+import re
+from bisect import bisect_left, bisect_right
+from datetime import datetime, time, timedelta
+from typing import List, Optional, Tuple, Union
+
+# 无时间段的间隔规则从这个时间起算，"every 30m" 落在整点/半点，"every 2h" 落在偶数点
+INTERVAL_ANCHOR = datetime(2000, 1, 1)
+
+INTERVAL_UNITS = {'m': 60, 'h': 3600, 'd': 86400}
+
+# cron 字段：(名称, 最小值, 最大值)
+CRON_FIELDS = (
+    ('minute', 0, 59),
+    ('hour', 0, 23),
+    ('day', 1, 31),
+    ('month', 1, 12),
+    ('weekday', 0, 7),
+)
+
+# 找不到下一次触发时间时最多检查的天数（如 2 月 31 日这种永远不会匹配的规则）
+MAX_SEARCH_DAYS = 366 * 5
+
+
+def _parse_cron_field(text: str, low: int, high: int) -> List[int]:
+    values = set()
+    for part in text.split(','):
+        step = 1
+        stepped = '/' in part
+        if stepped:
+            part, step_text = part.split('/', 1)
+            step = int(step_text)
+            if step <= 0:
+                raise ValueError(f"Invalid step: {step_text}")
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start_text, end_text = part.split('-', 1)
+            start, end = int(start_text), int(end_text)
+        else:
+            start = int(part)
+            # "5/15" 表示从 5 开始每 15 一次
+            end = high if stepped else start
+        if not low <= start <= end <= high:
+            raise ValueError(f"Value out of range {low}-{high}: {part}")
+        values.update(range(start, end + 1, step))
+    return sorted(values)
+
+
+class CronRule:
+    """5 段 cron 表达式（分 时 日 月 周，周日为 0 或 7）"""
+
+    def __init__(self, expression: str):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron expression needs 5 fields: {expression}")
+        parsed = [_parse_cron_field(text, low, high)
+                  for text, (_, low, high) in zip(fields, CRON_FIELDS)]
+        self.minutes, self.hours, self.days, self.months, weekdays = parsed
+        # cron 的周日是 0（也可写 7），datetime.weekday() 的周日是 6
+        self.weekdays = {(day - 1) % 7 for day in weekdays}
+        # 日和周都有限定时，满足其一即可（与标准 cron 相同）
+        self.day_restricted = fields[2] != '*'
+        self.weekday_restricted = fields[4] != '*'
+        self.text = 'cron ' + ' '.join(fields)
+
+    def _day_matches(self, day: datetime) -> bool:
+        in_days = day.day in self.days
+        in_weekdays = day.weekday() in self.weekdays
+        if self.day_restricted and self.weekday_restricted:
+            return in_days or in_weekdays
+        return in_days and in_weekdays
+
+    def next_after(self, after: datetime) -> datetime:
+        """after 之后（不含）的下一次触发时间"""
+        t = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = t + timedelta(days=MAX_SEARCH_DAYS)
+        while t < limit:
+            if t.month not in self.months:
+                i = bisect_right(self.months, t.month)
+                year = t.year if i < len(self.months) else t.year + 1
+                t = datetime(year, self.months[i % len(self.months)], 1)
+                continue
+            if not self._day_matches(t):
+                t = datetime(t.year, t.month, t.day) + timedelta(days=1)
+                continue
+            i = bisect_left(self.hours, t.hour)
+            if i == len(self.hours):
+                t = datetime(t.year, t.month, t.day) + timedelta(days=1)
+                continue
+            if self.hours[i] != t.hour:
+                t = t.replace(hour=self.hours[i], minute=0)
+            i = bisect_left(self.minutes, t.minute)
+            if i == len(self.minutes):
+                t = t.replace(minute=0) + timedelta(hours=1)
+                continue
+            return t.replace(minute=self.minutes[i])
+        raise ValueError(f"Rule never fires: {self.text}")
+
+
+class IntervalRule:
+    """固定间隔，可限定每天的时间段（结束早于开始表示跨零点）"""
+
+    def __init__(self, every: timedelta, window: Optional[Tuple[time, time]] = None):
+        if every < timedelta(minutes=1):
+            raise ValueError("Interval must be at least 1 minute")
+        self.every = every
+        self.window = window
+        text = f"every {self._format_interval(every)}"
+        if window:
+            text += f" {window[0].strftime('%H:%M')}-{window[1].strftime('%H:%M')}"
+        self.text = text
+
+    @staticmethod
+    def _format_interval(every: timedelta) -> str:
+        seconds = int(every.total_seconds())
+        for unit in ('d', 'h', 'm'):
+            if seconds % INTERVAL_UNITS[unit] == 0:
+                return f"{seconds // INTERVAL_UNITS[unit]}{unit}"
+        return f"{seconds // 60}m"
+
+    @staticmethod
+    def _next_on_grid(anchor: datetime, every: timedelta, after: datetime) -> datetime:
+        # anchor + k * every 中第一个晚于 after 的时间
+        if after < anchor:
+            return anchor
+        return anchor + ((after - anchor) // every + 1) * every
+
+    def next_after(self, after: datetime) -> datetime:
+        """after 之后（不含）的下一次触发时间"""
+        if not self.window:
+            return self._next_on_grid(INTERVAL_ANCHOR, self.every, after)
+
+        start, end = self.window
+        span = (datetime.combine(after.date(), end) - datetime.combine(after.date(), start))
+        if span <= timedelta(0):
+            span += timedelta(days=1)
+        # 每天的时间段内从开始时间起每隔 every 一次；跨零点的时间段可能是前一天开始的
+        day = after.date() - timedelta(days=1)
+        while True:
+            opens = datetime.combine(day, start)
+            fire = self._next_on_grid(opens, self.every, after)
+            if fire <= opens + span:
+                return fire
+            day += timedelta(days=1)
+
+
+Rule = Union[CronRule, IntervalRule]
+
+_INTERVAL_PATTERN = re.compile(
+    r'^every\s+(\d+)\s*([mhd])(?:\s+(\d{1,2}:\d{2})\s*-\s*(\d{1,2}:\d{2}))?$'
+)
+
+
+def parse_rule(text: str) -> Rule:
+    """
+    解析重复规则
+
+    Examples:
+        cron 0 9 * * *          每天 9:00
+        cron */30 9-21 * * 1-5  工作日 9:00-21:30 每半小时
+        every 2h                每 2 小时（整点）
+        every 45m 10:00-22:00   每天 10:00-22:00 之间每 45 分钟
+
+    Raises:
+        ValueError: 规则无法解析
+    """
+    text = ' '.join(text.strip().lower().split())
+    match = _INTERVAL_PATTERN.match(text)
+    if match:
+        amount, unit, window_start, window_end = match.groups()
+        every = timedelta(seconds=int(amount) * INTERVAL_UNITS[unit])
+        window = None
+        if window_start:
+            window = (datetime.strptime(window_start, '%H:%M').time(),
+                      datetime.strptime(window_end, '%H:%M').time())
+        return IntervalRule(every, window)
+    if text.startswith('cron '):
+        return CronRule(text[len('cron '):])
+    raise ValueError(f"Unrecognized rule: {text}")
@@ -0,0 +1,140 @@
+"""
+按钮回调路由
+
+callback_data 先按完整值在字典中查找，找不到再沿前缀树匹配最长的已注册前缀
+（如 "view_order_" + 订单号），前缀之后的部分作为参数传给处理函数。
+Telegram 的 callback_data 最长 64 字节，所以每次分发的开销与已注册路由的数量无关。
+
+每个路由可以声明只允许管理员使用，并记录调用次数、耗时和异常次数。
+"""
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# handler(update, context, query, user_id, arg)
+Handler = Callable[..., Awaitable[Any]]
+
+# 前缀树节点中存放路由的键（不会与单个字符冲突）
+_ROUTE = ''
+
+
+class Route:
+    """一个回调路由及其耗时统计"""
+
+    __slots__ = ('name', 'handler', 'admin', 'calls', 'errors', 'total_time', 'max_time')
+
+    def __init__(self, handler: Handler, admin: bool):
+        self.name = handler.__name__
+        self.handler = handler
+        self.admin = admin
+        self.calls = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+
+class CallbackRouter:
+    """完整匹配用字典、前缀匹配用前缀树的回调路由"""
+
+    def __init__(self, is_admin: Callable[[int], bool],
+                 on_denied: Callable[[Any], Awaitable[Any]]):
+        """
+        Args:
+            is_admin: 判断用户是否管理员
+            on_denied: 非管理员访问管理员路由时调用 on_denied(query)
+        """
+        self.is_admin = is_admin
+        self.on_denied = on_denied
+        self._exact: Dict[str, Route] = {}
+        self._trie: Dict[str, Any] = {}
+        self._routes: List[Route] = []
+
+    def route(self, *names: str, prefixes: Tuple[str, ...] = (), admin: bool = False):
+        """
+        注册回调处理函数（装饰器）
+
+        Args:
+            names: 完整匹配的 callback_data
+            prefixes: 前缀匹配的 callback_data，去掉前缀后的部分作为 arg 传入
+            admin: 是否只允许管理员
+
+        处理函数签名：handler(update, context, query, user_id, arg)，完整匹配时 arg 为 ''。
+        """
+        def decorator(handler: Handler) -> Handler:
+            route = Route(handler, admin)
+            for name in names:
+                if name in self._exact:
+                    raise ValueError(f"Duplicate callback route: {name}")
+                self._exact[name] = route
+            for prefix in prefixes:
+                node = self._trie
+                for char in prefix:
+                    node = node.setdefault(char, {})
+                if _ROUTE in node:
+                    raise ValueError(f"Duplicate callback prefix: {prefix}")
+                node[_ROUTE] = route
+            self._routes.append(route)
+            return handler
+        return decorator
+
+    def match(self, data: str) -> Optional[Tuple[Route, str]]:
+        """查找 data 对应的路由，返回 (路由, 参数)"""
+        route = self._exact.get(data)
+        if route is not None:
+            return route, ''
+
+        match = None
+        node = self._trie
+        for i, char in enumerate(data):
+            node = node.get(char)
+            if node is None:
+                break
+            if _ROUTE in node:
+                # 继续向下，取最长的前缀
+                match = (node[_ROUTE], data[i + 1:])
+        return match
+
+    async def dispatch(self, update, context) -> bool:
+        """分发按钮回调，没有匹配的路由时返回 False"""
+        query = update.callback_query
+        data = query.data or ''
+        match = self.match(data)
+        if match is None:
+            logger.warning(f"No callback route for {data!r}")
+            return False
+
+        route, arg = match
+        user_id = update.effective_user.id
+        if route.admin and not self.is_admin(user_id):
+            await self.on_denied(query)
+            return True
+
+        started = time.perf_counter()
+        try:
+            await route.handler(update, context, query, user_id, arg)
+        except Exception:
+            route.errors += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            route.calls += 1
+            route.total_time += elapsed
+            route.max_time = max(route.max_time, elapsed)
+        return True
+
+    def metrics(self) -> List[Dict[str, Any]]:
+        """各路由的调用统计（按总耗时从高到低）"""
+        stats = [
+            {
+                'route': route.name,
+                'calls': route.calls,
+                'errors': route.errors,
+                'avg_ms': route.total_time / route.calls * 1000 if route.calls else 0.0,
+                'max_ms': route.max_time * 1000,
+                'total_ms': route.total_time * 1000,
+            }
+            for route in self._routes
+        ]
+        return sorted(stats, key=lambda item: item['total_ms'], reverse=True)
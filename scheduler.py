@@ -0,0 +1,117 @@
+"""
+按下次触发时间调度的定时器
+
+待执行任务的触发时间放在一个最小堆里，只为最早的一个用 job_queue.run_once 设定唤醒；
+到点后执行回调，再为下一个最早的时间重新设定。没有任务时不会有任何轮询。
+新建/取消任务时调用 add/remove，唤醒时间会随之调整。
+回调抛出异常时（如数据库被其他进程锁住），本次到期的 key 在 retry_delay 后重新触发。
+"""
+import heapq
+import itertools
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class NextFireScheduler:
+    """以最早触发时间驱动的调度器（运行在 Bot 的事件循环中）"""
+
+    def __init__(self, name: str = 'scheduled_tasks', retry_delay: timedelta = timedelta(seconds=30)):
+        self.name = name
+        self.retry_delay = retry_delay
+        # (触发时间, 序号, key)：序号保证时间相同时不比较 key
+        self._heap: List[Tuple[datetime, int, Any]] = []
+        self._counter = itertools.count()
+        # key -> 当前有效的触发时间；堆中与之不一致的条目视为已删除
+        self._entries: Dict[Any, datetime] = {}
+        self._job_queue = None
+        self._callback: Optional[Callable] = None
+        self._job = None
+        self._armed_at: Optional[datetime] = None
+
+    def start(self, job_queue, callback: Callable, entries: Iterable[Tuple[Any, datetime]] = ()):
+        """
+        Args:
+            job_queue: Application.job_queue
+            callback: 到点时执行的 async callback(context)
+            entries: 初始的 (key, 触发时间)
+        """
+        self._job_queue = job_queue
+        self._callback = callback
+        for key, when in entries:
+            self._push(key, when)
+        self._arm()
+        logger.info(f"Scheduler {self.name} started, {len(self._entries)} pending")
+
+    def _push(self, key: Any, when: datetime):
+        self._entries[key] = when
+        heapq.heappush(self._heap, (when, next(self._counter), key))
+
+    def _peek(self) -> Optional[datetime]:
+        # 丢弃已删除/已改期的条目
+        while self._heap:
+            when, _, key = self._heap[0]
+            if self._entries.get(key) == when:
+                return when
+            heapq.heappop(self._heap)
+        return None
+
+    def add(self, key: Any, when: datetime):
+        """新增或改期"""
+        self._push(key, when)
+        self._arm()
+
+    def remove(self, key: Any):
+        """取消（堆中条目延迟删除）"""
+        if self._entries.pop(key, None) is not None:
+            self._arm()
+
+    def next_fire_time(self) -> Optional[datetime]:
+        """下一次触发时间（没有待执行任务时为 None）"""
+        return self._peek()
+
+    def _arm(self):
+        """为最早的触发时间设定唤醒（已设定为同一时间时不重复设定）"""
+        if self._job_queue is None:
+            return
+        when = self._peek()
+        if when == self._armed_at and self._job is not None:
+            return
+        if self._job is not None:
+            self._job.schedule_removal()
+            self._job = None
+            self._armed_at = None
+        if when is None:
+            return
+        delay = max((when - datetime.now()).total_seconds(), 0)
+        self._job = self._job_queue.run_once(self._fire, delay, name=self.name)
+        self._armed_at = when
+
+    async def _fire(self, context):
+        self._job = None
+        self._armed_at = None
+        now = datetime.now()
+        due = []
+        while True:
+            when = self._peek()
+            if when is None or when > now:
+                break
+            _, _, key = heapq.heappop(self._heap)
+            del self._entries[key]
+            due.append(key)
+
+        try:
+            if due:
+                await self._callback(context)
+        except Exception as e:
+            logger.error(f"Scheduler {self.name} callback failed, retrying {len(due)} key(s) "
+                         f"in {self.retry_delay.total_seconds():.0f}s: {e}", exc_info=True)
+            retry_at = datetime.now() + self.retry_delay
+            for key in due:
+                # 回调期间已重新加入（如重复规则已排好下一次）的保持不变
+                if key not in self._entries:
+                    self._push(key, retry_at)
+        finally:
+            self._arm()
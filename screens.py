@@ -0,0 +1,67 @@
+"""
+静态界面缓存
+
+欢迎页、帮助、套餐列表等界面的文字和键盘只由配置决定。这里按 (名称, 变体) 构建一次后复用
+（变体如 管理员/普通用户、支付方式、套餐），处理函数直接取出发送，不再每次重建按钮和拼接文字。
+配置变化后调用 invalidate()：版本号递增、缓存清空，之后按需用新配置重新构建。
+"""
+import logging
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class Screen:
+    """一个界面：文字（可为空）+ 键盘"""
+
+    __slots__ = ('text', 'reply_markup')
+
+    def __init__(self, text: Optional[str] = None, reply_markup: Any = None):
+        self.text = text
+        self.reply_markup = reply_markup
+
+
+class ScreenRegistry:
+    """按名称注册界面构建函数，按 (名称, 变体) 缓存构建结果"""
+
+    def __init__(self):
+        self._builders: Dict[str, Callable[[Hashable], Optional[Screen]]] = {}
+        self._cache: Dict[Tuple[str, Hashable], Screen] = {}
+        self._lock = threading.Lock()
+        self.version = 0
+
+    def register(self, name: str):
+        """
+        注册界面构建函数（装饰器）
+
+        构建函数接收变体参数，返回 Screen；变体无效（如不存在的套餐）时返回 None，结果不缓存。
+        """
+        def decorator(builder: Callable[[Hashable], Optional[Screen]]):
+            self._builders[name] = builder
+            return builder
+        return decorator
+
+    def get(self, name: str, variant: Hashable = None) -> Optional[Screen]:
+        """取出界面，第一次使用（或配置变化后）时构建"""
+        key = (name, variant)
+        screen = self._cache.get(key)
+        if screen is not None:
+            return screen
+
+        with self._lock:
+            version = self.version
+        screen = self._builders[name](variant)
+        if screen is not None:
+            with self._lock:
+                # 构建期间配置已变化时不缓存旧界面
+                if self.version == version:
+                    self._cache[key] = screen
+        return screen
+
+    def invalidate(self):
+        """配置变化后作废全部界面"""
+        with self._lock:
+            self.version += 1
+            self._cache.clear()
+        logger.info(f"Screens invalidated (version {self.version})")
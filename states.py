@@ -0,0 +1,186 @@
+"""
+多步骤对话的用户状态
+
+替代原来的模块级 user_states 字典，用法不变（user_states[user_id] = {...}、
+state['step'] = ...、del user_states[user_id]），另外：
+- 超过 TTL 没有更新的状态自动失效（用户中途放弃的流程不会一直占用内存）
+- 条目数有上限，超出时淘汰最久未使用的
+- 可选写穿到 SQLite：每次修改都排入写队列（不等待提交），启动时一次性载入，
+  Bot 重启后正在进行的流程可以继续，运行期间读取状态不查数据库
+"""
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ConversationState(dict):
+    """单个用户的状态；修改后自动保存"""
+
+    def __init__(self, store: 'ConversationStateStore', user_id: int, values: Dict[str, Any]):
+        super().__init__(values)
+        self._store = store
+        self._user_id = user_id
+
+    def __setitem__(self, key: str, value: Any):
+        super().__setitem__(key, value)
+        self._store._save(self._user_id, self)
+
+    def __delitem__(self, key: str):
+        super().__delitem__(key)
+        self._store._save(self._user_id, self)
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self._store._save(self._user_id, self)
+
+    def pop(self, key: str, *default):
+        value = super().pop(key, *default)
+        self._store._save(self._user_id, self)
+        return value
+
+
+class ConversationStateStore:
+    """带 TTL 和容量上限、可持久化的 user_id -> 状态 映射"""
+
+    def __init__(self, db=None, ttl_seconds: float = 7200, max_entries: int = 10000):
+        """
+        Args:
+            db: Database 实例；为 None 时只保存在内存中
+            ttl_seconds: 状态在最后一次修改后保留的秒数
+            max_entries: 内存中最多保存的用户数
+        """
+        self.db = db
+        self.ttl = ttl_seconds
+        self.max_entries = max_entries
+        # user_id -> (状态, 最后修改时间)，按最近使用排序
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        if db is not None:
+            self._load()
+
+    def _load(self):
+        cutoff = time.time() - self.ttl
+        self.db.delete_conversation_states_before(cutoff)
+        rows = self.db.get_conversation_states(self.max_entries)
+        # 按修改时间从旧到新放入，最近修改的排在最后
+        for user_id, state_json, updated_at in reversed(rows):
+            try:
+                values = json.loads(state_json)
+            except ValueError:
+                logger.warning(f"Dropping unreadable conversation state of user {user_id}")
+                continue
+            self._entries[user_id] = (ConversationState(self, user_id, values), updated_at)
+        if rows:
+            logger.info(f"Restored {len(self._entries)} conversation state(s)")
+
+    # ========== 持久化 ==========
+
+    def _save(self, user_id: int, state: ConversationState):
+        now = time.time()
+        with self._lock:
+            # 已删除/被替换/已淘汰的状态对象再被修改时不写回，否则重启后会恢复已删除的状态
+            if self._entries.get(user_id, (None,))[0] is not state:
+                return
+            self._entries[user_id] = (state, now)
+            self._entries.move_to_end(user_id)
+        self._persist(user_id, state, now)
+
+    def _persist(self, user_id: int, state: Optional[Dict[str, Any]], updated_at: float = 0):
+        if self.db is None:
+            return
+        if state is None:
+            future = self.db.delete_conversation_state(user_id)
+        else:
+            future = self.db.save_conversation_state(
+                user_id, json.dumps(state, ensure_ascii=False, default=str), updated_at
+            )
+        future.add_done_callback(self._log_failure)
+
+    @staticmethod
+    def _log_failure(future):
+        if future.exception() is not None:
+            logger.error(f"Failed to persist conversation state: {future.exception()}")
+
+    # ========== 映射接口 ==========
+
+    def _live(self, user_id: int) -> Optional[ConversationState]:
+        """未过期的状态（过期的顺便删除）"""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            state, updated_at = entry
+            if time.time() - updated_at <= self.ttl:
+                self._entries.move_to_end(user_id)
+                return state
+            del self._entries[user_id]
+        self._persist(user_id, None)
+        return None
+
+    def __contains__(self, user_id: int) -> bool:
+        return self._live(user_id) is not None
+
+    def __getitem__(self, user_id: int) -> ConversationState:
+        state = self._live(user_id)
+        if state is None:
+            raise KeyError(user_id)
+        return state
+
+    def get(self, user_id: int, default: Any = None) -> Any:
+        state = self._live(user_id)
+        return default if state is None else state
+
+    def __setitem__(self, user_id: int, values: Dict[str, Any]):
+        state = ConversationState(self, user_id, values)
+        now = time.time()
+        evicted = []
+        with self._lock:
+            self._entries[user_id] = (state, now)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                evicted.append(self._entries.popitem(last=False)[0])
+        self._persist(user_id, state, now)
+        for old_user_id in evicted:
+            logger.info(f"Evicted conversation state of user {old_user_id} (store full)")
+            self._persist(old_user_id, None)
+
+    def __delitem__(self, user_id: int):
+        with self._lock:
+            if user_id not in self._entries:
+                raise KeyError(user_id)
+            del self._entries[user_id]
+        self._persist(user_id, None)
+
+    def pop(self, user_id: int, default: Any = None) -> Any:
+        state = self._live(user_id)
+        if state is None:
+            return default
+        del self[user_id]
+        return state
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(list(self._entries))
+
+    def purge_expired(self) -> int:
+        """
+        删除全部已过期的状态（定期执行），返回从内存中删除的数量
+
+        数据库中的过期记录一并删除，包括已被淘汰出内存、用户再也没有回来的。
+        """
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            expired = [user_id for user_id, (_, updated_at) in self._entries.items()
+                       if updated_at < cutoff]
+            for user_id in expired:
+                del self._entries[user_id]
+        if self.db is not None:
+            self.db.delete_conversation_states_before(cutoff)
+        return len(expired)
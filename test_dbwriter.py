@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+数据库写入队列测试脚本（使用临时数据库，不影响 payment_bot.db）
+
+使用方法：
+    python3 test_dbwriter.py
+"""
+
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+
+from dbwriter import WriteQueue
+
+
+def _new_queue():
+    path = os.path.join(tempfile.mkdtemp(), 'writer_test.db')
+    writer = WriteQueue(path)
+    writer.execute(lambda cursor: cursor.execute("CREATE TABLE items (value INTEGER UNIQUE)"))
+    return writer, path
+
+
+def _values(path):
+    conn = sqlite3.connect(path)
+    try:
+        return sorted(row[0] for row in conn.execute("SELECT value FROM items"))
+    finally:
+        conn.close()
+
+
+def _insert(value):
+    return lambda cursor: cursor.execute("INSERT INTO items (value) VALUES (?)", (value,))
+
+
+def _submit_batch(writer, jobs):
+    """让 jobs 进入同一个组提交批次：先用一个写操作占住写线程，再一次性排队"""
+    started, release = threading.Event(), threading.Event()
+    blocker = writer.submit(lambda cursor: (started.set(), release.wait(5)))
+    started.wait(5)
+    futures = [writer.submit(job) for job in jobs]
+    release.set()
+    blocker.result(5)
+    return futures
+
+
+def test_failing_job_does_not_poison_batch():
+    """同一批里一个写操作失败，只回滚它自己，其他写操作照常提交"""
+    writer, path = _new_queue()
+    try:
+        futures = _submit_batch(writer, [_insert(1), _insert(1), _insert(2)])
+        assert futures[0].result(5) is not None
+        try:
+            futures[1].result(5)
+            raise AssertionError("duplicate insert should fail")
+        except sqlite3.IntegrityError:
+            pass
+        assert futures[2].result(5) is not None
+        assert _values(path) == [1, 2]
+        assert writer.metrics()['failed_writes'] == 1
+    finally:
+        writer.close()
+
+
+def test_ended_transaction_fails_batch_and_writer_survives():
+    """写操作结束了整个事务（如 SQLite 因 IO 错误回滚）时整批失败，写线程继续工作"""
+    writer, path = _new_queue()
+    try:
+        futures = _submit_batch(writer, [
+            _insert(1),
+            lambda cursor: cursor.execute("ROLLBACK"),
+            _insert(2),
+        ])
+        for future in futures:
+            try:
+                future.result(5)
+                raise AssertionError("write in an aborted transaction should fail")
+            except sqlite3.Error:
+                pass
+        assert _values(path) == []
+
+        # 之后的写操作不受影响
+        writer.execute(_insert(3))
+        assert _values(path) == [3]
+    finally:
+        writer.close()
+
+
+def test_nested_execute_runs_in_same_transaction():
+    """写操作内部再次调用 execute 时直接在当前事务中执行，不会死锁"""
+    writer, path = _new_queue()
+    try:
+        writer.execute(lambda cursor: (cursor.execute("INSERT INTO items VALUES (1)"),
+                                       writer.execute(_insert(2))))
+        assert _values(path) == [1, 2]
+    finally:
+        writer.close()
+
+
+def test_close_flushes_and_rejects_new_writes():
+    """close() 写完已排队的写操作；之后的写操作立即报错而不是一直等待"""
+    writer, path = _new_queue()
+    futures = [writer.submit(_insert(value)) for value in range(200)]
+    writer.close()
+    writer.close()
+    assert all(future.done() for future in futures)
+    assert _values(path) == list(range(200))
+
+    for call in (writer.submit, writer.execute):
+        try:
+            call(_insert(999))
+            raise AssertionError("closed queue should reject writes")
+        except RuntimeError:
+            pass
+
+
+if __name__ == '__main__':
+    tests = [value for name, value in sorted(globals().items()) if name.startswith('test_')]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except Exception as e:
+            failed += 1
+            print(f"❌ {test.__name__}: {e!r}")
+    print()
+    print(f"{len(tests) - failed}/{len(tests)} 通过")
+    sys.exit(1 if failed else 0)
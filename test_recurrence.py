@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+广告重复规则测试脚本（纯计算，不访问数据库）
+
+使用方法：
+    python3 test_recurrence.py
+"""
+
+import sys
+from datetime import datetime
+
+from recurrence import parse_rule
+
+# (规则, 起始时间, 下一次触发时间)；2026-10-19 是周一
+NEXT_FIRE_CASES = [
+    # 基本 / 不含起始时间本身
+    ('cron 0 9 * * *', datetime(2026, 10, 19, 8, 59), datetime(2026, 10, 19, 9, 0)),
+    ('cron 0 9 * * *', datetime(2026, 10, 19, 9, 0), datetime(2026, 10, 20, 9, 0)),
+    # 步长
+    ('cron */15 * * * *', datetime(2026, 10, 19, 10, 7, 30), datetime(2026, 10, 19, 10, 15)),
+    ('cron 5/20 * * * *', datetime(2026, 10, 19, 10, 6), datetime(2026, 10, 19, 10, 25)),
+    ('cron 0 9-17/4 * * *', datetime(2026, 10, 19, 13, 0), datetime(2026, 10, 19, 17, 0)),
+    ('cron 0 9-17/4 * * *', datetime(2026, 10, 19, 17, 0), datetime(2026, 10, 20, 9, 0)),
+    # 工作日跳过周末
+    ('cron 0 9 * * 1-5', datetime(2026, 10, 23, 10, 0), datetime(2026, 10, 26, 9, 0)),
+    # 周日写作 0 或 7
+    ('cron 0 12 * * 0', datetime(2026, 10, 19, 0, 0), datetime(2026, 10, 25, 12, 0)),
+    ('cron 0 12 * * 7', datetime(2026, 10, 19, 0, 0), datetime(2026, 10, 25, 12, 0)),
+    # 日和周都有限定时满足其一即可：11 月 1 日（周日）早于 11 月 2 日（周一）
+    ('cron 0 0 1 * 1', datetime(2026, 10, 27, 0, 0), datetime(2026, 11, 1, 0, 0)),
+    ('cron 0 0 1 * 1', datetime(2026, 10, 19, 0, 0), datetime(2026, 10, 26, 0, 0)),
+    # 跨月 / 跨年 / 闰日
+    ('cron 30 23 31 * *', datetime(2026, 11, 1, 0, 0), datetime(2026, 12, 31, 23, 30)),
+    ('cron 0 0 1 1 *', datetime(2026, 10, 19, 0, 0), datetime(2027, 1, 1, 0, 0)),
+    ('cron 0 0 29 2 *', datetime(2026, 10, 19, 0, 0), datetime(2028, 2, 29, 0, 0)),
+    # 固定间隔（从 2000-01-01 00:00 起算）
+    ('every 30m', datetime(2026, 10, 19, 10, 10), datetime(2026, 10, 19, 10, 30)),
+    ('every 30m', datetime(2026, 10, 19, 10, 30), datetime(2026, 10, 19, 11, 0)),
+    ('every 2h', datetime(2026, 10, 19, 1, 0), datetime(2026, 10, 19, 2, 0)),
+    ('every 1d', datetime(2026, 10, 19, 0, 0), datetime(2026, 10, 20, 0, 0)),
+    # 时间段内从开始时间起每隔 every 一次，结束时间本身也会触发
+    ('every 45m 10:00-22:00', datetime(2026, 10, 19, 21, 50), datetime(2026, 10, 19, 22, 0)),
+    ('every 45m 10:00-22:00', datetime(2026, 10, 19, 22, 0), datetime(2026, 10, 20, 10, 0)),
+    ('every 45m 10:00-22:00', datetime(2026, 10, 19, 3, 0), datetime(2026, 10, 19, 10, 0)),
+    # 跨零点的时间段
+    ('every 1h 22:00-02:00', datetime(2026, 10, 19, 23, 30), datetime(2026, 10, 20, 0, 0)),
+    ('every 1h 22:00-02:00', datetime(2026, 10, 20, 1, 30), datetime(2026, 10, 20, 2, 0)),
+    ('every 1h 22:00-02:00', datetime(2026, 10, 20, 2, 0), datetime(2026, 10, 20, 22, 0)),
+    ('every 1h 22:00-02:00', datetime(2026, 10, 20, 12, 0), datetime(2026, 10, 20, 22, 0)),
+]
+
+# (输入, 规范化后的规则文本)
+TEXT_CASES = [
+    ('  EVERY   2h ', 'every 2h'),
+    ('every 120m', 'every 2h'),
+    ('every 90m', 'every 90m'),
+    ('every 30m 9:00-21:00', 'every 30m 09:00-21:00'),
+    ('cron  0 9 * *  1-5', 'cron 0 9 * * 1-5'),
+]
+
+INVALID_RULES = [
+    'hello',
+    'every 0m',
+    'every 30s',
+    'every 30m 25:00-26:00',
+    'cron 0 9 * *',
+    'cron 60 * * * *',
+    'cron 0 24 * * *',
+    'cron 0 0 0 * *',
+    'cron */0 * * * *',
+    'cron 10-5 * * * *',
+]
+
+
+def test_next_fire_times():
+    for text, after, expected in NEXT_FIRE_CASES:
+        actual = parse_rule(text).next_after(after)
+        assert actual == expected, f"{text} after {after}: expected {expected}, got {actual}"
+
+
+def test_next_after_is_strictly_increasing():
+    """连续调用 next_after 得到的触发时间严格递增"""
+    for text in ('cron */7 9-10 * * 1,3,5', 'every 45m 22:30-01:00', 'cron 0 0 1,15 * 0'):
+        rule = parse_rule(text)
+        t = datetime(2026, 10, 19)
+        for _ in range(200):
+            fire = rule.next_after(t)
+            assert fire > t, f"{text}: {fire} is not after {t}"
+            t = fire
+
+
+def test_rule_text_is_normalized():
+    for text, expected in TEXT_CASES:
+        actual = parse_rule(text).text
+        assert actual == expected, f"{text!r}: expected {expected!r}, got {actual!r}"
+        # 规范化后的文本能重新解析为相同的规则
+        assert parse_rule(actual).text == expected
+
+
+def test_invalid_rules_rejected():
+    for text in INVALID_RULES:
+        try:
+            parse_rule(text)
+        except ValueError:
+            continue
+        raise AssertionError(f"{text!r} should be rejected")
+
+
+def test_rule_that_never_fires():
+    """2 月 31 日永远不会出现，next_after 报错而不是无限循环"""
+    rule = parse_rule('cron 0 0 31 2 *')
+    try:
+        rule.next_after(datetime(2026, 10, 19))
+    except ValueError:
+        return
+    raise AssertionError("cron 0 0 31 2 * should never fire")
+
+
+if __name__ == '__main__':
+    tests = [value for name, value in sorted(globals().items()) if name.startswith('test_')]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except Exception as e:
+            failed += 1
+            print(f"❌ {test.__name__}: {e!r}")
+    print()
+    print(f"{len(tests) - failed}/{len(tests)} 通过")
+    sys.exit(1 if failed else 0)
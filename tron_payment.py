@@ -7,8 +7,10 @@ from datetime import datetime, timedelta
 from threading import Thread, Lock
 from collections import defaultdict
 import logging
-from typing import Optional, Callable, List, Dict, Any
-import json
+from typing import Optional, Callable, List, Dict, Any, Iterator
+
+from models import TronOrder, fetch_one, fetch_all, iter_rows, row_to_dict
+import exporter
 
 # 配置日志
 logging.basicConfig(
@@ -34,6 +36,58 @@ class TronPayment:
     # TRC20-USDT 合约地址
     USDT_CONTRACT = "TR7NHqjeKQxGTCi8q8ZY4pL8otSzgjLj6t"
     
+    # 统计计数器触发器
+    STATS_TRIGGERS = [
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_stats_insert AFTER INSERT ON orders
+        BEGIN
+            INSERT INTO stats_counters (name, value) VALUES ('total_orders', 1)
+                ON CONFLICT(name) DO UPDATE SET value = value + excluded.value;
+            INSERT INTO stats_counters (name, value) VALUES ('status:' || NEW.status, 1)
+                ON CONFLICT(name) DO UPDATE SET value = value + excluded.value;
+            INSERT INTO stats_counters (name, value)
+                SELECT 'total_paid_amount', NEW.amount WHERE NEW.status = 'paid'
+                ON CONFLICT(name) DO UPDATE SET value = value + excluded.value;
+            INSERT INTO stats_counters (name, value)
+                SELECT 'total_users', 1
+                WHERE NOT EXISTS (SELECT 1 FROM orders WHERE user_id = NEW.user_id AND rowid <> NEW.rowid)
+                ON CONFLICT(name) DO UPDATE SET value = value + excluded.value;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_stats_update AFTER UPDATE OF status, amount ON orders
+        WHEN OLD.status IS NOT NEW.status OR OLD.amount IS NOT NEW.amount
+        BEGIN
+            INSERT INTO stats_counters (name, value) VALUES ('status:' || OLD.status, -1)
+                ON CONFLICT(name) DO UPDATE SET value = value + excluded.value;
+            INSERT INTO stats_counters (name, value) VALUES ('status:' || NEW.status, 1)
+                ON CONFLICT(name) DO UPDATE SET value = value + excluded.value;
+            INSERT INTO stats_counters (name, value)
+                SELECT 'total_paid_amount', -OLD.amount WHERE OLD.status = 'paid'
+                ON CONFLICT(name) DO UPDATE SET value = value + excluded.value;
+            INSERT INTO stats_counters (name, value)
+                SELECT 'total_paid_amount', NEW.amount WHERE NEW.status = 'paid'
+                ON CONFLICT(name) DO UPDATE SET value = value + excluded.value;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_stats_delete AFTER DELETE ON orders
+        BEGIN
+            INSERT INTO stats_counters (name, value) VALUES ('total_orders', -1)
+                ON CONFLICT(name) DO UPDATE SET value = value + excluded.value;
+            INSERT INTO stats_counters (name, value) VALUES ('status:' || OLD.status, -1)
+                ON CONFLICT(name) DO UPDATE SET value = value + excluded.value;
+            INSERT INTO stats_counters (name, value)
+                SELECT 'total_paid_amount', -OLD.amount WHERE OLD.status = 'paid'
+                ON CONFLICT(name) DO UPDATE SET value = value + excluded.value;
+            INSERT INTO stats_counters (name, value)
+                SELECT 'total_users', -1
+                WHERE NOT EXISTS (SELECT 1 FROM orders WHERE user_id = OLD.user_id)
+                ON CONFLICT(name) DO UPDATE SET value = value + excluded.value;
+        END
+        """,
+    ]
+    
     def __init__(
         self, 
         wallet_address: str, 
@@ -116,6 +170,20 @@ class TronPayment:
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_status ON orders(status)')
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_created_at ON orders(created_at)')
             
+            # 全局统计计数器（由触发器维护）
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS stats_counters (
+                    name TEXT PRIMARY KEY,
+                    value REAL NOT NULL DEFAULT 0
+                )
+            ''')
+            for trigger_sql in self.STATS_TRIGGERS:
+                cursor.execute(trigger_sql)
+            
+            cursor.execute("SELECT 1 FROM stats_counters WHERE name='total_orders'")
+            if cursor.fetchone() is None:
+                self._rebuild_statistics(cursor)
+            
             conn.commit()
             conn.close()
     
@@ -369,22 +437,18 @@ class TronPayment:
         
         self.logger.info(f"Order {order_id} timeout")
     
-    def get_order_status(self, order_id: str) -> Optional[Dict[str, Any]]:
+    def get_order_status(self, order_id: str) -> Optional[TronOrder]:
         """
         查询订单状态
         
         Returns:
-            订单信息字典，如果不存在返回 None
+            订单记录（支持字典式访问），如果不存在返回 None
         """
         conn = self._get_db_connection()
         cursor = conn.cursor()
         try:
             cursor.execute("SELECT * FROM orders WHERE order_id=?", (order_id,))
-            row = cursor.fetchone()
-            if row:
-                columns = [desc[0] for desc in cursor.description]
-                return dict(zip(columns, row))
-            return None
+            return fetch_one(cursor, TronOrder)
         finally:
             conn.close()
     
@@ -393,7 +457,7 @@ class TronPayment:
         user_id: str, 
         status: Optional[str] = None,
         limit: int = 50
-    ) -> List[Dict[str, Any]]:
+    ) -> List[TronOrder]:
         """
         查询用户的所有订单
         
@@ -419,9 +483,7 @@ class TronPayment:
                     (user_id, limit)
                 )
             
-            rows = cursor.fetchall()
-            columns = [desc[0] for desc in cursor.description]
-            return [dict(zip(columns, row)) for row in rows]
+            return fetch_all(cursor, TronOrder)
         finally:
             conn.close()
     
@@ -431,7 +493,7 @@ class TronPayment:
         start_date: Optional[datetime] = None,
         end_date: Optional[datetime] = None,
         limit: int = 100
-    ) -> List[Dict[str, Any]]:
+    ) -> List[TronOrder]:
         """
         查询所有订单（管理功能）
         
@@ -444,6 +506,26 @@ class TronPayment:
         Returns:
             订单列表
         """
+        return list(self.iter_orders(status, start_date, end_date, limit))
+    
+    def iter_orders(
+        self,
+        status: Optional[str] = None,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None,
+        limit: Optional[int] = None,
+        chunk_size: int = 500
+    ) -> Iterator[TronOrder]:
+        """
+        惰性遍历订单（批量读取，适合导出等大数据量场景）
+        
+        Args:
+            status: 状态筛选
+            start_date: 开始日期
+            end_date: 结束日期
+            limit: 返回数量限制，None 表示不限制
+            chunk_size: 每批读取的行数
+        """
         conn = self._get_db_connection()
         cursor = conn.cursor()
         try:
@@ -462,13 +544,13 @@ class TronPayment:
                 query += " AND created_at <= ?"
                 params.append(end_date)
             
-            query += " ORDER BY created_at DESC LIMIT ?"
-            params.append(limit)
+            query += " ORDER BY created_at DESC"
+            if limit is not None:
+                query += " LIMIT ?"
+                params.append(limit)
             
             cursor.execute(query, params)
-            rows = cursor.fetchall()
-            columns = [desc[0] for desc in cursor.description]
-            return [dict(zip(columns, row)) for row in rows]
+            yield from iter_rows(cursor, TronOrder, chunk_size)
         finally:
             conn.close()
     
@@ -481,11 +563,25 @@ class TronPayment:
         
         Returns:
             统计信息字典
+        
+        全局统计直接读取触发器维护的计数器；单用户统计走 user_id 索引。
         """
         conn = self._get_db_connection()
         cursor = conn.cursor()
         try:
-            if user_id:
+            if not user_id:
+                cursor.execute("SELECT name, value FROM stats_counters")
+                counters = dict(cursor.fetchall())
+                return {
+                    'total_orders': int(counters.get('total_orders', 0)),
+                    'paid_orders': int(counters.get('status:paid', 0)),
+                    'total_paid_amount': counters.get('total_paid_amount', 0),
+                    'pending_orders': int(counters.get('status:pending', 0)),
+                    'timeout_orders': int(counters.get('status:timeout', 0)),
+                    'cancelled_orders': int(counters.get('status:cancelled', 0)),
+                    'total_users': int(counters.get('total_users', 0))
+                }
+            else:
                 cursor.execute("""
                     SELECT 
                         COUNT(*) as total_orders,
@@ -496,25 +592,36 @@ class TronPayment:
                         SUM(CASE WHEN status='cancelled' THEN 1 ELSE 0 END) as cancelled_orders
                     FROM orders WHERE user_id=?
                 """, (user_id,))
-            else:
-                cursor.execute("""
-                    SELECT 
-                        COUNT(*) as total_orders,
-                        SUM(CASE WHEN status='paid' THEN 1 ELSE 0 END) as paid_orders,
-                        SUM(CASE WHEN status='paid' THEN amount ELSE 0 END) as total_paid_amount,
-                        SUM(CASE WHEN status='pending' THEN 1 ELSE 0 END) as pending_orders,
-                        SUM(CASE WHEN status='timeout' THEN 1 ELSE 0 END) as timeout_orders,
-                        SUM(CASE WHEN status='cancelled' THEN 1 ELSE 0 END) as cancelled_orders,
-                        COUNT(DISTINCT user_id) as total_users
-                    FROM orders
-                """)
-            
-            row = cursor.fetchone()
-            columns = [desc[0] for desc in cursor.description]
-            return dict(zip(columns, row))
+                return row_to_dict(cursor, cursor.fetchone())
         finally:
             conn.close()
     
+    def rebuild_statistics(self):
+        """根据现有订单重建统计计数器（用于修正计数漂移）"""
+        with self.db_lock:
+            conn = self._get_db_connection()
+            try:
+                self._rebuild_statistics(conn.cursor())
+                conn.commit()
+            finally:
+                conn.close()
+        self.logger.info("Statistics counters rebuilt")
+    
+    def _rebuild_statistics(self, cursor: sqlite3.Cursor):
+        cursor.execute("DELETE FROM stats_counters")
+        cursor.execute("""
+            INSERT INTO stats_counters (name, value)
+            SELECT 'total_orders', COUNT(*) FROM orders
+            UNION ALL
+            SELECT 'total_users', COUNT(DISTINCT user_id) FROM orders
+            UNION ALL
+            SELECT 'total_paid_amount', COALESCE(SUM(amount), 0) FROM orders WHERE status='paid'
+        """)
+        cursor.execute("""
+            INSERT INTO stats_counters (name, value)
+            SELECT 'status:' || status, COUNT(*) FROM orders GROUP BY status
+        """)
+    
     def cancel_order(self, order_id: str, reason: str = 'manual') -> bool:
         """
         取消订单
@@ -640,7 +747,7 @@ class TronPayment:
         
         return success
     
-    def get_pending_refunds(self) -> List[Dict[str, Any]]:
+    def get_pending_refunds(self) -> List[TronOrder]:
         """
         获取待处理的退款请求（管理功能）
         
@@ -653,9 +760,7 @@ class TronPayment:
             cursor.execute(
                 "SELECT * FROM orders WHERE refund_status='pending' ORDER BY created_at DESC"
             )
-            rows = cursor.fetchall()
-            columns = [desc[0] for desc in cursor.description]
-            return [dict(zip(columns, row)) for row in rows]
+            return fetch_all(cursor, TronOrder)
         finally:
             conn.close()
     
@@ -719,21 +824,27 @@ class TronPayment:
         self.logger.info(f"Cleaned up {deleted} old orders")
         return deleted
     
-    def export_orders(self, filepath: str, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None):
+    def export_orders(self, filepath: str, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None,
+                      status: Optional[str] = None, fmt: str = 'json', watermark_path: Optional[str] = None):
         """
-        导出订单到 JSON 文件
+        流式导出订单（不限条数，内存占用恒定）
         
         Args:
             filepath: 导出文件路径
             start_date: 开始日期
             end_date: 结束日期
+            status: 状态筛选
+            fmt: 导出格式（json / jsonl / csv / columnar）
+            watermark_path: 增量导出水位文件，指定后只导出上次之后新增的订单（不含已导出订单的状态变化）
+            
+        Returns:
+            {'count': 导出条数, 'last_rowid': 最后的 rowid, 'path': 文件}
         """
-        orders = self.get_all_orders(start_date=start_date, end_date=end_date, limit=10000)
-        
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(orders, f, indent=2, ensure_ascii=False, default=str)
-        
-        self.logger.info(f"Exported {len(orders)} orders to {filepath}")
+        return exporter.export_orders(
+            self._get_db_connection, filepath, fmt,
+            status=status, start_date=start_date, end_date=end_date,
+            watermark_path=watermark_path
+        )
     
     def close(self):
         """关闭支付系统，清理资源"""